@@ -0,0 +1,55 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from benchmarks.synthetic import WorkloadSpec, write_synthetic_questionnaire
+
+# results are stored here (one json file per run), compare runs with "pytest-benchmark compare"
+STORAGE_DIR = Path(__file__).parent / '.benchmarks'
+
+
+def pytest_addoption(parser):
+    parser.addoption('--max-scale', type=int, default=1000,
+                     help='largest workload scale (number of pages) to benchmark, default: 1000')
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # (before the benchmark session of the plugin reads the options)
+    if importlib.util.find_spec('pytest_benchmark') is None:
+        return
+    # store every run, unless a storage option is given on the command line
+    if not config.option.benchmark_autosave and not config.option.benchmark_save:
+        from pytest_benchmark.utils import get_tag
+        config.option.benchmark_autosave = get_tag()
+    if config.option.benchmark_storage == 'file://./.benchmarks':
+        config.option.benchmark_storage = STORAGE_DIR.as_uri()
+
+
+def pytest_collection_modifyitems(config, items):
+    max_scale = config.getoption('--max-scale')
+    skip = pytest.mark.skip(reason=f'scale larger than --max-scale={max_scale}')
+    for item in items:
+        scale = getattr(item, 'callspec', None) and item.callspec.params.get('scale')
+        if scale is not None and scale > max_scale:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope='session')
+def workload_dir(tmp_path_factory) -> Path:
+    return tmp_path_factory.mktemp('workloads')
+
+
+@pytest.fixture(scope='session')
+def workload_files(workload_dir):
+    # questionnaire files are generated once per scale
+    files = {}
+
+    def get(scale: int) -> Path:
+        if scale not in files:
+            files[scale] = write_synthetic_questionnaire(workload_dir / f'questionnaire_{scale}.xml',
+                                                         WorkloadSpec().scaled(scale))
+        return files[scale]
+
+    return get
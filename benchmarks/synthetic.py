@@ -0,0 +1,195 @@
+"""
+Synthetic Zofar questionnaires of parameterized size, for benchmarks:
+
+    python -m benchmarks.synthetic --pages 1000 -o questionnaire_1000.xml
+"""
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from lxml import etree
+
+from qrt.util.qmlutil import ZOFAR_NS_URI, DISPLAY_NS_URI
+
+NSMAP = {'zofar': ZOFAR_NS_URI, 'display': DISPLAY_NS_URI}
+
+
+def z(tag: str) -> str:
+    return f'{{{ZOFAR_NS_URI}}}{tag}'
+
+
+@dataclass
+class WorkloadSpec:
+    pages: int = 1
+    # answer options and items of the matrix question on each page
+    answer_options: int = 5
+    matrix_items: int = 10
+    # conditional transitions per page (to later pages), in addition to the transition to the next page
+    transitions: int = 3
+    # variable triggers per page
+    triggers: int = 2
+    # every n-th page has an action trigger that loads, saves and resets episode JSON data, and a redirect trigger
+    episode_every: int = 5
+    # pages per uid prefix ("module"), e.g. A01 ... A20, B01 ...
+    module_size: int = 20
+
+    def scaled(self, factor: int) -> 'WorkloadSpec':
+        return WorkloadSpec(pages=self.pages * factor, answer_options=self.answer_options,
+                            matrix_items=self.matrix_items, transitions=self.transitions, triggers=self.triggers,
+                            episode_every=self.episode_every, module_size=self.module_size)
+
+
+def page_uids(spec: WorkloadSpec) -> List[str]:
+    # first and last page are named like in Zofar questionnaires
+    uids = []
+    for i in range(spec.pages):
+        module, n = divmod(i, spec.module_size)
+        prefix = ''
+        module += 1
+        while module > 0:
+            module, rest = divmod(module - 1, 26)
+            prefix = chr(ord('A') + rest) + prefix
+        uids.append(f'{prefix}{n + 1:02}')
+    if uids:
+        uids[0] = 'index'
+    if len(uids) > 1:
+        uids[-1] = 'end'
+    return uids
+
+
+def _add_page(root: etree._Element, variables: etree._Element, spec: WorkloadSpec, index: int,
+              uids: List[str]) -> None:
+    # (elements are created within the tree, so that the zofar prefix of the root element is used)
+    uid = uids[index]
+    page = etree.SubElement(root, z('page'), uid=uid)
+    header = etree.SubElement(page, z('header'))
+    etree.SubElement(header, z('title'), uid='t1').text = f'Page {uid}'
+    body = etree.SubElement(page, z('body'), uid='b')
+
+    def declare(name: str, var_type: str) -> str:
+        etree.SubElement(variables, z('variable'), name=name, type=var_type)
+        return name
+
+    # single choice question
+    sc_var = declare(f'{uid}_sc', 'singleChoiceAnswerOption')
+    sc = etree.SubElement(body, z('questionSingleChoice'), uid='qsc', block='true')
+    etree.SubElement(etree.SubElement(sc, z('header')), z('question'), uid='q').text = f'Question on {uid}?'
+    rd = etree.SubElement(sc, z('responseDomain'), uid='rd', variable=sc_var)
+    for k in range(spec.answer_options):
+        etree.SubElement(rd, z('answerOption'), uid=f'ao{k + 1}', value=str(k + 1), label=f'option {k + 1}')
+
+    # matrix question, shown depending on the single choice answer
+    mqsc = etree.SubElement(body, z('matrixQuestionSingleChoice'), uid='mqsc', block='true',
+                            visible=f'!zofar.isMissing({sc_var}) and zofar.asNumber({sc_var}) gt 1')
+    etree.SubElement(etree.SubElement(mqsc, z('header')), z('question'), uid='q').text = 'Matrix question'
+    matrix_rd = etree.SubElement(mqsc, z('responseDomain'), uid='rd', noResponseOptions=str(spec.answer_options))
+    titles = etree.SubElement(matrix_rd, z('header'))
+    for k in range(spec.answer_options):
+        etree.SubElement(titles, z('title'), uid=f'ti{k + 1}').text = f'option {k + 1}'
+    etree.SubElement(matrix_rd, z('missingHeader'))
+    for j in range(spec.matrix_items):
+        item_var = declare(f'{uid}_it{j + 1}', 'singleChoiceAnswerOption')
+        item = etree.SubElement(matrix_rd, z('item'), uid=f'it{j + 1}')
+        etree.SubElement(etree.SubElement(item, z('header')), z('question'), uid='q').text = f'item {j + 1}'
+        item_rd = etree.SubElement(item, z('responseDomain'), uid='rd', variable=item_var)
+        for k in range(spec.answer_options):
+            etree.SubElement(item_rd, z('answerOption'), uid=f'ao{k + 1}', value=str(k + 1),
+                             label=f'option {k + 1}')
+
+    # open question with an attached text
+    open_var = declare(f'{uid}_open', 'string')
+    qo = etree.SubElement(body, z('questionOpen'), uid='qo', variable=open_var, size='40',
+                          visible=f'zofar.asNumber({sc_var}) == {spec.answer_options}')
+    etree.SubElement(etree.SubElement(qo, z('header')), z('question'), uid='q').text = \
+        f'#{{zofar.valueOf({sc_var})}} - please specify'
+
+    triggers = etree.SubElement(page, z('triggers'))
+    for k in range(spec.triggers):
+        flag = declare(f'{uid}_flag{k + 1}', 'boolean')
+        etree.SubElement(triggers, z('variable'), variable=flag, value='true', direction='same', onExit='false',
+                         condition=f'!zofar.isMissing({sc_var})')
+    if spec.episode_every and index % spec.episode_every == 0:
+        load = etree.SubElement(triggers, z('action'), command='zofar.nothing()', onExit='false')
+        etree.SubElement(load, z('scriptItem'), value=f"toLoad.add('{uid}_ep')")
+        etree.SubElement(load, z('scriptItem'), value=f"toReset.add('{uid}_ep')")
+        save = etree.SubElement(triggers, z('action'), command='zofar.nothing()', onExit='true')
+        etree.SubElement(save, z('scriptItem'), value=f"toPersist.put('{uid}_ep',{uid}_sc.value)")
+        if index + 2 < len(uids):
+            etree.SubElement(triggers, z('action'), command=f"navigatorBean.redirect('{uids[index + 2]}')",
+                             onExit='false', condition=f'zofar.asNumber({sc_var}) == 1')
+
+    transitions = etree.SubElement(page, z('transitions'))
+    later = uids[index + 2:index + 2 + spec.transitions]
+    for k, target in enumerate(later):
+        etree.SubElement(transitions, z('transition'), target=target,
+                         condition=f'zofar.asNumber({sc_var}) == {k + 2} and {uid}_flag1.value'
+                         if spec.triggers else f'zofar.asNumber({sc_var}) == {k + 2}')
+    if index + 1 < len(uids):
+        etree.SubElement(transitions, z('transition'), target=uids[index + 1])
+
+
+def synthetic_questionnaire(spec: Optional[WorkloadSpec] = None) -> etree._Element:
+    """
+    :return: root element of a questionnaire with spec.pages pages; each page has a single choice question,
+     a matrix question, an open question, variable (and every few pages episode/redirect) triggers and conditional
+     transitions to later pages
+    """
+    spec = spec if spec is not None else WorkloadSpec()
+    uids = page_uids(spec)
+    root = etree.Element(z('questionnaire'), nsmap=NSMAP, language='de')
+    etree.SubElement(root, z('name')).text = f'synthetic_{spec.pages}'
+    etree.SubElement(root, z('description'))
+    variables = etree.SubElement(root, z('variables'))
+    for i in range(spec.pages):
+        _add_page(root, variables, spec, i, uids)
+    return root
+
+
+def write_synthetic_questionnaire(out_file: Path, spec: Optional[WorkloadSpec] = None) -> Path:
+    etree.ElementTree(synthetic_questionnaire(spec)).write(str(out_file), encoding='UTF-8', xml_declaration=True,
+                                                          pretty_print=True)
+    return out_file
+
+
+def synthetic_pv(questions: int, per_page: int = 8) -> str:
+    """
+    :return: TOML programming template with the given number of matrix questions (4 items each), per_page
+     questions per page
+    """
+    chunks = ['survey = "synthetic"\n']
+    for i in range(questions):
+        chunks.append(f"""
+[Q{i:05}]
+page = "P{i // per_page:04}"
+type = "matrixQuestionSingleChoice"
+visible = ""
+headers = [{{ uid = "q1", type = "question", text = "Question {i}" }}]
+aos = [
+    {{ uid = "ao1", value = "1", label = "first" }},
+    {{ uid = "ao2", value = "2", label = "second" }},
+    {{ uid = "ao3", value = "3", label = "third" }}
+]
+items = [
+    {{ uid = "it1", variable = "v{i}_1a", text = "item 1" }},
+    {{ uid = "it2", variable = "v{i}_1b", text = "item 2" }},
+    {{ uid = "it3", variable = "v{i}_1c", text = "item 3" }},
+    {{ uid = "it4", variable = "v{i}_2", text = "item 4" }}
+]
+""")
+    return ''.join(chunks)
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.synthetic')
+    parser.add_argument('--pages', type=int, default=WorkloadSpec.pages)
+    parser.add_argument('--items', type=int, default=WorkloadSpec.matrix_items)
+    parser.add_argument('--transitions', type=int, default=WorkloadSpec.transitions)
+    parser.add_argument('-o', '--output', type=Path, required=True)
+    parsed = parser.parse_args(args)
+    write_synthetic_questionnaire(parsed.output, WorkloadSpec(pages=parsed.pages, matrix_items=parsed.items,
+                                                              transitions=parsed.transitions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmarks of the analysis pipeline on synthetic questionnaires with 10, 100 and 1000 pages (see synthetic.py):
+
+    pip install -r requirements-dev.txt
+    python -m pytest benchmarks [--max-scale 100]
+
+Every run is saved in benchmarks/.benchmarks; compare runs with
+
+    pytest-benchmark --storage file://benchmarks/.benchmarks compare --group-by=func
+"""
+import importlib.util
+import io
+from functools import lru_cache
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from benchmarks.synthetic import synthetic_pv
+from qrt.util import module_graph
+from qrt.util.graph import digraph, make_flowchart
+from qrt.util.qml import read_xml
+from qrt.util.qmlgen import gen_mqsc
+from qrt.util.questionnaire import Questionnaire
+from qrt.util.tomlutil import compile_pv
+from qrt.util.util import qml_details
+
+SCALES = [10, 100, 1000]
+# timed rounds per scale (the large workloads take seconds per round)
+ROUNDS = {10: 20, 100: 5, 1000: 1}
+
+EDGE_COLORS = {i: module_graph.color_str_to_hex(color) for i, color in
+               enumerate(['black', 'blue', 'pink', 'green', 'orange', 'cyan', 'red', 'lime', 'yellow'])}
+
+
+def run(benchmark, scale: int, function, *args, **kwargs):
+    return benchmark.pedantic(function, args=args, kwargs=kwargs, rounds=ROUNDS[scale], iterations=1,
+                              warmup_rounds=1 if scale < 1000 else 0)
+
+
+@pytest.fixture(scope='module')
+def questionnaires(workload_files):
+    # parsed once per scale, the benchmarks below only read the questionnaire
+    @lru_cache(maxsize=None)
+    def get(scale: int) -> Questionnaire:
+        return read_xml(workload_files(scale))
+
+    return get
+
+
+@pytest.mark.parametrize('scale', SCALES)
+def test_read_xml(benchmark, workload_files, scale):
+    q = run(benchmark, scale, read_xml, workload_files(scale))
+    assert len(q.pages) == scale
+
+
+@pytest.mark.parametrize('scale', SCALES)
+def test_qml_details(benchmark, questionnaires, scale):
+    q = questionnaires(scale)
+    details = run(benchmark, scale, qml_details, q, 'questionnaire.xml')
+    assert details['filename']['data'] == 'questionnaire.xml'
+
+
+@pytest.mark.parametrize('scale', SCALES)
+def test_digraph(benchmark, questionnaires, scale):
+    g = run(benchmark, scale, digraph, questionnaires(scale))
+    assert g.number_of_nodes() >= scale
+
+
+@pytest.mark.parametrize('engine', ['layered', 'auto'])
+@pytest.mark.parametrize('scale', SCALES)
+def test_make_flowchart(benchmark, questionnaires, workload_dir: Path, scale, engine):
+    if engine != 'layered' and importlib.util.find_spec('pygraphviz') is None:
+        pytest.skip('pygraphviz is not installed')
+    out_file = workload_dir / f'flowchart_{scale}_{engine}.svg'
+    assert run(benchmark, scale, make_flowchart, questionnaires(scale), out_file, engine=engine)
+
+
+@pytest.mark.parametrize('scale', SCALES)
+def test_module_graph(benchmark, questionnaires, scale):
+    g = run(benchmark, scale, module_graph.create_digraph, questionnaires(scale), EDGE_COLORS)
+    assert 'index' in g
+
+
+@pytest.mark.parametrize('scale', SCALES)
+def test_gen_mqsc(benchmark, scale):
+    # matrix question with scale items
+    spec = {'q_type': 'mqsc', 'q_uid': 'mqsc', 'q_visible': 'true',
+            'headers': {1: {'type': 'question', 'uid': 'q', 'text': 'Matrix question'}},
+            'aos': {k: {'uid': f'ao{k}', 'value': str(k), 'label': f'option {k}'} for k in range(1, 6)},
+            'items': {j: {'uid': f'it{j}', 'variable': f'it{j}', 'text': f'item {j}'} for j in range(1, scale + 1)}}
+    xml_str = run(benchmark, scale, gen_mqsc, spec)
+    assert xml_str.count('<zofar:item ') == scale
+
+
+@pytest.mark.parametrize('scale', SCALES)
+def test_compile_pv(benchmark, scale):
+    # TOML programming template with 8 matrix questions per page
+    pv_str = synthetic_pv(questions=scale * 8)
+
+    def compile_to_bytes() -> bytes:
+        out = io.BytesIO()
+        compile_pv(pv_str, out)
+        return out.getvalue()
+
+    xml_bytes = run(benchmark, scale, compile_to_bytes)
+    assert xml_bytes.count(b'<zofar:page ') == scale
@@ -0,0 +1,64 @@
+import gzip
+import hashlib
+import importlib.util
+from pathlib import Path
+from typing import Container, List, Optional, Tuple, Union
+
+from qform.registry import write_atomic
+
+# brotli is optional; without it only gzip variants are written
+BROTLI_AVAILABLE = importlib.util.find_spec('brotli') is not None
+
+# content encoding -> file suffix of the precompressed variant, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def available_encodings() -> List[Tuple[str, str]]:
+    return [(enc, suffix) for enc, suffix in ENCODINGS if enc != 'br' or BROTLI_AVAILABLE]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9)
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data)
+    raise ValueError(f'unknown encoding: "{encoding}"')
+
+
+def content_etag(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    # each content encoding of a resource needs its own strong ETag
+    return etag if encoding is None else f'{etag}-{encoding}'
+
+
+def precompress_artifact(path: Union[str, Path]) -> str:
+    """
+    Write compressed variants (".gz" and, if available, ".br") next to the given file.
+
+    :param path: generated artifact (svg, json, ...)
+    :return: content hash of the uncompressed file, to be used as ETag
+    """
+    path = Path(path)
+    data = path.read_bytes()
+    for encoding, suffix in available_encodings():
+        encoded_path = path.with_name(path.name + suffix)
+        write_atomic(encoded_path, compress(data, encoding))
+    return content_etag(data)
+
+
+def select_encoding(path: Union[str, Path], accepted: Container[str]) -> Tuple[Path, Optional[str]]:
+    """
+    :param path: uncompressed artifact
+    :param accepted: content encodings accepted by the client
+    :return: file to be sent and its content encoding (None for the uncompressed file)
+    """
+    path = Path(path)
+    for encoding, suffix in available_encodings():
+        encoded_path = path.with_name(path.name + suffix)
+        if encoding in accepted and encoded_path.exists():
+            return encoded_path, encoding
+    return path, None
@@ -0,0 +1,69 @@
+"""
+gunicorn configuration for running qform with several worker processes:
+
+    gunicorn -c qform/gunicorn_conf.py qform.qform:app
+
+The app and the heavy modules (lxml, networkx, pygraphviz, ...) are imported once in the master process before
+the workers are forked. Workers are recycled after WEB_MAX_REQUESTS requests (with jitter) or as soon as their
+resident memory exceeds WEB_WORKER_MAX_RSS_MB; running requests are finished first.
+"""
+import importlib
+import os
+import resource
+import shutil
+import tempfile
+
+bind = f'0.0.0.0:{os.getenv("SERVICE_PORT", "8080")}'
+workers = int(os.getenv('WEB_WORKERS', os.cpu_count() or 2))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 4))
+preload_app = True
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 500))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 50))
+# parsing and layout of large questionnaires may take a while
+timeout = int(os.getenv('WEB_TIMEOUT', 300))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 60))
+
+WORKER_MAX_RSS = int(os.getenv('WEB_WORKER_MAX_RSS_MB', 1024)) * 2 ** 20
+
+PRELOAD_MODULES = ['lxml.etree', 'networkx', 'networkx.drawing.nx_agraph', 'pygraphviz', 'qrt.util.qml',
+                   'qrt.util.graph', 'qrt.util.util', 'qrt.util.qmlgen']
+
+# uploaded files and the file registry have to be shared by all workers (and must not be removed when a
+#  worker exits), so the upload directory is created here, once, and removed when the master exits
+_CREATED_UPLOAD_DIR = None
+if not os.getenv('UPLOAD_DIR'):
+    _CREATED_UPLOAD_DIR = tempfile.mkdtemp(prefix='qform_')
+    os.environ['UPLOAD_DIR'] = _CREATED_UPLOAD_DIR
+
+
+def current_rss() -> int:
+    """
+    :return: resident set size of the current process in bytes (peak RSS where /proc is not available)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def on_starting(server):
+    for module in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as err:
+            server.log.info(f'not preloaded: {module} ({err})')
+
+
+def post_request(worker, req, environ, resp):
+    rss = current_rss()
+    if rss > WORKER_MAX_RSS:
+        worker.log.info(f'worker {worker.pid}: rss {rss // 2 ** 20} MB > {WORKER_MAX_RSS // 2 ** 20} MB, restarting')
+        # stop accepting requests; the arbiter replaces the worker once running requests are finished
+        worker.alive = False
+
+
+def on_exit(server):
+    if _CREATED_UPLOAD_DIR is not None:
+        shutil.rmtree(_CREATED_UPLOAD_DIR, ignore_errors=True)
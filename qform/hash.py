@@ -1,10 +1,156 @@
+import argparse
+import getpass
 import os
 import base64
+import hmac
 import math
 import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
 
+# login verification runs on its own small thread pool (hashlib.scrypt releases the GIL); at most
+#  VERIFY_WORKERS + VERIFY_QUEUE verifications are accepted at a time, further logins are rejected immediately
+VERIFY_WORKERS = int(os.getenv('LOGIN_VERIFY_WORKERS', 2))
+VERIFY_QUEUE = int(os.getenv('LOGIN_VERIFY_QUEUE', 8))
+VERIFY_TIMEOUT = float(os.getenv('LOGIN_VERIFY_TIMEOUT', 30))
 
-def hash_salt_password(password, n: int = 16384, r: int = 16, p: int = 16) -> str:
+_VERIFY_EXECUTOR = None
+
+
+class VerifierBusy(Exception):
+    pass
+
+
+class VerifySlots:
+    """
+    Number of tasks running or waiting on the verification executor, limited to size.
+    """
+
+    def __init__(self, size: int):
+        self.lock = threading.Lock()
+        self.size = size
+        self.taken = 0
+
+    def acquire(self) -> bool:
+        with self.lock:
+            if self.taken >= self.size:
+                return False
+            self.taken += 1
+            return True
+
+    def release(self, _: Optional[Future] = None) -> None:
+        with self.lock:
+            self.taken -= 1
+
+    def pending(self) -> int:
+        with self.lock:
+            return self.taken
+
+
+_VERIFY_SLOTS = VerifySlots(VERIFY_WORKERS + VERIFY_QUEUE)
+
+
+@dataclass(frozen=True)
+class HashParams:
+    version: str
+    n: int
+    r: int
+    p: int
+    salt: bytes
+    hash: bytes
+
+
+@dataclass(frozen=True)
+class CostProfile:
+    name: str
+    n: int
+    r: int
+    p: int
+
+    def memory(self) -> int:
+        # approximate memory needed by scrypt, in bytes (the p lanes are computed one after another)
+        return 128 * self.n * self.r
+
+    def spec(self) -> str:
+        return f'{self.n},{self.r},{self.p}'
+
+
+# named scrypt cost profiles; the profile used for new hashes is set by FLASK_PW_PROFILE (a name from this dict or
+#  "n,r,p", e.g. as suggested by "python -m qform.hash benchmark"). Stored hashes with other parameters are replaced
+#  on the next successful login.
+COST_PROFILES = {
+    'legacy': CostProfile('legacy', n=2 ** 14, r=16, p=16),
+    'interactive': CostProfile('interactive', n=2 ** 14, r=8, p=1),
+    'moderate': CostProfile('moderate', n=2 ** 15, r=8, p=2),
+    'strong': CostProfile('strong', n=2 ** 17, r=8, p=1),
+}
+DEFAULT_PROFILE = 'legacy'
+
+
+def cost_profile(spec: Optional[str] = None) -> CostProfile:
+    """
+    :param spec: profile name or "n,r,p"; defaults to FLASK_PW_PROFILE or DEFAULT_PROFILE
+    """
+    if spec is None:
+        spec = os.getenv('FLASK_PW_PROFILE', DEFAULT_PROFILE).strip() or DEFAULT_PROFILE
+    if spec in COST_PROFILES:
+        return COST_PROFILES[spec]
+    try:
+        n, r, p = [int(x) for x in spec.split(',')]
+    except ValueError:
+        raise ValueError(f'unknown scrypt cost profile: "{spec}"; expected one of {list(COST_PROFILES)} or "n,r,p"')
+    if n < 2 or not math.log2(n).is_integer() or r < 1 or p < 1 or r > 255 or p > 255:
+        raise ValueError(f'invalid scrypt parameters: "{spec}"')
+    return CostProfile(spec, n=n, r=r, p=p)
+
+
+class VerificationStats:
+    """
+    Latency of password verifications (queue wait + scrypt) and number of rejected attempts.
+    """
+
+    def __init__(self, window: int = 100):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.recent.append(seconds)
+
+    def record_rejected(self) -> None:
+        with self.lock:
+            self.rejected += 1
+
+    def summary(self) -> Dict[str, Union[int, float, None]]:
+        with self.lock:
+            recent = sorted(self.recent)
+            return {'count': self.count,
+                    'rejected': self.rejected,
+                    'mean_seconds': self.total_seconds / self.count if self.count else None,
+                    'max_seconds': self.max_seconds if self.count else None,
+                    'p50_seconds': recent[len(recent) // 2] if recent else None,
+                    'p95_seconds': recent[min(int(len(recent) * 0.95), len(recent) - 1)] if recent else None}
+
+
+VERIFICATION_STATS = VerificationStats()
+
+
+def hash_salt_password(password, n: int = 16384, r: int = 16, p: int = 16,
+                       profile: Optional[CostProfile] = None) -> str:
+    if profile is not None:
+        n, r, p = profile.n, profile.r, profile.p
     version = "s0"
     salt = base64.b64encode(os.urandom(16))
     try:
@@ -19,22 +165,167 @@ def hash_salt_password(password, n: int = 16384, r: int = 16, p: int = 16) -> st
     return '$' + '$'.join((version, params_str, base64.b64encode(salt).decode(), passwd_hash_str.decode()))
 
 
-def verify_password(password: str, password_check: str) -> bool:
+@lru_cache(maxsize=16)
+def parse_hash(password_check: str) -> HashParams:
+    """
+    :param password_check: stored hash, as created by hash_salt_password
+    :return: scrypt parameters, salt and hash (cached per hash string)
+    """
     parts = password_check.split("$")
     allowed_versions = ['s0']
+    if len(parts) != 5 or parts[1] not in allowed_versions:
+        raise ValueError(f'wrong version! found: {parts[1] if len(parts) > 1 else None}; '
+                         f'but should be one of: {allowed_versions}')
     try:
-        assert parts[1] in allowed_versions
-    except AssertionError:
-        raise AssertionError(f'wrong version! found: {parts[1]}; but should be one of: {allowed_versions}')
-    params = int(parts[2], 16)
+        params = int(parts[2], 16)
+        salt = base64.b64decode(parts[3])
+        decoded_hash = base64.b64decode(parts[4])
+    except ValueError:
+        raise ValueError('malformed password hash')
     n = int(math.pow(2.0, float((params >> 16 & 65535))))
     r = int(params >> 8 & 255)
     p = int(params & 255)
-    salt = base64.b64decode(parts[3])
-    decoded_hash = base64.b64decode(parts[4])
-    result = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=32, maxmem=2 ** 30)
-    return decoded_hash == result
+    return HashParams(version=parts[1], n=n, r=r, p=p, salt=salt, hash=decoded_hash)
+
+
+def verify_password(password: str, password_check: str) -> bool:
+    params = parse_hash(password_check)
+    result = hashlib.scrypt(password.encode(), salt=params.salt, n=params.n, r=params.r, p=params.p, dklen=32,
+                            maxmem=2 ** 30)
+    return hmac.compare_digest(params.hash, result)
+
+
+def needs_rehash(password_check: str, profile: Optional[CostProfile] = None) -> bool:
+    """
+    :return: True if the stored hash was created with other parameters than the (current) cost profile
+    """
+    params = parse_hash(password_check)
+    profile = profile if profile is not None else cost_profile()
+    return (params.n, params.r, params.p) != (profile.n, profile.r, profile.p)
+
+
+def rehash_if_needed(password: str, password_check: str, profile: Optional[CostProfile] = None) -> Optional[str]:
+    """
+    To be called after a successful verification: hashes the password with the current cost profile (on the
+    verification executor, within its bound) if the stored hash is outdated.
+
+    :return: new hash, or None if the stored hash is up to date
+    :raises VerifierBusy: if the executor and its queue are full or hashing timed out
+    """
+    profile = profile if profile is not None else cost_profile()
+    if not needs_rehash(password_check, profile):
+        return None
+    return run_offloaded(hash_salt_password, password, profile=profile)
+
+
+def scrypt_seconds(n: int, r: int, p: int, repeat: int = 3) -> float:
+    # best of repeat runs
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hashlib.scrypt(b'benchmark', salt=os.urandom(16), n=n, r=r, p=p, dklen=32, maxmem=2 ** 30)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark(target_ms: float, max_mem_mb: int = 64, r: int = 8,
+              repeat: int = 3) -> Tuple[CostProfile, float, List[Tuple[int, int, float]]]:
+    """
+    Find scrypt parameters for this host: the largest n (power of 2, limited by max_mem_mb) whose verification
+    takes at most target_ms, then the largest p that keeps within target_ms.
+
+    :return: suggested profile, its measured time in ms and all measurements (n, p, ms)
+    """
+    measurements = []
+    n, p = 2 ** 10, 1
+    best_ms = scrypt_seconds(n, r, p, repeat) * 1000
+    measurements.append((n, p, best_ms))
+    while 128 * (n * 2) * r <= max_mem_mb * 2 ** 20:
+        ms = scrypt_seconds(n * 2, r, p, repeat) * 1000
+        measurements.append((n * 2, p, ms))
+        if ms > target_ms:
+            break
+        n, best_ms = n * 2, ms
+    while p < 255:
+        # p runs sequentially in OpenSSL: the time grows linearly
+        ms = scrypt_seconds(n, r, p + 1, repeat) * 1000
+        measurements.append((n, p + 1, ms))
+        if ms > target_ms:
+            break
+        p, best_ms = p + 1, ms
+    return CostProfile(f'{n},{r},{p}', n=n, r=r, p=p), best_ms, measurements
+
+
+def verify_executor() -> ThreadPoolExecutor:
+    global _VERIFY_EXECUTOR
+
+    if _VERIFY_EXECUTOR is None:
+        _VERIFY_EXECUTOR = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='verify_password')
+
+    return _VERIFY_EXECUTOR
+
+
+def pending_verifications() -> int:
+    # verifications running or waiting for a worker of the verification executor
+    return _VERIFY_SLOTS.pending()
+
+
+def run_offloaded(func, *args, timeout: Optional[float] = VERIFY_TIMEOUT, **kwargs):
+    """
+    Run func on the verification executor if a slot is free and wait for its result.
+
+    :raises VerifierBusy: if the executor and its queue are full or the result is not ready within timeout (the
+     task keeps its slot until it is done)
+    """
+    if not _VERIFY_SLOTS.acquire():
+        VERIFICATION_STATS.record_rejected()
+        raise VerifierBusy('too many login attempts at the moment, please try again later')
+    try:
+        future = verify_executor().submit(func, *args, **kwargs)
+    except BaseException:
+        _VERIFY_SLOTS.release()
+        raise
+    future.add_done_callback(_VERIFY_SLOTS.release)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        VERIFICATION_STATS.record_rejected()
+        raise VerifierBusy('login verification timed out, please try again later')
+
+
+def verify_password_offloaded(password: str, password_check: str, timeout: Optional[float] = VERIFY_TIMEOUT) -> bool:
+    """
+    Verify the password on the bounded verification executor, so that request threads are not busy with scrypt.
+
+    :raises VerifierBusy: if the executor and its queue are full or the verification timed out
+    """
+    # raises ValueError for malformed hashes before a slot is taken
+    parse_hash(password_check)
+    start = time.perf_counter()
+    result = run_offloaded(verify_password, password, password_check, timeout=timeout)
+    VERIFICATION_STATS.record(time.perf_counter() - start)
+    return result
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m qform.hash')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark', help='suggest scrypt parameters for a target latency')
+    bench_parser.add_argument('--target-ms', type=float, default=250)
+    bench_parser.add_argument('--max-mem-mb', type=int, default=64)
+    bench_parser.add_argument('-r', type=int, default=8)
+    hash_parser = subparsers.add_parser('hash', help='hash a password (for FLASK_PW_HASH)')
+    hash_parser.add_argument('--profile', default=None, help='profile name or "n,r,p"')
+    parsed = parser.parse_args(args)
+
+    if parsed.command == 'benchmark':
+        profile, ms, measurements = benchmark(parsed.target_ms, max_mem_mb=parsed.max_mem_mb, r=parsed.r)
+        for n, p, m in measurements:
+            print(f'n=2^{int(math.log2(n))} r={parsed.r} p={p}: {m:.1f} ms')
+        print(f'FLASK_PW_PROFILE={profile.spec()}  # {ms:.1f} ms, {profile.memory() / 2 ** 20:.0f} MB')
+    elif parsed.command == 'hash':
+        print(hash_salt_password(getpass.getpass('password: '), profile=cost_profile(parsed.profile)))
 
 
 if __name__ == '__main__':
-    print(hash_salt_password('pass'))
+    main()
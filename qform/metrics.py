@@ -0,0 +1,381 @@
+"""
+Counters, gauges and histograms in the Prometheus text exposition format (version 0.0.4), without external
+dependencies.
+
+Every worker process keeps its own metrics and writes a snapshot of them to a directory shared by all workers
+(see SnapshotWriter); /metrics merges the snapshots, so that the values do not depend on the worker that answers
+the scrape. Snapshots are named by pid and process start time, so a new worker that gets the pid of an exited one
+does not overwrite its values. Counters and histograms of exited workers are summed up in one file (totals do not
+drop when workers are recycled), gauges are only taken from running workers.
+"""
+import bisect
+import json
+import math
+import os
+import resource
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from qform.registry import write_atomic
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# counters and histograms of exited worker processes, see fold_snapshots
+ACCUMULATED_FILE = 'accumulated.json'
+FOLD_LOCK = '.fold.lock'
+
+Snapshot = Dict[str, Dict[str, Any]]
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'metric "{self.name}": expected labels {list(self.labelnames)}, got {list(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _sample_value(self, value: Any) -> Any:
+        return value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = [[list(key), self._sample_value(value)] for key, value in self._values.items()]
+        return {'type': self.type, 'help': self.documentation, 'labelnames': list(self.labelnames),
+                'samples': samples}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if amount < 0:
+            raise ValueError(f'counter "{self.name}" can only be increased')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        # bucket i counts the observations <= buckets[i] (and > buckets[i - 1]); the last one counts the rest
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _sample_value(self, value: Any) -> Any:
+        counts, total = value
+        return {'buckets': list(self.buckets), 'counts': list(counts), 'sum': total}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f'metric "{metric.name}" is already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Snapshot:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+
+def gauge_snapshot(documentation: str, value: Optional[float] = None, labelnames: Sequence[str] = (),
+                   samples: Optional[Iterable[Tuple[Sequence[str], float]]] = None) -> Dict[str, Any]:
+    """
+    Snapshot entry of a gauge that is computed when the metrics are collected (instead of being updated).
+    """
+    if samples is None:
+        samples = [((), value)] if value is not None else []
+    return {'type': 'gauge', 'help': documentation, 'labelnames': list(labelnames),
+            'samples': [[list(labels), float(v)] for labels, v in samples]}
+
+
+def merge_snapshots(snapshots: Iterable[Snapshot]) -> Snapshot:
+    """
+    Sum up the samples (with equal labels) of several snapshots.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if name not in merged:
+                merged[name] = {'type': metric['type'], 'help': metric['help'], 'labelnames': metric['labelnames'],
+                                'samples': {}}
+            samples = merged[name]['samples']
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                if key not in samples:
+                    samples[key] = json.loads(json.dumps(value))
+                elif metric['type'] == 'histogram':
+                    if samples[key]['buckets'] != value['buckets']:
+                        # bucket boundaries changed between versions; keep the current ones
+                        continue
+                    samples[key]['counts'] = [a + b for a, b in zip(samples[key]['counts'], value['counts'])]
+                    samples[key]['sum'] += value['sum']
+                else:
+                    samples[key] += value
+    for metric in merged.values():
+        metric['samples'] = [[list(key), value] for key, value in metric['samples'].items()]
+    return merged
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_str(labelnames: Sequence[str], labels: Sequence[str], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def render(snapshot: Snapshot) -> str:
+    """
+    :return: the metrics in the Prometheus text format
+    """
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f'# HELP {name} ' + metric['help'].replace('\\', '\\\\').replace('\n', '\\n'))
+        lines.append(f'# TYPE {name} {metric["type"]}')
+        labelnames = metric['labelnames']
+        for labels, value in sorted(metric['samples'], key=lambda sample: sample[0]):
+            if metric['type'] == 'histogram':
+                cumulative = 0
+                for bound, n in zip(value['buckets'] + [math.inf], value['counts']):
+                    cumulative += n
+                    le = (('le', _format_value(bound)),)
+                    lines.append(f'{name}_bucket{_labels_str(labelnames, labels, le)} {cumulative}')
+                lines.append(f'{name}_sum{_labels_str(labelnames, labels)} {_format_value(value["sum"])}')
+                lines.append(f'{name}_count{_labels_str(labelnames, labels)} {cumulative}')
+            else:
+                lines.append(f'{name}{_labels_str(labelnames, labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def resident_memory_bytes() -> int:
+    """
+    :return: resident set size of the current process in bytes (peak RSS where /proc is not available)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def process_start_time(pid: int) -> Optional[str]:
+    """
+    :return: start time of the process (clock ticks after boot), None where /proc is not available
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # the fields after the command name (which may contain spaces); starttime is field 22
+            return f.read().rpartition(')')[2].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+_PROCESS_IDS: Dict[int, str] = {}
+
+
+def process_id() -> str:
+    """
+    :return: "<pid>-<start time>" of the current process, unique even if the pid is reused later (a random
+     token instead of the start time where /proc is not available)
+    """
+    pid = os.getpid()
+    if pid not in _PROCESS_IDS:
+        _PROCESS_IDS[pid] = f'{pid}-{process_start_time(pid) or uuid.uuid4().hex}'
+    return _PROCESS_IDS[pid]
+
+
+def process_running(process: str) -> bool:
+    """
+    :param process: process id as returned by process_id
+    """
+    pid, _, start = process.partition('-')
+    if not pid.isdigit() or not pid_alive(int(pid)):
+        return False
+    current_start = process_start_time(int(pid))
+    # another process with the same pid, started later
+    return current_start is None or current_start == start
+
+
+class SnapshotWriter:
+    """
+    Writes the snapshot of a registry to <directory>/<process id>.json, at most every min_interval seconds.
+    """
+
+    def __init__(self, registry: MetricsRegistry, min_interval: float = 1.0):
+        self.registry = registry
+        self.min_interval = min_interval
+        self.last_written = 0.0
+        self.lock = threading.Lock()
+
+    def write(self, directory: Path, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.last_written < self.min_interval:
+            return
+        if not self.lock.acquire(blocking=False):
+            # another thread of this process is writing
+            return
+        try:
+            self.last_written = now
+            directory.mkdir(parents=True, exist_ok=True)
+            _write_json(Path(directory, f'{process_id()}.json'), self.registry.snapshot())
+        finally:
+            self.lock.release()
+
+
+def _write_json(path: Path, value: Any) -> None:
+    write_atomic(path, json.dumps(value).encode('utf-8'))
+
+
+def _read_json(path: Path) -> Any:
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _without_gauges(snapshot: Snapshot) -> Snapshot:
+    return {name: metric for name, metric in snapshot.items() if metric['type'] != 'gauge'}
+
+
+def fold_snapshots(directory: Path, stale_lock_seconds: float = 60.0) -> None:
+    """
+    Sum up the counters and histograms of exited worker processes in ACCUMULATED_FILE and delete their
+    snapshots, so that the directory does not grow with every recycled worker. Skipped if another process is
+    folding at the same time.
+    """
+    directory = Path(directory)
+    lock_dir = Path(directory, FOLD_LOCK)
+    try:
+        lock_dir.mkdir()
+    except FileExistsError:
+        try:
+            if time.time() - lock_dir.stat().st_mtime > stale_lock_seconds:
+                # left behind by a process that was killed while folding
+                lock_dir.rmdir()
+        except OSError:
+            pass
+        return
+    except OSError:
+        return
+    try:
+        accumulated = _read_json(Path(directory, ACCUMULATED_FILE)) or {'folded': [], 'metrics': {}}
+        dead = [path for path in sorted(directory.glob('*.json'))
+                if path.name != ACCUMULATED_FILE and path.name not in accumulated['folded']
+                and not process_running(path.stem)]
+        if not dead:
+            return
+        snapshots = [accumulated['metrics']]
+        for path in dead:
+            snapshot = _read_json(path)
+            if snapshot is not None:
+                snapshots.append(_without_gauges(snapshot))
+        # the names of the folded snapshots are kept until they are deleted (no double counting if this process
+        #  dies between writing ACCUMULATED_FILE and deleting them)
+        folded = [name for name in accumulated['folded'] if Path(directory, name).exists()]
+        _write_json(Path(directory, ACCUMULATED_FILE),
+                    {'folded': folded + [path.name for path in dead], 'metrics': merge_snapshots(snapshots)})
+        for path in dead:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+    finally:
+        lock_dir.rmdir()
+
+
+def read_snapshots(directory: Path) -> List[Snapshot]:
+    """
+    :return: snapshots of all worker processes (counters and histograms of exited ones summed up in
+     ACCUMULATED_FILE); gauges only of the running ones
+    """
+    fold_snapshots(directory)
+    accumulated = _read_json(Path(directory, ACCUMULATED_FILE)) or {'folded': [], 'metrics': {}}
+    snapshots = [accumulated['metrics']]
+    for path in sorted(Path(directory).glob('*.json')):
+        if path.name == ACCUMULATED_FILE or path.name in accumulated['folded']:
+            continue
+        snapshot = _read_json(path)
+        if snapshot is None:
+            continue
+        if not process_running(path.stem):
+            snapshot = _without_gauges(snapshot)
+        snapshots.append(snapshot)
+    return snapshots
@@ -1,21 +1,30 @@
-import importlib
 import os
 import re
 import secrets
 import textwrap
+import time
 import uuid
 from collections import defaultdict
 from functools import wraps
 from pathlib import Path
-from typing import Dict, Optional, Union, Tuple
+from typing import Any, Dict, Optional, Union, Tuple
 
 import lxml.etree
 import waitress as waitress
-from qform.hash import verify_password
-from qrt.util.qmlgen import gen_mqsc
+from qform.artifacts import precompress_artifact, select_encoding, available_encodings, compress, content_etag, \
+    encoded_etag
+from qform.hash import verify_password_offloaded, VerifierBusy, VERIFICATION_STATS, rehash_if_needed, \
+    pending_verifications
+from qform.metrics import MetricsRegistry, SnapshotWriter, gauge_snapshot, merge_snapshots, read_snapshots, render, \
+    resident_memory_bytes, CONTENT_TYPE
+from qform.registry import FileRegistry, write_atomic
+from qrt.util.qmlgen import gen_mqsc, build_questions, serialize_questions, gen_questionnaire
 from qrt.util.util import qml_details
-from qrt.util.graph import make_flowchart
-from flask import Flask, render_template, request, json, send_file, session, flash, Request
+from qrt.util.graphcache import LayoutCache
+from qrt.util.snapshot import read_snapshot, write_snapshot, SnapshotError
+from qrt.util.timing import TimingRecorder, recording, stage
+from qrt.util import memprofile
+from flask import Flask, render_template, request, json, send_file, session, flash, Request, stream_with_context, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.utils import secure_filename, redirect
@@ -32,9 +41,16 @@ __version__ = "0.0.2"
 
 app = Flask(__name__)
 app.debug = True
-app.config['upload_dir'] = TemporaryDirectory()
+# UPLOAD_DIR has to be set (to a directory shared by all workers) when running several worker processes
+if os.getenv('UPLOAD_DIR'):
+    app.config['upload_dir'] = Path(os.getenv('UPLOAD_DIR'))
+else:
+    app.config['upload_dir'] = TemporaryDirectory()
 app.config['SESSION_TYPE'] = 'filesystem'
-app.secret_key = secrets.token_hex(16)
+app.secret_key = os.getenv('FLASK_SECRET_KEY') or secrets.token_hex(16)
+# opt-in memory profiling (slow): MEMORY_PROFILE=<number of frames stored per allocation>, see /api/admin/memory
+if os.getenv('MEMORY_PROFILE'):
+    memprofile.start(int(os.getenv('MEMORY_PROFILE')))
 
 
 @app.context_processor
@@ -55,28 +71,78 @@ def cleanup_credentials(cred: Union[str, None]):
 
 flask_user = cleanup_credentials(os.environ.get('FLASK_USER'))
 flask_pw_hash = cleanup_credentials(os.environ.get('FLASK_PW_HASH'))
+# optional file that receives the password hash when it is upgraded to the current scrypt cost profile
+flask_pw_hash_file = cleanup_credentials(os.environ.get('FLASK_PW_HASH_FILE'))
+if flask_pw_hash_file is not None and Path(flask_pw_hash_file).exists():
+    flask_pw_hash = cleanup_credentials(Path(flask_pw_hash_file).read_text()) or flask_pw_hash
 
-limiter = Limiter(app=app, key_func=get_remote_address)
+# the default in-memory storage counts per worker process; set RATELIMIT_STORAGE_URI (e.g. redis://...) to share
+limiter = Limiter(app=app, key_func=get_remote_address, storage_uri=os.getenv('RATELIMIT_STORAGE_URI', 'memory://'))
 
 ALLOWED_EXTENSIONS = ['xml']
 FILE_DICT = None
-GEN_DICT = None
-SESSION_LIST = None
+GEN_REGISTRY = None
+SESSION_REGISTRY = None
+LAYOUT_CACHE = None
+
+# metrics of this worker process, see /metrics
+METRICS = MetricsRegistry()
+REQUEST_SECONDS = METRICS.histogram('qform_request_duration_seconds', 'request latency per route',
+                                    ['route', 'method'])
+REQUESTS = METRICS.counter('qform_requests_total', 'requests per route and response status',
+                           ['route', 'method', 'status'])
+REQUESTS_IN_PROGRESS = METRICS.gauge('qform_requests_in_progress', 'requests being handled')
+PARSE_FAILURES = METRICS.counter('qform_parse_failures_total', 'uploaded files that could not be parsed')
+GRAPHVIZ_SECONDS = METRICS.counter('qform_graphviz_seconds_total', 'time spent in graphviz layout and drawing')
+LAYOUT_CACHE_REQUESTS = METRICS.counter('qform_layout_cache_requests_total',
+                                        'flowchart renderings answered from the layout cache (hit) or not (miss)',
+                                        ['result'])
+CACHED_QUESTIONNAIRES = METRICS.gauge('qform_cached_questionnaires', 'parsed questionnaires held in memory',
+                                      ['pid'])
+RESIDENT_MEMORY = METRICS.gauge('process_resident_memory_bytes', 'resident memory of the worker process',
+                                ['pid'])
+METRICS_SNAPSHOTS = SnapshotWriter(METRICS)
 
 
 def log_in():
     session['logged_in'] = True
-    session['uid'] = uuid.uuid4()
-    session_list().append(session['uid'])
+    session['uid'] = str(uuid.uuid4())
+    session_registry()[session['uid']] = {'logged_in': time.time()}
 
 
 def log_out():
-    file_ids_list = [k for k, v in file_dict().items() if v['session_uid'] == session.get('uid')]
-    [file_dict().pop(file_id) for file_id in file_ids_list]
-    session_list().remove(session['uid'])
+    file_ids_list = [k for k, v in file_dict().items() if v.get('session_uid') == session.get('uid')]
+    [unregister_file(file_id) for file_id in file_ids_list]
+    # the session may have been started in another worker process
+    if session.get('uid') is not None:
+        session_registry().pop(session['uid'], None)
+    gen_registry().pop(session.get('session_id', ''), None)
     session.clear()
 
 
+def stored_pw_hash() -> Optional[str]:
+    # the hash file may have been updated by another worker process
+    if flask_pw_hash_file is not None and Path(flask_pw_hash_file).exists():
+        return cleanup_credentials(Path(flask_pw_hash_file).read_text()) or flask_pw_hash
+    return flask_pw_hash
+
+
+def update_pw_hash(password: str, pw_hash: str) -> None:
+    global flask_pw_hash
+    # upgrade the stored hash if it does not match the configured scrypt cost profile (FLASK_PW_PROFILE)
+    try:
+        new_hash = rehash_if_needed(password, pw_hash)
+    except (ValueError, VerifierBusy) as err:
+        # the login succeeded anyway, the hash is upgraded on a later login
+        app.logger.warning(f'password hash not upgraded: {err}')
+        return
+    if new_hash is None:
+        return
+    flask_pw_hash = new_hash
+    if flask_pw_hash_file is not None:
+        write_atomic(flask_pw_hash_file, new_hash.encode('utf-8'))
+
+
 def login_restricted(func):
     @wraps(func)
     def func_wrapper(*args, **kwargs):
@@ -100,30 +166,43 @@ def valid_filename(filename):
 
 
 def upload_dir():
-    p = Path(app.config['upload_dir'].name)
+    upload_path = app.config['upload_dir']
+    p = Path(upload_path.name if isinstance(upload_path, TemporaryDirectory) else upload_path)
     if not p.exists():
         p.mkdir(parents=True, exist_ok=True)
     return p
 
 
-def file_dict():
+def file_dict() -> FileRegistry:
     global FILE_DICT
-    # review simple file dict - might be cleared when app is reinitialized
+    # file metadata is stored in upload_dir, so that it is shared between worker processes
 
     if FILE_DICT is None:
-        FILE_DICT = {}
+        FILE_DICT = FileRegistry(Path(upload_dir(), 'registry'), local_keys=['questionnaire'])
 
     return FILE_DICT
 
 
-def session_list():
-    global SESSION_LIST
-    # review simple file dict - might be cleared when app is reinitialized
+def layout_cache() -> LayoutCache:
+    global LAYOUT_CACHE
+    # rendered flowcharts, shared between sessions; persists across restarts if LAYOUT_CACHE_DIR is set
+
+    if LAYOUT_CACHE is None:
+        cache_dir = os.getenv('LAYOUT_CACHE_DIR', str(Path(upload_dir(), 'layout_cache')))
+        max_bytes = int(os.getenv('LAYOUT_CACHE_MAX_BYTES', 256 * 2 ** 20))
+        LAYOUT_CACHE = LayoutCache(cache_dir, max_bytes=max_bytes)
 
-    if SESSION_LIST is None:
-        SESSION_LIST = []
+    return LAYOUT_CACHE
 
-    return SESSION_LIST
+
+def session_registry() -> FileRegistry:
+    global SESSION_REGISTRY
+    # logged in sessions (session uid -> login time), shared between worker processes like the file registry
+
+    if SESSION_REGISTRY is None:
+        SESSION_REGISTRY = FileRegistry(Path(upload_dir(), 'sessions'), local_keys=[])
+
+    return SESSION_REGISTRY
 
 
 @app.errorhandler(400)
@@ -143,17 +222,33 @@ def too_many_requests(e):
     return index()
 
 
-def gen_dict():
-    global GEN_DICT
-    # review simple gen data dict - might be cleared when app is reinitialized
+def gen_registry() -> FileRegistry:
+    global GEN_REGISTRY
+    # gen_mqsc form data per session, shared between worker processes like the file registry
+
+    if GEN_REGISTRY is None:
+        GEN_REGISTRY = FileRegistry(Path(upload_dir(), 'gen_forms'), local_keys=[])
+
+    return GEN_REGISTRY
 
-    if GEN_DICT is None:
-        GEN_DICT = {}
 
-    if 'session_id' not in GEN_DICT:
-        GEN_DICT['session_id'] = {}
+def load_gen_data() -> Dict[str, Any]:
+    try:
+        data = gen_registry()[session['session_id']]['data']
+    except KeyError:
+        return {}
+    # JSON object keys are strings, the form uses int indices
+    for key in ['headers', 'aos', 'items']:
+        if key in data:
+            data[key] = {int(i): element for i, element in data[key].items()}
+    for item in data.get('items', {}).values():
+        if 'attached_opens' in item:
+            item['attached_opens'] = {int(j): att_open for j, att_open in item['attached_opens'].items()}
+    return data
+
 
-    return GEN_DICT['session_id']
+def store_gen_data(data: Dict[str, Any]) -> None:
+    gen_registry()[session['session_id']] = {'data': data}
 
 
 @app.before_request
@@ -162,6 +257,95 @@ def init_session():
         session['session_id'] = randstr(20)
 
 
+def metrics_dir() -> Path:
+    # metrics snapshots of all worker processes
+    return Path(upload_dir(), 'metrics')
+
+
+def request_route() -> str:
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    REQUESTS_IN_PROGRESS.inc()
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_request(exc):
+    if 'request_start' not in g:
+        return
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route=request_route(), method=request.method)
+    REQUESTS.inc(route=request_route(), method=request.method, status=g.get('response_status', 500))
+    REQUESTS_IN_PROGRESS.dec()
+    write_metrics_snapshot()
+
+
+def write_metrics_snapshot(force: bool = False) -> None:
+    pid = os.getpid()
+    CACHED_QUESTIONNAIRES.set(file_dict().local_count('questionnaire'), pid=pid)
+    RESIDENT_MEMORY.set(resident_memory_bytes(), pid=pid)
+    METRICS_SNAPSHOTS.write(metrics_dir(), force=force)
+
+
+def directory_bytes(path: Path) -> int:
+    total = 0
+    for p in path.rglob('*'):
+        try:
+            if p.is_file():
+                total += p.stat().st_size
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def collected_metrics():
+    # gauges computed on each scrape, from the state shared by all worker processes
+    files_per_session = defaultdict(int)
+    for file_meta in file_dict().values():
+        files_per_session[file_meta.get('session_uid')] += 1
+    stats = VERIFICATION_STATS.summary()
+    return {
+        'qform_registered_files': gauge_snapshot('uploaded files in the file registry',
+                                                 sum(files_per_session.values())),
+        'qform_sessions_with_files': gauge_snapshot('sessions with registered files', len(files_per_session)),
+        'qform_session_files_max': gauge_snapshot('registered files of the session with the most files',
+                                                  max(files_per_session.values(), default=0)),
+        'qform_upload_dir_bytes': gauge_snapshot('bytes in the upload directory (including the layout cache)',
+                                                 directory_bytes(upload_dir())),
+        'qform_layout_cache_bytes': gauge_snapshot('bytes in the layout cache', layout_cache().size()),
+        'qform_layout_cache_entries': gauge_snapshot('rendered flowcharts in the layout cache',
+                                                     len(layout_cache().entries())),
+        'qform_login_verifications_pending': gauge_snapshot('password verifications running or queued',
+                                                            pending_verifications()),
+        # VERIFICATION_STATS of the answering worker process
+        'qform_login_verifications': gauge_snapshot('password verifications (this worker)', stats['count']),
+        'qform_login_rejected': gauge_snapshot('logins rejected because the verifier was busy (this worker)',
+                                               stats['rejected']),
+        'qform_login_verification_seconds': gauge_snapshot(
+            'password verification latency of the recent logins (this worker)', labelnames=['quantile'],
+            samples=[((quantile,), stats[key]) for quantile, key in [('0.5', 'p50_seconds'),
+                                                                       ('0.95', 'p95_seconds')]
+                     if stats[key] is not None]),
+    }
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text format; not login restricted (for the scraper), nginx does not forward /metrics
+    write_metrics_snapshot(force=True)
+    snapshot = merge_snapshots(read_snapshots(metrics_dir()))
+    snapshot.update(collected_metrics())
+    return app.response_class(response=render(snapshot), status=200, content_type=CONTENT_TYPE)
+
+
 @app.route('/')
 @login_restricted
 def index():
@@ -180,11 +364,16 @@ def do_login():
         return index()
     us_correct = request.form['username'].encode('utf-8') == flask_user.encode('utf-8')
     pw_correct = False
+    pw_hash = stored_pw_hash()
     try:
-        pw_correct = verify_password(request.form['password'], flask_pw_hash)
+        pw_correct = verify_password_offloaded(request.form['password'], pw_hash)
+    except VerifierBusy as err:
+        flash(err.args[0])
+        return index()
     except ValueError as err:
         flash(err.args[0])
     if pw_correct and us_correct:
+        update_pw_hash(request.form['password'], pw_hash)
         log_in()
         return index()
     else:
@@ -192,6 +381,16 @@ def do_login():
     return index()
 
 
+@app.route('/api/stats/login', methods=['GET'])
+@login_restricted
+def login_stats():
+    return app.response_class(
+        response=json.dumps(VERIFICATION_STATS.summary()),
+        status=200,
+        mimetype='application/json'
+    )
+
+
 @app.route('/logout', methods=['GET'])
 @limiter.limit("100/day")
 @limiter.limit("10/minute")
@@ -224,7 +423,7 @@ def upload():
 @app.route('/gen_mqsc', methods=['GET'])
 @login_restricted
 def form_mqsc():
-    gen_data = gen_dict()
+    gen_data = load_gen_data()
     if gen_data == {}:
         gen_data = {'type': 'mqsc',
                     'q_uid': 'mqsc',
@@ -399,10 +598,9 @@ def form_mqsc_post():
                 # ToDo: comment and fix line below
                 new_dict[new_index]['uid'] = re.sub(r'[0-9]+', '', data[obj_type + 's'][k]['uid']) + str(new_index)
             data[obj_type + 's'] = new_dict
-    gen_dict().clear()
-    gen_dict().update(data)
+    store_gen_data(data)
 
-    return render_template('gen_mqsc.html', gen_data=gen_dict())
+    return render_template('gen_mqsc.html', gen_data=data)
 
 
 @app.route('/api/gen_mqsc', methods=['POST'])
@@ -411,37 +609,205 @@ def generate_mqsc(data_dict):
     return gen_mqsc(data_dict)
 
 
+@app.route('/api/gen_batch', methods=['POST'])
+@login_restricted
+def generate_batch():
+    # question specs as JSON list (or {"questions": [...]}); the generated XML is streamed question by question
+    data = request.get_json(silent=True)
+    specs = data.get('questions') if isinstance(data, dict) else data
+    if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+        return app.response_class(
+            response=json.dumps({'msg': 'expected a list of question specs'}),
+            status=400,
+            mimetype='application/json'
+        )
+    try:
+        questions = build_questions(specs)
+    except ValueError as err:
+        return app.response_class(
+            response=json.dumps({'msg': err.args[0]}),
+            status=400,
+            mimetype='application/json'
+        )
+    return app.response_class(
+        response=stream_with_context(serialize_questions(questions)),
+        status=200,
+        mimetype='application/xml'
+    )
+
+
+@app.route('/api/gen_questionnaire', methods=['POST'])
+@login_restricted
+def generate_questionnaire():
+    # {"name": ..., "pages": [{"uid": ..., "questions": [...]}, ...]}; the questionnaire.xml is streamed page by page
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return app.response_class(
+            response=json.dumps({'msg': 'expected a questionnaire spec with "pages"'}),
+            status=400,
+            mimetype='application/json'
+        )
+    try:
+        xml_chunks = gen_questionnaire(data)
+    except ValueError as err:
+        return app.response_class(
+            response=json.dumps({'msg': err.args[0]}),
+            status=400,
+            mimetype='application/json'
+        )
+    return app.response_class(
+        response=stream_with_context(xml_chunks),
+        status=200,
+        mimetype='application/xml',
+        headers={'Content-Disposition': 'attachment; filename=questionnaire.xml'}
+    )
+
+
+def previous_questionnaire(file_id) -> Optional[Questionnaire]:
+    # most recently processed upload of the same file within the same session
+    file_meta = file_dict()[file_id]
+    candidates = [v for k, v in file_dict().items() if k != file_id and 'questionnaire' in v and
+                  v['filename'] == file_meta['filename'] and v['session_uid'] == file_meta['session_uid']]
+    if not candidates:
+        return None
+    return candidates[-1]['questionnaire']
+
+
+def new_recorder() -> TimingRecorder:
+    # records the peak memory per stage as well if memory profiling is enabled
+    return TimingRecorder(trace_memory=memprofile.enabled())
+
+
+# registry keys of the timings, one per phase: concurrent requests (threads, workers) do not overwrite each other
+TIMINGS_KEY_PREFIX = 'timings_'
+
+
+def store_timings(file_id, phase: str, recorder: TimingRecorder) -> None:
+    # per-stage timings of the last run of each phase (read_xml, qml_details, flowchart variants)
+    file_dict()[file_id][TIMINGS_KEY_PREFIX + phase] = recorder.summary()
+
+
+def stored_timings(file_meta) -> Dict[str, Any]:
+    # phase -> timings of the last run, see store_timings
+    timings = {}
+    for key in list(file_meta):
+        if key.startswith(TIMINGS_KEY_PREFIX):
+            summary = file_meta.get(key)
+            # None: removed by another process
+            if summary is not None:
+                timings[key[len(TIMINGS_KEY_PREFIX):]] = summary
+    return timings
+
+
+def snapshot_path(file_id) -> Path:
+    # parsed questionnaire, for the other worker processes and after restarts
+    return Path(upload_dir(), f'{file_id}_questionnaire.snapshot')
+
+
+def remove_snapshot(file_id) -> None:
+    try:
+        snapshot_path(file_id).unlink(missing_ok=True)
+    except OSError as err:
+        app.logger.warning(f'snapshot of {file_id} not removed: {err}')
+
+
+def unregister_file(file_id) -> None:
+    file_dict().pop(file_id, None)
+    remove_snapshot(file_id)
+
+
+def load_questionnaire(file_id) -> None:
+    # questionnaire of a file processed by another worker process (or before a restart): restored from its snapshot,
+    # parsed again if there is none (or it was written by an incompatible version)
+    try:
+        with recording(new_recorder()) as recorder, stage('read_snapshot'):
+            q = read_snapshot(snapshot_path(file_id))
+    except (OSError, SnapshotError):
+        process_xml(file_id)
+        return
+    file_dict()[file_id]['questionnaire'] = q
+    store_timings(file_id, 'read_snapshot', recorder)
+
+
 def process_xml(file_id) -> None:
     file_meta = file_dict()[file_id]
     filename = file_meta['internal_filename']
     try:
-        q = read_xml(Path(upload_dir(), filename))
+        with recording(new_recorder()) as recorder, stage('read_xml'):
+            q = read_xml(Path(upload_dir(), filename), previous=previous_questionnaire(file_id))
     except ParseError:
+        PARSE_FAILURES.inc()
         try:
             lxml.etree.parse(Path(upload_dir(), filename))
         except lxml.etree.XMLSyntaxError as synterr:
             raise ParseError(synterr.msg)
     file_dict()[file_id]['questionnaire'] = q
-
-
-def process_graphs(file_id):
-    if importlib.util.find_spec('pygraphviz') is None:
-        raise ModuleNotFoundError('module "pygraphviz" not found')
-
+    try:
+        with recording(recorder), stage('write_snapshot'):
+            write_snapshot(q, snapshot_path(file_id))
+    except OSError as err:
+        # the snapshot is only a cache: other worker processes parse the file again
+        app.logger.warning(f'snapshot of {file_id} not written: {err}')
+        remove_snapshot(file_id)
+    store_timings(file_id, 'read_xml', recorder)
+    if recorder.trace_memory:
+        # traced memory still allocated after read_xml: the size of the cached questionnaire (without the lxml trees
+        # and without pages shared with the previous upload)
+        file_dict()[file_id]['memory'] = {'retained_bytes': recorder.retained_bytes['read_xml'],
+                                          'peak_bytes': recorder.peak_bytes['read_xml']}
+    # details have to be serialized again
+    file_dict()[file_id].pop('details_etag', None)
+
+
+# flowchart variants rendered for each file: (file name suffix, make_flowchart options)
+FLOWCHART_VARIANTS = [
+    ('flowchart_var_cond', {'show_var': True, 'show_cond': True}),
+    ('flowchart_var', {'show_var': True, 'show_cond': False}),
+    ('flowchart', {'show_var': False, 'show_cond': False, 'color_nodes': True}),
+    ('flowchart_var_cond_repl', {'show_var': True, 'show_cond': True, 'color_nodes': False,
+                                 'replace_zofar_cond': True}),
+]
+
+
+def layout_options(input_request: Request) -> Dict[str, Union[str, bool]]:
+    engine = input_request.args.get('engine', 'auto')
+    from qrt.util.graph import LAYOUT_ENGINES, available_layout_engines
+    if engine != 'auto' and engine not in LAYOUT_ENGINES:
+        raise ValueError(f'unknown layout engine: "{engine}"')
+    if engine != 'auto' and engine not in available_layout_engines():
+        raise ValueError(f'layout engine "{engine}" is not available (pygraphviz is not installed)')
+    collapse_prefixes = input_request.args.get('collapse', 'false').lower() in ['1', 'true', 'on']
+    return {'engine': engine, 'collapse_prefixes': collapse_prefixes}
+
+
+def render_flowchart(file_id, variant_index: int, engine: str = 'auto',
+                     collapse_prefixes: bool = False) -> Tuple[Path, str]:
+    # networkx (and pygraphviz) are imported on first use only
+    from qrt.util.graph import make_flowchart
     file_meta = file_dict()[file_id]
-    flowchart_file1 = Path(upload_dir(), file_id + '_flowchart_var_cond.svg')
-    flowchart_file2 = Path(upload_dir(), file_id + '_flowchart_var.svg')
-    flowchart_file3 = Path(upload_dir(), file_id + '_flowchart.svg')
-    flowchart_file4 = Path(upload_dir(), file_id + '_flowchart_var_cond_repl.svg')
-
-    make_flowchart(q=file_meta['questionnaire'], out_file=flowchart_file4, show_var=True, show_cond=True,
-                   color_nodes=False, replace_zofar_cond=True)
-    make_flowchart(q=file_meta['questionnaire'], out_file=flowchart_file3, show_var=False, show_cond=False,
-                   color_nodes=True)
-    make_flowchart(q=file_meta['questionnaire'], out_file=flowchart_file2, show_var=True, show_cond=False)
-    make_flowchart(q=file_meta['questionnaire'], out_file=flowchart_file1, show_var=True, show_cond=True)
-
-    file_meta['flowchart'] = [str(flowchart_file1), str(flowchart_file2), str(flowchart_file3), str(flowchart_file4)]
+    name, options = FLOWCHART_VARIANTS[variant_index]
+    if engine == 'auto' and not collapse_prefixes:
+        flowchart_file = Path(upload_dir(), f'{file_id}_{name}.svg')
+    else:
+        flowchart_file = Path(upload_dir(), f'{file_id}_{name}_{engine}{"_collapsed" if collapse_prefixes else ""}.svg')
+    with recording(new_recorder()) as recorder, stage('flowchart'):
+        make_flowchart(q=file_meta['questionnaire'], out_file=flowchart_file, cache=layout_cache(), engine=engine,
+                       collapse_prefixes=collapse_prefixes, **options)
+    store_timings(file_id, name, recorder)
+    summary = recorder.summary()
+    GRAPHVIZ_SECONDS.inc(summary['stages'].get('flowchart.graphviz', {}).get('seconds', 0.0))
+    LAYOUT_CACHE_REQUESTS.inc(summary['counters'].get('flowchart.cache_hits', 0), result='hit')
+    LAYOUT_CACHE_REQUESTS.inc(summary['counters'].get('flowchart.cache_misses', 0), result='miss')
+    return flowchart_file, precompress_artifact(flowchart_file)
+
+
+def process_graphs(file_id, engine: str = 'auto', collapse_prefixes: bool = False):
+    # without pygraphviz, make_flowchart falls back to the built-in layered svg renderer
+    file_meta = file_dict()[file_id]
+    rendered = [render_flowchart(file_id, i, engine=engine, collapse_prefixes=collapse_prefixes)
+                for i in range(len(FLOWCHART_VARIANTS))]
+    file_meta['flowchart'] = [str(flowchart_file) for flowchart_file, _ in rendered]
+    file_meta['flowchart_etag'] = [etag for _, etag in rendered]
 
 
 @app.route('/api/process/<file_id>', methods=['GET'])
@@ -478,7 +844,13 @@ def process_file(file_id):
         )
 
     try:
-        process_graphs(file_id)
+        process_graphs(file_id, **layout_options(request))
+    except ValueError as err:
+        return app.response_class(
+            response=json.dumps({'msg': err.args[0]}),
+            status=400,
+            mimetype='application/json'
+        )
     except ModuleNotFoundError as err:
         print(err)
         return app.response_class(
@@ -494,9 +866,143 @@ def process_file(file_id):
     )
 
 
+def details_error(file_id):
+    # error response if the file is not registered for the session or cannot be parsed, otherwise None
+    if file_id not in [k for k, v in file_dict().items() if v['session_uid'] == session.get('uid')]:
+        return app.response_class(
+            response=json.dumps({'msg': 'file id not registered'}),
+            status=400,
+            mimetype='application/json'
+        )
+    if 'questionnaire' not in file_dict()[file_id]:
+        try:
+            load_questionnaire(file_id)
+        except ParseError as err:
+            return app.response_class(
+                response=json.dumps({'msg': f'error while parsing file: {err.msg}'}),
+                status=400,
+                mimetype='application/json'
+            )
+    assert isinstance(file_dict()[file_id]['questionnaire'], Questionnaire)
+    return None
+
+
 @app.route('/api/details/<file_id>', methods=['GET'])
 @login_restricted
 def file_details(file_id):
+    error_response = details_error(file_id)
+    if error_response is not None:
+        return error_response
+    path = details_file(file_id)
+    return send_artifact(path, file_dict()[file_id]['details_etag'], 'application/json')
+
+
+def details_file(file_id) -> Path:
+    # details JSON is serialized once per processed file and stored (with precompressed variants) as an artifact
+    file_meta = file_dict()[file_id]
+    path = Path(upload_dir(), f'{file_id}_details.json')
+    if 'details_etag' not in file_meta or not path.exists():
+        with recording(new_recorder()) as recorder, stage('qml_details'):
+            details_dict = qml_details(file_meta['questionnaire'], file_meta['filename'])
+        store_timings(file_id, 'qml_details', recorder)
+        assert 'msg' not in details_dict
+        path.write_bytes(json.dumps({'msg': 'success', **details_dict}).encode('utf-8'))
+        file_meta['details_etag'] = precompress_artifact(path)
+    return path
+
+
+@app.route('/api/timings/<file_id>', methods=['GET'])
+@login_restricted
+def file_timings(file_id):
+    # per-stage timing breakdown of the processing of a file
+    if file_id not in [k for k, v in file_dict().items() if v['session_uid'] == session.get('uid')]:
+        return app.response_class(
+            response=json.dumps({'msg': 'file id not registered'}),
+            status=400,
+            mimetype='application/json'
+        )
+    return app.response_class(
+        response=json.dumps({'msg': 'success', 'timings': stored_timings(file_dict()[file_id])}),
+        status=200,
+        mimetype='application/json'
+    )
+
+
+@app.route('/api/admin/memory', methods=['GET'])
+@login_restricted
+def admin_memory():
+    # memory of the answering worker process: cached questionnaires, peak per processing stage (maximum over the
+    # registered files) and, if memory profiling is enabled, the top allocation sites
+    try:
+        limit = int(request.args.get('limit', 20))
+        top_allocations = memprofile.top_allocations(limit=limit, group_by=request.args.get('group_by', 'lineno'))
+    except ValueError as err:
+        return app.response_class(
+            response=json.dumps({'msg': err.args[0]}),
+            status=400,
+            mimetype='application/json'
+        )
+    questionnaires = {}
+    for file_id, q in file_dict().local_values('questionnaire').items():
+        try:
+            file_meta = file_dict()[file_id]
+        except KeyError:
+            # removed by another process
+            continue
+        questionnaires[file_id] = {'filename': file_meta['filename'], 'pages': len(q.pages_unmasked),
+                                   **file_meta.get('memory', {})}
+    stage_peaks = defaultdict(int)
+    for file_meta in file_dict().values():
+        for phase in stored_timings(file_meta).values():
+            for name, values in phase['stages'].items():
+                if 'peak_bytes' in values:
+                    stage_peaks[name] = max(stage_peaks[name], values['peak_bytes'])
+    return app.response_class(
+        response=json.dumps({'msg': 'success', 'profiling': memprofile.enabled(), 'pid': os.getpid(),
+                             'resident_bytes': resident_memory_bytes(), **memprofile.traced_memory(),
+                             'questionnaires': questionnaires, 'stage_peak_bytes': dict(stage_peaks),
+                             'top_allocations': top_allocations}),
+        status=200,
+        mimetype='application/json'
+    )
+
+
+def set_cache_headers(response):
+    # artifacts are user specific and may change when a file is processed again: always revalidate (-> 304)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.cache_control.max_age = None
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compressible_response(data: bytes, mimetype: str):
+    # content-hash ETag (answers conditional requests with 304) and compression if accepted by the client
+    encoding = next((enc for enc, _ in available_encodings() if enc in request.accept_encodings), None)
+    response = app.response_class(response=data, status=200, mimetype=mimetype)
+    response.set_etag(encoded_etag(content_etag(data), encoding))
+    set_cache_headers(response)
+    response.make_conditional(request)
+    if response.status_code == 200 and encoding is not None:
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def send_artifact(path: Path, etag: str, mimetype: str):
+    # serve a generated file (or its precompressed variant) with ETag / Last-Modified and 304 handling
+    encoded_path, encoding = select_encoding(path, request.accept_encodings)
+    response = send_file(encoded_path, mimetype=mimetype, etag=encoded_etag(etag, encoding), conditional=True,
+                         last_modified=Path(path).stat().st_mtime)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return set_cache_headers(response)
+
+
+@app.route('/api/graph/<file_id>', methods=['GET'])
+@login_restricted
+def graph_json(file_id):
     if file_id not in [k for k, v in file_dict().items() if v['session_uid'] == session.get('uid')]:
         return app.response_class(
             response=json.dumps({'msg': 'file id not registered'}),
@@ -506,39 +1012,32 @@ def file_details(file_id):
     else:
         if 'questionnaire' not in file_dict()[file_id]:
             try:
-                process_xml(file_id)
+                load_questionnaire(file_id)
             except ParseError as err:
                 return app.response_class(
                     response=json.dumps({'msg': f'error while parsing file: {err.msg}'}),
                     status=400,
                     mimetype='application/json'
                 )
-    q = file_dict()[file_id]['questionnaire']
-    assert isinstance(q, Questionnaire)
 
-    details_dict = qml_details(file_dict()[file_id]['questionnaire'], file_dict()[file_id]['filename'])
-    assert 'msg' not in details_dict
-    return app.response_class(
-        response=json.dumps({'msg': 'success', **details_dict}),
-        status=200,
-        mimetype='application/json'
-    )
+    options = {'show_cond': request.args.get('cond', 'true').lower() in ['1', 'true', 'on'],
+               'show_jumper': request.args.get('jumper', 'false').lower() in ['1', 'true', 'on'],
+               'color_nodes': request.args.get('color', 'true').lower() in ['1', 'true', 'on'],
+               'replace_zofar_cond': request.args.get('replace', 'false').lower() in ['1', 'true', 'on']}
+    from qrt.util.graph import graph_data
+    data = graph_data(file_dict()[file_id]['questionnaire'], **options)
+    return compressible_response(json.dumps(data, separators=(',', ':')).encode('utf-8'), 'application/json')
 
 
 @app.route('/details/<file_id>', methods=['GET'])
 @login_restricted
 def details(file_id):
-    api_response = file_details(file_id)
-    if api_response.status_code != 200:
-        return app.response_class(
-            response=json.dumps(api_response.json),
-            status=api_response.status_code,
-            mimetype='application/json'
-        )
-    else:
-        details_data = api_response.json
-        details_data.pop('msg')
-        return render_template('details.html', details_data=details_data)
+    error_response = details_error(file_id)
+    if error_response is not None:
+        return error_response
+    details_data = json.loads(details_file(file_id).read_bytes())
+    details_data.pop('msg')
+    return render_template('details.html', details_data=details_data)
 
 
 def serialize(obj):
@@ -564,15 +1063,37 @@ def flowchart(file_id):
             mimetype='application/json'
         )
     else:
-        if 'questionnaire' not in file_dict()[file_id]:
+        if 'flowchart' not in file_dict()[file_id]:
             return app.response_class(
                 response=json.dumps({'msg': 'file has not been processed'}),
                 status=400,
                 mimetype='application/json'
             )
 
+    if 'engine' in request.args or 'collapse' in request.args:
+        # render on demand with the requested layout options
+        try:
+            if 'questionnaire' not in file_dict()[file_id]:
+                # processed by another worker process
+                load_questionnaire(file_id)
+            flowchart_file, etag = render_flowchart(file_id, int(flowchart_i), **layout_options(request))
+        except ParseError as err:
+            return app.response_class(
+                response=json.dumps({'msg': f'error while parsing file: {err.msg}'}),
+                status=400,
+                mimetype='application/json'
+            )
+        except ValueError as err:
+            return app.response_class(
+                response=json.dumps({'msg': err.args[0]}),
+                status=400,
+                mimetype='application/json'
+            )
+        return send_artifact(flowchart_file, etag, 'image/svg+xml')
+
     flowchart_file = file_dict()[file_id]['flowchart'][int(flowchart_i)]
-    return send_file(flowchart_file)
+    etag = file_dict()[file_id]['flowchart_etag'][int(flowchart_i)]
+    return send_artifact(Path(flowchart_file), etag, 'image/svg+xml')
 
 
 @app.route('/api/upload', methods=['POST'])
@@ -600,7 +1121,7 @@ def upload_file():
                             'session_uid': session.get('uid')}
 
     return app.response_class(
-        response=json.dumps(file_dict()[file_id]),
+        response=json.dumps(dict(file_dict()[file_id])),
         status=200,
         mimetype='application/json'
     )
@@ -616,7 +1137,7 @@ def remove_file(file_id):
             mimetype='application/json'
         )
     else:
-        file_dict().pop(file_id)
+        unregister_file(file_id)
 
     return app.response_class(
         response=json.dumps({'msg': 'success'}),
@@ -635,7 +1156,7 @@ def remove_file_link(file_id):
             mimetype='application/json'
         )
     else:
-        file_dict().pop(file_id)
+        unregister_file(file_id)
     return redirect('/upload')
 
 
@@ -644,7 +1165,7 @@ def main():
         waitress.serve(app, host="0.0.0.0", port=int(os.getenv("SERVICE_PORT")))
         # app.run(host='0.0.0.0')
     finally:
-        if 'upload_dir' in app.config:
+        if isinstance(app.config.get('upload_dir'), TemporaryDirectory):
             app.config['upload_dir'].cleanup()
 
 
@@ -0,0 +1,161 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Union
+
+RE_KEY = re.compile(r'^[A-Za-z0-9_\-]+$')
+
+# marker file in each entry directory; its content orders the entries by registration time
+CREATED_MARKER = '.created'
+
+
+def write_atomic(path: Union[str, Path], data: bytes) -> None:
+    # unique temporary file: several threads (and processes) may write the same path at the same time
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+class RegistryEntry(MutableMapping):
+    """
+    Metadata of one registered file. Every key is written through to the registry immediately, so changes are
+    visible to all worker processes; keys in the registry's local_keys only exist in the current process.
+    """
+
+    def __init__(self, registry: 'FileRegistry', file_id: str):
+        self.registry = registry
+        self.file_id = file_id
+
+    def _local(self) -> Dict[str, Any]:
+        return self.registry._local.setdefault(self.file_id, {})
+
+    def _path(self, key: str) -> Path:
+        if not RE_KEY.match(key):
+            raise KeyError(key)
+        return Path(self.registry.entry_dir(self.file_id), key + '.json')
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.registry.local_keys:
+            return self._local()[key]
+        try:
+            return json.loads(self._path(key).read_bytes())
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self.registry.local_keys:
+            self._local()[key] = value
+            return
+        write_atomic(self._path(key), json.dumps(value).encode('utf-8'))
+
+    def __delitem__(self, key: str) -> None:
+        if key in self.registry.local_keys:
+            del self._local()[key]
+            return
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            keys = [p.stem for p in Path(self.registry.entry_dir(self.file_id)).iterdir()
+                    if p.suffix == '.json' and not p.name.startswith('.')]
+        except FileNotFoundError:
+            keys = []
+        return iter(sorted(keys) + list(self.registry._local.get(self.file_id, {}).keys()))
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return f'RegistryEntry({self.file_id!r}, {dict(self)!r})'
+
+
+class FileRegistry(MutableMapping):
+    """
+    Registry of uploaded files (file id -> metadata) stored on disk, so that it can be shared by several worker
+    processes: one directory per file id, one JSON file per metadata key. Values that cannot be serialized
+    (e.g. the parsed questionnaire) are kept per process for the keys listed in local_keys.
+    """
+
+    def __init__(self, registry_dir: Union[str, Path], local_keys: Iterable[str] = ('questionnaire',)):
+        self.registry_dir = Path(registry_dir)
+        self.local_keys = set(local_keys)
+        self._local: Dict[str, Dict[str, Any]] = {}
+        self.registry_dir.mkdir(parents=True, exist_ok=True)
+
+    def entry_dir(self, file_id: str) -> Path:
+        if not RE_KEY.match(file_id):
+            raise KeyError(file_id)
+        return Path(self.registry_dir, file_id)
+
+    def __getitem__(self, file_id: str) -> RegistryEntry:
+        if not self.entry_dir(file_id).is_dir():
+            # removed by another process
+            self._local.pop(file_id, None)
+            raise KeyError(file_id)
+        return RegistryEntry(self, file_id)
+
+    def __setitem__(self, file_id: str, meta: Dict[str, Any]) -> None:
+        if file_id in self:
+            del self[file_id]
+        entry_dir = self.entry_dir(file_id)
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.registry_dir, prefix=f'.{file_id}.', suffix='.tmp'))
+        Path(tmp_dir, CREATED_MARKER).write_text(str(time.time_ns()))
+        entry = RegistryEntry(self, file_id)
+        for key, value in meta.items():
+            if key in self.local_keys:
+                entry[key] = value
+            else:
+                Path(tmp_dir, key + '.json').write_bytes(json.dumps(value).encode('utf-8'))
+        # the entry becomes visible to other processes once it is complete
+        os.replace(tmp_dir, entry_dir)
+
+    def __delitem__(self, file_id: str) -> None:
+        self._local.pop(file_id, None)
+        try:
+            shutil.rmtree(self.entry_dir(file_id))
+        except FileNotFoundError:
+            raise KeyError(file_id)
+
+    def __contains__(self, file_id) -> bool:
+        try:
+            return self.entry_dir(file_id).is_dir()
+        except KeyError:
+            return False
+
+    def _created(self, file_id: str) -> int:
+        try:
+            return int(Path(self.entry_dir(file_id), CREATED_MARKER).read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def __iter__(self) -> Iterator[str]:
+        file_ids = [p.name for p in self.registry_dir.iterdir() if p.is_dir() and not p.name.startswith('.')]
+        # drop process local values of entries removed by other processes
+        for file_id in set(self._local) - set(file_ids):
+            self._local.pop(file_id, None)
+        return iter(sorted(file_ids, key=self._created))
+
+    def local_count(self, key: str) -> int:
+        # number of entries with a process local value for key (e.g. questionnaires parsed by this process)
+        return sum(1 for values in self._local.values() if key in values)
+
+    def local_values(self, key: str) -> Dict[str, Any]:
+        # process local values for key by file id
+        return {file_id: values[key] for file_id, values in self._local.items() if key in values}
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
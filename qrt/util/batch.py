@@ -0,0 +1,190 @@
+"""
+Analyse all questionnaires in a directory (e.g. an archive of several survey waves):
+
+    python -m qrt.util.batch <directory> -o results.jsonl [--jobs 4] [--pattern '*.xml']
+
+read_xml and qml_details run in a pool of worker processes; every result is appended to the output as one JSON line
+as soon as its file is done (in order of completion):
+
+    {"path": "wave1/questionnaire.xml", "sha256": "...", "status": "ok", "pages": 49, "seconds": 0.41,
+     "timings": {"stages": {...}, "counters": {...}}, "details": {...}}
+    {"path": "wave2/broken.xml", "sha256": "...", "status": "error", "error": "ParseError: ...", "seconds": 0.01}
+
+Files whose content hash is already in the output are skipped, so an interrupted run can be resumed with the same
+command.
+"""
+import argparse
+import dataclasses
+import hashlib
+import json
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from qrt.util.qml import read_xml
+from qrt.util.timing import recording, stage
+from qrt.util.util import qml_details
+
+
+def file_sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def find_files(directory: Path, pattern: str = '*.xml') -> List[Path]:
+    """
+    :return: files matching pattern in directory and its subdirectories, sorted by path
+    """
+    return sorted(p for p in Path(directory).rglob(pattern) if p.is_file())
+
+
+def analysed_hashes(output: Path) -> Set[str]:
+    """
+    :param output: JSONL output of an earlier run (may not exist)
+    :return: content hashes of the files in the output
+    """
+    hashes = set()
+    if not output.exists():
+        return hashes
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            try:
+                hashes.add(json.loads(line)['sha256'])
+            except (ValueError, KeyError, TypeError):
+                # e.g. a line cut off when the run was interrupted
+                continue
+    return hashes
+
+
+def _ends_with_newline(path: Path) -> bool:
+    with open(path, 'rb') as f:
+        f.seek(-1, 2)
+        return f.read(1) == b'\n'
+
+
+def _json_default(obj: Any) -> Any:
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    return str(obj)
+
+
+def analyse_file(path: Path, relative_path: str, sha256: str) -> Dict[str, Any]:
+    """
+    :param path: QML file
+    :param relative_path: path to report
+    :param sha256: content hash of the file
+    :return: result record (status "ok" with pages, details and timings, or status "error")
+    """
+    result = {'path': relative_path, 'sha256': sha256}
+    start = time.perf_counter()
+    try:
+        with recording() as recorder:
+            with stage('read_xml'):
+                q = read_xml(path)
+            with stage('qml_details'):
+                details = qml_details(q, path.name)
+        result.update({'status': 'ok', 'pages': len(q.pages), 'timings': recorder.summary(), 'details': details})
+    except Exception as err:
+        result.update({'status': 'error', 'error': f'{type(err).__name__}: {err}',
+                       'traceback': traceback.format_exc(limit=-3)})
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def _analyse_line(path: Path, relative_path: str, sha256: str) -> Tuple[str, str]:
+    # runs in the worker processes: the result is serialized there, only the line is sent back
+    result = analyse_file(path, relative_path, sha256)
+    return result['status'], json.dumps(result, default=_json_default, ensure_ascii=False)
+
+
+def _analyse_in_pool(tasks: List[Tuple[Path, str, str]], jobs: int,
+                     write: Callable[[str, str, str], None]) -> List[Tuple[Path, str, str]]:
+    # :return: the tasks that were not done because a worker process died
+    broken = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_analyse_line, *task): task for task in tasks}
+        for future in as_completed(futures):
+            try:
+                status, line = future.result()
+            except BrokenProcessPool:
+                broken.append(futures[future])
+                continue
+            write(futures[future][1], status, line)
+    return broken
+
+
+def analyse_directory(directory: Path, output: Path, jobs: int = 1, pattern: str = '*.xml',
+                      files: Optional[Iterable[Path]] = None) -> Dict[str, int]:
+    """
+    :param directory: directory with the QML files
+    :param output: JSONL file, results are appended
+    :param jobs: number of worker processes (1: analyse in this process)
+    :param pattern: file name pattern
+    :param files: files to analyse instead of all files in directory that match pattern
+    :return: number of files per status ("ok", "error", "skipped")
+    """
+    directory = Path(directory)
+    output = Path(output)
+    done = analysed_hashes(output)
+    counts = {'ok': 0, 'error': 0, 'skipped': 0}
+    tasks = []
+    for path in (files if files is not None else find_files(directory, pattern)):
+        sha256 = file_sha256(path)
+        if sha256 in done:
+            counts['skipped'] += 1
+            continue
+        # files with the same content are analysed once
+        done.add(sha256)
+        tasks.append((path, path.relative_to(directory).as_posix(), sha256))
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'a', encoding='utf-8') as f:
+        if f.tell() > 0 and not _ends_with_newline(output):
+            # the last line was cut off by an interruption
+            f.write('\n')
+
+        def write(relative_path: str, status: str, line: str) -> None:
+            f.write(line + '\n')
+            # results are kept if the run is interrupted
+            f.flush()
+            counts[status] += 1
+            print(f'[{counts["ok"] + counts["error"]}/{len(tasks)}] {relative_path}: {status}', file=sys.stderr)
+
+        if jobs <= 1:
+            for task in tasks:
+                write(task[1], *_analyse_line(*task))
+        else:
+            # a worker process that dies (e.g. killed when out of memory) fails all pending tasks of the pool: they
+            #  are retried one by one in a new pool, so that only the file that kills its worker is reported
+            for path, relative_path, sha256 in _analyse_in_pool(tasks, jobs, write):
+                if _analyse_in_pool([(path, relative_path, sha256)], 1, write):
+                    result = {'path': relative_path, 'sha256': sha256, 'status': 'error',
+                              'error': 'BrokenProcessPool: the worker process died (e.g. out of memory)'}
+                    write(relative_path, 'error', json.dumps(result, ensure_ascii=False))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse all QML files in a directory, one JSON line per file')
+    parser.add_argument('directory', type=Path, help='directory with the QML files (searched recursively)')
+    parser.add_argument('-o', '--output', type=Path, required=True,
+                        help='JSONL output; files already in it are skipped')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--pattern', default='*.xml', help='file name pattern (default: *.xml)')
+    ns = parser.parse_args()
+    counts = analyse_directory(ns.directory, ns.output, jobs=ns.jobs, pattern=ns.pattern)
+    print(', '.join(f'{status}: {n}' for status, n in counts.items()), file=sys.stderr)
+    return 1 if counts['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
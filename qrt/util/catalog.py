@@ -0,0 +1,268 @@
+"""
+Variable catalog across questionnaires, e.g. the waves of a panel survey:
+
+    catalog = build_catalog({'2021': read_xml(path_2021), '2022': read_xml(path_2022)})
+    catalog.diff('2021', '2022')  # {'added': [...], 'removed': [...], 'retyped': {...}}
+    catalog.save('variables.parquet')  # .npz without pyarrow
+
+The catalog is a columnar table with one row per wave and variable (declared and/or used in the wave). String
+columns are dictionary encoded: an int32 code per row into a sorted array of the distinct values (code of the empty
+string: not declared / not used), so that the comparisons between waves are vectorized NumPy operations on the codes.
+
+    python -m qrt.util.catalog wave1.xml wave2.xml ... [-o variables.parquet]
+
+NumPy is not a requirement of the web app, see requirements-optional.txt.
+"""
+import argparse
+import importlib.util
+import os
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+import numpy as np
+
+from qrt.util.qml import Questionnaire, read_xml
+
+# Parquet is written only if pyarrow is installed
+PYARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+STRING_COLUMNS = ('name', 'declared_type', 'used_type', 'question_type', 'pages')
+
+
+def questionnaire_variables(q: Questionnaire) -> Dict[str, Dict[str, str]]:
+    """
+    :return: per variable (declared or used on any page): declared_type, used_type (of the first use), question_type
+     (of the first use that has one) and pages (uids of the pages using it, space separated); '' if not applicable
+    """
+    variables = defaultdict(lambda: {'declared_type': '', 'used_type': '', 'question_type': '', 'pages': []})
+    for var_name, var in q.var_declarations.items():
+        variables[var_name]['declared_type'] = var.type or ''
+    for p in q.pages:
+        for var_ref in p.body_vars:
+            entry = variables[var_ref.variable.name]
+            if not entry['pages']:
+                entry['used_type'] = var_ref.variable.type or ''
+            if not entry['question_type'] and var_ref.question_type:
+                entry['question_type'] = var_ref.question_type
+            if p.uid not in entry['pages']:
+                entry['pages'].append(p.uid)
+    return {name: {**entry, 'pages': ' '.join(entry['pages'])} for name, entry in variables.items()}
+
+
+class VariableCatalog:
+    def __init__(self, waves: List[str], wave: np.ndarray, codes: Dict[str, np.ndarray],
+                 dictionaries: Dict[str, np.ndarray]):
+        """
+        :param waves: wave labels (in wave order); column wave holds the index of the label
+        :param wave: wave of each row
+        :param codes: per string column, the index of each row's value in the dictionary of the column
+        :param dictionaries: per string column, the sorted distinct values (including '')
+        """
+        self.waves = list(waves)
+        self.wave = wave
+        self.codes = codes
+        self.dictionaries = dictionaries
+        self._matrices: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_columns(cls, waves: List[str], wave: Iterable[int], columns: Mapping[str, Iterable[str]]) \
+            -> 'VariableCatalog':
+        codes, dictionaries = {}, {}
+        for column in STRING_COLUMNS:
+            # '' is always part of the dictionary (code 0)
+            values, inverse = np.unique(np.array([''] + list(columns[column]), dtype=str), return_inverse=True)
+            dictionaries[column] = values
+            codes[column] = inverse[1:].astype(np.int32)
+        return cls(waves, np.asarray(list(wave), dtype=np.int32), codes, dictionaries)
+
+    def __len__(self) -> int:
+        return len(self.wave)
+
+    def column(self, column: str) -> np.ndarray:
+        """
+        :return: values of a column (wave labels for "wave")
+        """
+        if column == 'wave':
+            return np.array(self.waves, dtype=str)[self.wave]
+        return self.dictionaries[column][self.codes[column]]
+
+    def rows(self, wave: Optional[str] = None) -> List[Dict[str, str]]:
+        mask = self._wave_mask(wave) if wave is not None else slice(None)
+        columns = {column: self.column(column)[mask].tolist() for column in ('wave',) + STRING_COLUMNS}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    def _wave_index(self, wave: str) -> int:
+        try:
+            return self.waves.index(wave)
+        except ValueError:
+            raise KeyError(f'unknown wave "{wave}"')
+
+    def _wave_mask(self, wave: str) -> np.ndarray:
+        return self.wave == self._wave_index(wave)
+
+    def _matrix(self, column: str) -> np.ndarray:
+        # variables x waves: code of the column per variable and wave, -1 if the variable is not in the wave
+        if column not in self._matrices:
+            matrix = np.full((len(self.dictionaries['name']), len(self.waves)), -1, dtype=np.int32)
+            matrix[self.codes['name'], self.wave] = self.codes[column]
+            self._matrices[column] = matrix
+        return self._matrices[column]
+
+    def _type_matrix(self) -> np.ndarray:
+        # declared type, used type of undeclared variables; codes of the declared_type dictionary
+        if 'type' not in self._matrices:
+            declared = self.dictionaries['declared_type']
+            used_as_declared = np.searchsorted(declared, self.dictionaries['used_type'])
+            # used types that are no declared type get codes beyond the dictionary
+            unknown = (used_as_declared >= len(declared)) | \
+                      (declared[np.minimum(used_as_declared, len(declared) - 1)] != self.dictionaries['used_type'])
+            used_as_declared[unknown] = len(declared) + np.arange(unknown.sum())
+            type_codes = np.where(self.codes['declared_type'] != 0, self.codes['declared_type'],
+                                  used_as_declared[self.codes['used_type']])
+            matrix = np.full((len(self.dictionaries['name']), len(self.waves)), -1, dtype=np.int64)
+            matrix[self.codes['name'], self.wave] = type_codes
+            self._matrices['type'] = matrix
+            self._type_names = np.concatenate([declared, self.dictionaries['used_type'][unknown]])
+        return self._matrices['type']
+
+    def presence(self) -> np.ndarray:
+        """
+        :return: variables x waves (rows in the order of the name dictionary): whether the variable is in the wave
+        """
+        return self._matrix('name') >= 0
+
+    def waves_present(self) -> Dict[str, List[str]]:
+        """
+        :return: per variable name, the waves that declare or use it
+        """
+        presence = self.presence()
+        waves = np.array(self.waves, dtype=object)
+        return {name: waves[row].tolist() for name, row in zip(self.dictionaries['name'].tolist(), presence)}
+
+    def added(self, from_wave: str, to_wave: str) -> List[str]:
+        presence = self.presence()
+        mask = presence[:, self._wave_index(to_wave)] & ~presence[:, self._wave_index(from_wave)]
+        return self.dictionaries['name'][mask].tolist()
+
+    def removed(self, from_wave: str, to_wave: str) -> List[str]:
+        return self.added(to_wave, from_wave)
+
+    def retyped(self, from_wave: str, to_wave: str) -> Dict[str, Tuple[str, str]]:
+        """
+        :return: variables in both waves whose type (declared type, or used type if not declared) differs:
+         name -> (type in from_wave, type in to_wave)
+        """
+        types = self._type_matrix()
+        a, b = types[:, self._wave_index(from_wave)], types[:, self._wave_index(to_wave)]
+        mask = (a >= 0) & (b >= 0) & (a != b)
+        return {name: (type_a, type_b) for name, type_a, type_b in
+                zip(self.dictionaries['name'][mask].tolist(), self._type_names[a[mask]].tolist(),
+                    self._type_names[b[mask]].tolist())}
+
+    def diff(self, from_wave: str, to_wave: str) -> Dict[str, Union[List[str], Dict[str, Tuple[str, str]]]]:
+        return {'added': self.added(from_wave, to_wave),
+                'removed': self.removed(from_wave, to_wave),
+                'retyped': self.retyped(from_wave, to_wave)}
+
+    def declared_not_used(self, wave: str) -> List[str]:
+        mask = self._wave_mask(wave) & (self.codes['declared_type'] != 0) & (self.codes['pages'] == 0)
+        return self.column('name')[mask].tolist()
+
+    def used_not_declared(self, wave: str) -> List[str]:
+        mask = self._wave_mask(wave) & (self.codes['declared_type'] == 0)
+        return self.column('name')[mask].tolist()
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        :param path: .parquet (requires pyarrow) or .npz file
+        """
+        path = Path(path)
+        if path.suffix == '.parquet':
+            if not PYARROW_AVAILABLE:
+                raise ModuleNotFoundError('pyarrow is required to write Parquet files (or use .npz)')
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            arrays = {'wave': pa.DictionaryArray.from_arrays(pa.array(self.wave), pa.array(self.waves, pa.string()))}
+            for column in STRING_COLUMNS:
+                arrays[column] = pa.DictionaryArray.from_arrays(pa.array(self.codes[column]),
+                                                                pa.array(self.dictionaries[column].tolist(),
+                                                                         pa.string()))
+            pq.write_table(pa.table(arrays), path)
+        else:
+            np.savez_compressed(path, waves=np.array(self.waves, dtype=str), wave=self.wave,
+                                **{f'codes_{column}': self.codes[column] for column in STRING_COLUMNS},
+                                **{f'dictionary_{column}': self.dictionaries[column] for column in STRING_COLUMNS})
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'VariableCatalog':
+        path = Path(path)
+        if path.suffix == '.parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(path).to_pydict()
+            waves = list(dict.fromkeys(table['wave']))
+            return cls.from_columns(waves, [waves.index(w) for w in table['wave']], table)
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['waves'].tolist(), data['wave'],
+                       {column: data[f'codes_{column}'] for column in STRING_COLUMNS},
+                       {column: data[f'dictionary_{column}'] for column in STRING_COLUMNS})
+
+
+def build_catalog(questionnaires: Mapping[str, Questionnaire]) -> VariableCatalog:
+    """
+    :param questionnaires: wave label -> questionnaire, in wave order
+    :return: catalog with one row per wave and variable
+    """
+    wave = []
+    columns = {column: [] for column in STRING_COLUMNS}
+    for wave_index, q in enumerate(questionnaires.values()):
+        for name, entry in sorted(questionnaire_variables(q).items()):
+            wave.append(wave_index)
+            columns['name'].append(name)
+            for column in STRING_COLUMNS[1:]:
+                columns[column].append(entry[column])
+    return VariableCatalog.from_columns(list(questionnaires), wave, columns)
+
+
+def wave_labels(xml_files: List[Path]) -> List[str]:
+    """
+    :return: the file names without suffix, or, if they are not unique (e.g. wave1/questionnaire.xml and
+     wave2/questionnaire.xml), the paths relative to the common directory of the files without suffix
+    :raises ValueError: if a file is given twice
+    """
+    labels = [xml_file.stem for xml_file in xml_files]
+    if len(set(labels)) < len(labels):
+        resolved = [xml_file.resolve() for xml_file in xml_files]
+        common = Path(os.path.commonpath([p.parent for p in resolved]))
+        labels = [p.relative_to(common).with_suffix('').as_posix() for p in resolved]
+    duplicates = sorted({label for label in labels if labels.count(label) > 1})
+    if duplicates:
+        raise ValueError(f'files given more than once: {duplicates}')
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Variable catalog of several questionnaires (waves, in the given '
+                                                 'order); prints the differences between consecutive waves')
+    parser.add_argument('xml_files', nargs='+', type=Path,
+                        help='QML files; the wave labels are the file names (or the relative paths if the file names '
+                             'are not unique)')
+    parser.add_argument('-o', '--output', type=Path, help='catalog file (.parquet or .npz)')
+    ns = parser.parse_args()
+    try:
+        labels = wave_labels(ns.xml_files)
+    except ValueError as err:
+        parser.error(str(err))
+    catalog = build_catalog({label: read_xml(xml_file) for label, xml_file in zip(labels, ns.xml_files)})
+    for from_wave, to_wave in zip(catalog.waves, catalog.waves[1:]):
+        diff = catalog.diff(from_wave, to_wave)
+        print(f'{from_wave} -> {to_wave}: {len(diff["added"])} added, {len(diff["removed"])} removed, '
+              f'{len(diff["retyped"])} retyped')
+        for name, (type_a, type_b) in diff['retyped'].items():
+            print(f'    {name}: {type_a} -> {type_b}')
+    if ns.output is not None:
+        catalog.save(ns.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,14 @@
+import html
+import importlib.util
 import re
 from collections import defaultdict
 from pathlib import Path
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Union
 import networkx as nx
+from qrt.util.graphcache import LayoutCache, graph_fingerprint
 from qrt.util.qml import Questionnaire, read_xml
 from qrt.util.qmlutil import flatten
+from qrt.util.timing import stage, count
 
 
 def prepare_digraph(q: Questionnaire, options_dict: Optional[Dict[str, bool]] = None) -> nx.DiGraph:
@@ -89,6 +93,16 @@ def combine_transition_cond(q: Questionnaire, remove_cond_false: bool = False,
     return result
 
 
+def page_variables(q: Questionnaire) -> Dict[str, List[str]]:
+    vars_d = defaultdict(set)
+    [vars_d[uid].clear() for uid in [p.uid for p in q.pages]]
+    # add page variables from body to dict
+    [[vars_d[p.uid].add(var.variable.name) for var in p.body_vars] for p in q.pages]
+    # add page variables from triggers to dict
+    [[vars_d[p.uid].add(var) for var in p.triggers_vars_explicit] for p in q.pages]
+    return {k: sorted(list(v)) for k, v in vars_d.items()}
+
+
 def digraph(q: Questionnaire,
             show_var: bool = True,
             show_cond: bool = True,
@@ -137,13 +151,7 @@ def digraph(q: Questionnaire,
     g.add_edges_from([t for t in tr_tuples])
 
     if show_var:
-        vars_d = defaultdict(set)
-        [vars_d[uid].clear() for uid in [p.uid for p in q.pages]]
-        # add page variables from body to dict
-        [[vars_d[p.uid].add(var.variable.name) for var in p.body_vars] for p in q.pages]
-        # add page variables from triggers to dict
-        [[vars_d[p.uid].add(var) for var in p.triggers_vars_explicit] for p in q.pages]
-        vars_d = {k: sorted(list(v)) for k, v in vars_d.items()}
+        vars_d = page_variables(q)
         replacement_dict = {
             uid: f'{uid}\\n[' + ',\\n'.join(
                 [",".join(y) for y in [vars_d[uid][i:i + 3] for i in range(0, len(vars_d[uid]), 3)]]) + ']' for uid
@@ -154,6 +162,348 @@ def digraph(q: Questionnaire,
     return g
 
 
+# layout presets: graphviz program and additional graph attributes
+LAYOUT_ENGINES = {
+    'dot': ('dot', {}),
+    # ranked layout with straight edges and limited crossing minimization / network simplex iterations
+    'dot-fast': ('dot', {'splines': 'line', 'mclimit': '0.2', 'nslimit': '2', 'nslimit1': '2', 'remincross': 'false'}),
+    'sfdp': ('sfdp', {'overlap': 'scale', 'splines': 'false'}),
+    # built-in renderer (see draw_svg), does not need graphviz
+    'layered': ('layered', {}),
+}
+# thresholds for the automatic engine selection ('auto')
+LAYOUT_DOT_MAX_NODES = 400
+LAYOUT_DOT_MAX_EDGES = 800
+LAYOUT_DOT_FAST_MAX_NODES = 1500
+LAYOUT_DOT_FAST_MAX_EDGES = 3000
+
+RE_UID_PREFIX = re.compile(r'^[a-zA-Z]+')
+
+
+def available_layout_engines() -> List[str]:
+    # the graphviz engines need pygraphviz
+    if importlib.util.find_spec('pygraphviz') is None:
+        return [engine for engine, (prog, _) in LAYOUT_ENGINES.items() if prog == 'layered']
+    return list(LAYOUT_ENGINES)
+
+
+def select_layout_engine(g: nx.DiGraph) -> str:
+    if g.number_of_nodes() <= LAYOUT_DOT_MAX_NODES and g.number_of_edges() <= LAYOUT_DOT_MAX_EDGES:
+        return 'dot'
+    if g.number_of_nodes() <= LAYOUT_DOT_FAST_MAX_NODES and g.number_of_edges() <= LAYOUT_DOT_FAST_MAX_EDGES:
+        return 'dot-fast'
+    return 'sfdp'
+
+
+def uid_prefix(node: str) -> str:
+    match = RE_UID_PREFIX.match(node)
+    if match is None:
+        return node
+    return match.group(0)
+
+
+def collapse_uid_prefixes(g: nx.DiGraph) -> nx.DiGraph:
+    """
+    Collapse all pages sharing the same alphabetic uid prefix (e.g. "A01", "A02", ... -> "A") into one node; a page
+    that is the only one with its prefix keeps its uid.
+    Transitions within a group are dropped, parallel transitions between groups are merged into one edge that is
+    labelled with the number of merged transitions.
+
+    :param g: page graph as returned by digraph()
+    :return: collapsed graph
+    """
+    groups = defaultdict(list)
+    for node in g.nodes:
+        groups[uid_prefix(node)].append(node)
+
+    c = nx.DiGraph()
+    # page -> node of its group in the collapsed graph; pages without other pages of their prefix are kept as is
+    group_node = {}
+    for prefix, nodes in groups.items():
+        if len(nodes) == 1:
+            c.add_node(nodes[0], **g.nodes[nodes[0]])
+            group_node[nodes[0]] = nodes[0]
+            continue
+        attrs = {k: v for k, v in g.nodes[nodes[0]].items() if k in ['style', 'fillcolor']}
+        c.add_node(prefix, label=f'{prefix}*\\n({len(nodes)} pages)', **attrs)
+        group_node.update({node: prefix for node in nodes})
+
+    edge_counts = defaultdict(int)
+    edge_colors = {}
+    for u, v, attrs in g.edges(data=True):
+        cu, cv = group_node[u], group_node[v]
+        if cu == cv:
+            continue
+        edge_counts[(cu, cv)] += 1
+        if 'color' in attrs:
+            edge_colors[(cu, cv)] = attrs['color']
+    for (cu, cv), count in edge_counts.items():
+        attrs = {}
+        if count > 1:
+            attrs['label'] = str(count)
+        if (cu, cv) in edge_colors:
+            attrs['color'] = edge_colors[(cu, cv)]
+        c.add_edge(cu, cv, **attrs)
+    return c
+
+
+def graph_data(q: Questionnaire,
+               show_cond: bool = True,
+               show_jumper: bool = False,
+               color_nodes: bool = True,
+               replace_zofar_cond: bool = False) -> Dict[str, List[Dict[str, Union[str, List[str]]]]]:
+    """
+    Compact node/edge list of the page graph for client-side rendering. Attributes that are not set are omitted.
+
+    :return: {'nodes': [{'id', 'vars', 'color'}], 'edges': [{'source', 'target', 'label', 'color'}]}
+    """
+    g = digraph(q=q, show_var=False, show_cond=show_cond, show_jumper=show_jumper, color_nodes=color_nodes,
+                replace_zofar_cond=replace_zofar_cond)
+    vars_d = page_variables(q)
+    nodes = []
+    for node, attrs in g.nodes(data=True):
+        node_dict = {'id': node}
+        if vars_d.get(node):
+            node_dict['vars'] = vars_d[node]
+        if 'fillcolor' in attrs:
+            node_dict['color'] = attrs['fillcolor']
+        nodes.append(node_dict)
+    edges = []
+    for u, v, attrs in g.edges(data=True):
+        edge_dict = {'source': u, 'target': v}
+        if attrs.get('label') is not None:
+            edge_dict['label'] = attrs['label']
+        if 'color' in attrs:
+            edge_dict['color'] = attrs['color']
+        edges.append(edge_dict)
+    return {'nodes': nodes, 'edges': edges}
+
+
+# pure-python layered (Sugiyama-style) layout and SVG output, used if pygraphviz is not available
+SVG_FONT_SIZE = 14
+SVG_CHAR_WIDTH = 8.4
+SVG_LINE_HEIGHT = 18
+SVG_NODE_PADDING = 10
+SVG_NODE_SEP = 30
+SVG_RANK_SEP = 60
+SVG_ORDERING_SWEEPS = 4
+
+
+def _label_lines(label: Optional[str]) -> List[str]:
+    if label is None:
+        return []
+    # graphviz-style escaped newlines (as used by digraph) and real newlines
+    return [line for line in str(label).replace('\\n', '\n').split('\n')]
+
+
+def _node_label(g: nx.DiGraph, node) -> str:
+    return g.nodes[node].get('label', node)
+
+
+def _acyclic_edges(g: nx.DiGraph) -> List[Tuple[str, str, bool]]:
+    """
+    Orient all edges so that they form a DAG: edges closing a cycle (back edges of a depth-first search) are
+    reversed. Self loops are dropped.
+
+    :return: list of (u, v, reversed) tuples
+    """
+    visited, on_stack = set(), set()
+    back_edges = set()
+    for root in g.nodes:
+        if root in visited:
+            continue
+        visited.add(root)
+        on_stack.add(root)
+        stack = [(root, iter(g.successors(root)))]
+        while stack:
+            node, successors = stack[-1]
+            for succ in successors:
+                if succ in on_stack:
+                    back_edges.add((node, succ))
+                elif succ not in visited:
+                    visited.add(succ)
+                    on_stack.add(succ)
+                    stack.append((succ, iter(g.successors(succ))))
+                    break
+            else:
+                stack.pop()
+                on_stack.discard(node)
+    result = []
+    for u, v in g.edges:
+        if u == v:
+            continue
+        if (u, v) in back_edges:
+            result.append((v, u, True))
+        else:
+            result.append((u, v, False))
+    return result
+
+
+def layered_layout(g: nx.DiGraph) -> Tuple[Dict[str, Tuple[float, float, float, float]],
+                                           List[Tuple[str, str, List[Tuple[float, float]]]]]:
+    """
+    Layered layout: cycle removal, longest path layering, dummy nodes for long edges, barycenter ordering and
+    simple coordinate assignment.
+
+    :param g: graph
+    :return: node boxes {node: (x_center, y_center, width, height)} and edge routes [(u, v, [points])]
+    """
+    dag_edges = _acyclic_edges(g)
+    dag = nx.DiGraph()
+    dag.add_nodes_from(g.nodes)
+    dag.add_edges_from([(u, v) for u, v, _ in dag_edges])
+
+    # longest path layering
+    layer = {}
+    for node in nx.topological_sort(dag):
+        layer[node] = max([layer[pred] + 1 for pred in dag.predecessors(node)], default=0)
+
+    # split long edges by dummy nodes
+    dummy_count = 0
+    chains = []
+    ranked = nx.DiGraph()
+    ranked.add_nodes_from(g.nodes)
+    for u, v, is_reversed in dag_edges:
+        chain = [u]
+        for rank in range(layer[u] + 1, layer[v]):
+            dummy = ('dummy', dummy_count)
+            dummy_count += 1
+            layer[dummy] = rank
+            chain.append(dummy)
+        chain.append(v)
+        ranked.add_edges_from(zip(chain[:-1], chain[1:]))
+        chains.append((u, v, is_reversed, chain))
+
+    layers = defaultdict(list)
+    for node in ranked.nodes:
+        layers[layer[node]].append(node)
+    layer_indices = sorted(layers.keys())
+
+    # crossing reduction: barycenter heuristic, alternating downward and upward sweeps
+    position = {node: i for rank in layer_indices for i, node in enumerate(layers[rank])}
+    for sweep in range(SVG_ORDERING_SWEEPS):
+        downward = sweep % 2 == 0
+        for rank in (layer_indices[1:] if downward else reversed(layer_indices[:-1])):
+            neighbours = ranked.predecessors if downward else ranked.successors
+
+            def barycenter(node):
+                values = [position[n] for n in neighbours(node)]
+                if not values:
+                    return position[node]
+                return sum(values) / len(values)
+
+            layers[rank].sort(key=barycenter)
+            position.update({node: i for i, node in enumerate(layers[rank])})
+
+    # coordinates
+    sizes = {}
+    for node in ranked.nodes:
+        if node in g.nodes:
+            lines = _label_lines(_node_label(g, node)) or ['']
+            sizes[node] = (max(len(line) for line in lines) * SVG_CHAR_WIDTH + 2 * SVG_NODE_PADDING,
+                           len(lines) * SVG_LINE_HEIGHT + 2 * SVG_NODE_PADDING)
+        else:
+            sizes[node] = (0, 0)
+    layer_widths = {rank: sum(sizes[n][0] for n in layers[rank]) + SVG_NODE_SEP * (len(layers[rank]) - 1)
+                    for rank in layer_indices}
+    max_width = max(layer_widths.values(), default=0)
+
+    boxes = {}
+    y = SVG_NODE_SEP
+    for rank in layer_indices:
+        height = max([sizes[n][1] for n in layers[rank]], default=0)
+        x = SVG_NODE_SEP + (max_width - layer_widths[rank]) / 2
+        for node in layers[rank]:
+            width, node_height = sizes[node]
+            boxes[node] = (x + width / 2, y + height / 2, width, node_height)
+            x += width + SVG_NODE_SEP
+        y += height + SVG_RANK_SEP
+
+    routes = []
+    for u, v, is_reversed, chain in chains:
+        points = []
+        for i, node in enumerate(chain):
+            cx, cy, width, height = boxes[node]
+            if i == 0:
+                points.append((cx, cy + height / 2))
+            elif i == len(chain) - 1:
+                points.append((cx, cy - height / 2))
+            else:
+                points.append((cx, cy))
+        if is_reversed:
+            routes.append((v, u, list(reversed(points))))
+        else:
+            routes.append((u, v, points))
+    for u, v in g.edges:
+        if u == v:
+            cx, cy, width, height = boxes[u]
+            right = cx + width / 2
+            routes.append((u, v, [(right, cy - height / 4), (right + SVG_NODE_SEP / 2, cy),
+                                  (right, cy + height / 4)]))
+
+    return {node: box for node, box in boxes.items() if node in g.nodes}, routes
+
+
+def svg_color(color: str) -> str:
+    # graphviz/X11 color variants like "brown4" are not valid in SVG; fall back to the base color
+    if color.startswith('#'):
+        return color
+    return color.rstrip('0123456789') or 'black'
+
+
+def draw_svg(g: nx.DiGraph, out_file: Path, graph_label: Optional[str] = None,
+             layout: Optional[Tuple[Dict[str, Tuple[float, float, float, float]],
+                                    List[Tuple[str, str, List[Tuple[float, float]]]]]] = None) -> None:
+    """
+    :param layout: result of layered_layout(g), computed if not given
+    """
+    boxes, routes = layout if layout is not None else layered_layout(g)
+    width = max([cx + w / 2 for cx, _, w, _ in boxes.values()], default=0) + 2 * SVG_NODE_SEP
+    height = max([cy + h / 2 for _, cy, _, h in boxes.values()], default=0) + 2 * SVG_NODE_SEP
+    if graph_label is not None:
+        height += SVG_LINE_HEIGHT
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}pt" height="{height:.0f}pt" '
+           f'viewBox="0 0 {width:.0f} {height:.0f}" font-family="Times,serif" font-size="{SVG_FONT_SIZE}">',
+           '<defs><marker id="arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="8" markerHeight="8" '
+           'orient="auto-start-reverse"><path d="M 0 0 L 10 5 L 0 10 z" fill="context-stroke"/></marker></defs>',
+           '<rect width="100%" height="100%" fill="white"/>']
+
+    for u, v, points in routes:
+        attrs = g.edges[u, v]
+        color = svg_color(attrs.get('color', 'black'))
+        points_str = ' '.join(f'{x:.1f},{y:.1f}' for x, y in points)
+        out.append(f'<g class="edge"><title>{html.escape(str(u))}-&gt;{html.escape(str(v))}</title>'
+                   f'<polyline points="{points_str}" fill="none" stroke="{color}" marker-end="url(#arrow)"/>')
+        label_lines = _label_lines(attrs.get('label'))
+        if label_lines:
+            mx, my = points[len(points) // 2] if len(points) > 2 else (
+                (points[0][0] + points[-1][0]) / 2, (points[0][1] + points[-1][1]) / 2)
+            out.append(f'<text x="{mx + 4:.1f}" y="{my:.1f}" font-size="{SVG_FONT_SIZE - 4}">' + ''.join(
+                f'<tspan x="{mx + 4:.1f}" dy="{0 if i == 0 else SVG_LINE_HEIGHT - 4}">{html.escape(line)}</tspan>'
+                for i, line in enumerate(label_lines)) + '</text>')
+        out.append('</g>')
+
+    for node, (cx, cy, w, h) in boxes.items():
+        attrs = g.nodes[node]
+        fill = svg_color(attrs['fillcolor']) if attrs.get('style') == 'filled' and 'fillcolor' in attrs else 'none'
+        stroke = svg_color(attrs.get('color', 'black'))
+        lines = _label_lines(_node_label(g, node))
+        text_y = cy - (len(lines) - 1) * SVG_LINE_HEIGHT / 2 + SVG_FONT_SIZE / 3
+        out.append(f'<g class="node"><title>{html.escape(str(node))}</title>'
+                   f'<rect x="{cx - w / 2:.1f}" y="{cy - h / 2:.1f}" width="{w:.1f}" height="{h:.1f}" '
+                   f'fill="{fill}" stroke="{stroke}"/>'
+                   f'<text text-anchor="middle" x="{cx:.1f}" y="{text_y:.1f}">' + ''.join(
+                    f'<tspan x="{cx:.1f}" dy="{0 if i == 0 else SVG_LINE_HEIGHT}">{html.escape(line)}</tspan>'
+                    for i, line in enumerate(lines)) + '</text></g>')
+
+    if graph_label is not None:
+        out.append(f'<text text-anchor="middle" x="{width / 2:.1f}" y="{height - SVG_NODE_SEP / 2:.1f}">'
+                   f'{html.escape(graph_label)}</text>')
+    out.append('</svg>')
+    Path(out_file).write_text('\n'.join(out), encoding='utf-8')
+
+
 def make_flowchart(q: Questionnaire,
                    out_file: Path,
                    filename: Optional[str] = None,
@@ -161,16 +511,65 @@ def make_flowchart(q: Questionnaire,
                    show_cond: bool = True,
                    color_nodes: bool = False,
                    show_jumper: bool = False,
-                   replace_zofar_cond: bool = False) -> bool:
-    g = digraph(q=q, show_var=show_var, show_cond=show_cond, color_nodes=color_nodes, show_jumper=show_jumper,
-                replace_zofar_cond=replace_zofar_cond)
+                   replace_zofar_cond: bool = False,
+                   cache: Optional[LayoutCache] = None,
+                   engine: str = 'auto',
+                   collapse_prefixes: bool = False) -> bool:
+    """
+    :param engine: one of LAYOUT_ENGINES or 'auto' (chosen by graph size, see select_layout_engine; falls back to
+     the built-in 'layered' renderer if pygraphviz is not installed)
+    :param collapse_prefixes: collapse pages by uid prefix (see collapse_uid_prefixes)
+    """
+    with stage('flowchart.graph'):
+        g = digraph(q=q, show_var=show_var and not collapse_prefixes, show_cond=show_cond and not collapse_prefixes,
+                    color_nodes=color_nodes, show_jumper=show_jumper, replace_zofar_cond=replace_zofar_cond)
+        if collapse_prefixes:
+            g = collapse_uid_prefixes(g)
+    if engine == 'auto':
+        engine = select_layout_engine(g) if importlib.util.find_spec('pygraphviz') is not None else 'layered'
+    if engine not in LAYOUT_ENGINES:
+        raise ValueError(f'unknown layout engine: "{engine}"; must be one of {["auto", *LAYOUT_ENGINES.keys()]}')
+    if engine not in available_layout_engines():
+        raise ValueError(f'layout engine "{engine}" is not available (pygraphviz is not installed); '
+                         f'use one of {["auto", *available_layout_engines()]}')
+    prog, engine_graph_attr = LAYOUT_ENGINES[engine]
+
     # ToDo: add filename
-    a = nx.nx_agraph.to_agraph(g)
-    a.node_attr['shape'] = 'box'
+    graph_attr = dict(engine_graph_attr)
+    node_attr = {'shape': 'box'}
     if filename is not None:
-        a.graph_attr['label'] = filename
-    a.layout('dot')
-    a.draw(out_file)
+        graph_attr['label'] = filename
+
+    out_suffix = Path(out_file).suffix.lstrip('.')
+    fingerprint = None
+    if cache is not None:
+        with stage('flowchart.cache'):
+            fingerprint = graph_fingerprint(g, graph_attr=graph_attr, node_attr=node_attr, engine=prog)
+            cache_hit = cache.copy_to(fingerprint, out_suffix, out_file)
+        if cache_hit:
+            count('flowchart.cache_hits')
+            return True
+        count('flowchart.cache_misses')
+
+    if prog == 'layered':
+        if out_suffix != 'svg':
+            raise ValueError(f'layout engine "layered" only supports svg output, not "{out_suffix}"')
+        with stage('flowchart.layout'):
+            layout = layered_layout(g)
+        with stage('flowchart.draw'):
+            draw_svg(g, out_file, graph_label=filename, layout=layout)
+    else:
+        with stage('flowchart.graphviz'):
+            with stage('flowchart.layout'):
+                a = nx.nx_agraph.to_agraph(g)
+                a.node_attr.update(node_attr)
+                a.graph_attr.update(graph_attr)
+                a.layout(prog)
+            with stage('flowchart.draw'):
+                a.draw(out_file)
+
+    if cache is not None:
+        cache.put(fingerprint, out_suffix, out_file)
     return True
 
 
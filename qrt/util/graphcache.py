@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+
+
+def graph_fingerprint(g: 'nx.DiGraph',
+                      graph_attr: Optional[Dict[str, str]] = None,
+                      node_attr: Optional[Dict[str, str]] = None,
+                      engine: str = 'dot') -> str:
+    """
+    Canonical fingerprint of a graph: independent of the insertion order of nodes and edges, but sensitive to
+    every node, edge and graph attribute and to the layout engine.
+
+    :param g: graph to be rendered
+    :param graph_attr: graph attributes that will be set on the rendered graph
+    :param node_attr: default node attributes that will be set on the rendered graph
+    :param engine: layout engine
+    :return: hex digest
+    """
+    data = {'nodes': sorted([str(node), sorted([(str(k), str(v)) for k, v in attrs.items()])]
+                            for node, attrs in g.nodes(data=True)),
+            'edges': sorted([str(u), str(v), sorted([(str(k), str(val)) for k, val in attrs.items()])]
+                            for u, v, attrs in g.edges(data=True)),
+            'graph_attr': sorted((str(k), str(v)) for k, v in (graph_attr or {}).items()),
+            'node_attr': sorted((str(k), str(v)) for k, v in (node_attr or {}).items()),
+            'engine': engine}
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class LayoutCache:
+    """
+    Size-bounded on-disk cache of rendered (laid out) graphs, keyed by graph fingerprint and output format.
+    Least recently used entries are evicted once the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str, suffix: str) -> Path:
+        return Path(self.cache_dir, key + '.' + suffix.lstrip('.'))
+
+    def get(self, key: str, suffix: str) -> Optional[Path]:
+        """
+        :return: path of the entry; it may be evicted by another process at any time, use copy_to to read it
+        """
+        path = self._path(key, suffix)
+        try:
+            # mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def copy_to(self, key: str, suffix: str, target_file: Union[str, Path]) -> bool:
+        """
+        Copy an entry to target_file. The entry is opened before it is copied, so that eviction by another process
+        in between cannot fail the copy.
+
+        :return: False if there is no such entry (a cache miss)
+        """
+        path = self._path(key, suffix)
+        try:
+            with open(path, 'rb') as f:
+                # mark as recently used
+                os.utime(f.fileno())
+                with open(target_file, 'wb') as target:
+                    shutil.copyfileobj(f, target)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key: str, suffix: str, source_file: Union[str, Path]) -> Path:
+        path = self._path(key, suffix)
+        # unique temporary file: the same layout may be stored by several threads at the same time
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, prefix=f'.{path.name}.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as target, open(source_file, 'rb') as f:
+                shutil.copyfileobj(f, target)
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        self.evict()
+        return path
+
+    def entries(self):
+        return [p for p in self.cache_dir.iterdir() if p.is_file() and not p.name.startswith('.')]
+
+    def size(self) -> int:
+        return sum(p.stat().st_size for p in self.entries())
+
+    def evict(self) -> None:
+        stats = []
+        for p in self.entries():
+            try:
+                stats.append((p, p.stat()))
+            except FileNotFoundError:
+                continue
+        total = sum(st.st_size for _, st in stats)
+        for p, st in sorted(stats, key=lambda x: x[1].st_mtime):
+            if total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= st.st_size
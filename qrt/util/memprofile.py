@@ -0,0 +1,62 @@
+"""
+Opt-in memory profiling based on tracemalloc. Tracing slows down allocations considerably, so it is only started
+on request (qform: environment variable MEMORY_PROFILE=<number of frames per traceback>):
+
+    start(frames=1)
+    with recording(TimingRecorder(trace_memory=True)) as recorder:
+        q = read_xml(path)
+    recorder.summary()  # stages with peak_bytes and retained_bytes
+    top_allocations(limit=20)
+
+Only allocations of the Python memory allocators are traced; memory that libxml2 allocates for lxml trees is not
+included.
+"""
+import tracemalloc
+from typing import Any, Dict, List
+
+GROUP_BY = ('lineno', 'filename', 'traceback')
+
+# allocations of the profiling itself
+_IGNORED_FILES = [tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>',
+                  '<unknown>']
+
+
+def start(frames: int = 1) -> None:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(frames, 1))
+
+
+def stop() -> None:
+    tracemalloc.stop()
+
+
+def enabled() -> bool:
+    return tracemalloc.is_tracing()
+
+
+def traced_memory() -> Dict[str, int]:
+    """
+    :return: currently traced bytes and their peak (since the start or the last reset by a stage)
+    """
+    if not tracemalloc.is_tracing():
+        return {}
+    current, peak = tracemalloc.get_traced_memory()
+    return {'traced_bytes': current, 'peak_bytes': peak, 'tracemalloc_bytes': tracemalloc.get_tracemalloc_memory()}
+
+
+def top_allocations(limit: int = 20, group_by: str = 'lineno') -> List[Dict[str, Any]]:
+    """
+    :param limit: number of allocation sites
+    :param group_by: 'lineno', 'filename' or 'traceback' (requires more than 1 frame, see start)
+    :return: allocation sites holding the most memory
+    """
+    if group_by not in GROUP_BY:
+        raise ValueError(f'group_by has to be one of {", ".join(GROUP_BY)}, got "{group_by}"')
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, filename) for filename in _IGNORED_FILES])
+    return [{'size_bytes': stat.size,
+             'count': stat.count,
+             'traceback': [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback]}
+            for stat in snapshot.statistics(group_by)[:limit]]
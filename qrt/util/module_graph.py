@@ -2,16 +2,39 @@ import argparse
 import os
 import traceback
 from pathlib import Path
-from typing import List, Optional
-
-from networkx import NetworkXError
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
 from qrt.util.misc import flatten
-import networkx as nx
 from qrt.util.qml import Questionnaire, read_xml
-# import pygraphviz
-import numpy as np
-import matplotlib as mpl
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+# hex values of the (CSS) color names used for the module graphs
+HEX_COLORS = {'black': '#000000', 'white': '#ffffff', 'grey': '#808080', 'gray': '#808080', 'blue': '#0000ff',
+              'pink': '#ffc0cb', 'green': '#008000', 'orange': '#ffa500', 'cyan': '#00ffff', 'red': '#ff0000',
+              'lime': '#00ff00', 'yellow': '#ffff00'}
+
+
+def hex_to_rgb(color_hex: str) -> Tuple[float, float, float]:
+    return tuple(int(color_hex[i:i + 2], 16) / 255 for i in (1, 3, 5))
+
+
+def rgb_to_hex(rgb: Tuple[float, float, float]) -> str:
+    return '#' + ''.join(f'{round(min(max(c, 0.0), 1.0) * 255):02x}' for c in rgb)
+
+
+def color_str_to_hex(color_str: str) -> str:
+    color_str = color_str.strip().lower()
+    if color_str in HEX_COLORS:
+        return HEX_COLORS[color_str]
+    if len(color_str) == 7 and color_str.startswith('#'):
+        try:
+            int(color_str[1:], 16)
+            return color_str
+        except ValueError:
+            pass
+    raise ValueError(f'unknown color: "{color_str}"')
 
 
 def color_fader(c1, c2, mix=0):  # fade (linear interpolate) from color c1 (at mix=0) to c2 (mix=1)
@@ -20,9 +43,9 @@ def color_fader(c1, c2, mix=0):  # fade (linear interpolate) from color c1 (at m
     :param c1:
     :type mix: float
     """
-    c1 = np.array(mpl.colors.to_rgb(c1))
-    c2 = np.array(mpl.colors.to_rgb(c2))
-    return mpl.colors.to_hex((1 - mix) * c1 + mix * c2)
+    rgb1 = hex_to_rgb(color_str_to_hex(c1))
+    rgb2 = hex_to_rgb(color_str_to_hex(c2))
+    return rgb_to_hex(tuple((1 - mix) * a + mix * b for a, b in zip(rgb1, rgb2)))
 
 
 def create_blue_red_color_gradient_list(steps: int = 256) -> List[str]:
@@ -37,12 +60,10 @@ def create_blue_red_color_gradient_list(steps: int = 256) -> List[str]:
     return color_gradient_list
 
 
-def color_str_to_hex(color_str: str) -> str:
-    return mpl.colors.to_hex(np.array(mpl.colors.to_rgb(color_str)))
-
-
 def create_digraph(q: Questionnaire, color_edges: Optional[dict], color_nodes: Optional[dict] = None,
-                   remove_dead_ends: bool = True, label_edges: bool = False) -> nx.DiGraph:
+                   remove_dead_ends: bool = True, label_edges: bool = False) -> 'nx.DiGraph':
+    import networkx as nx
+    from networkx import NetworkXError
     g = nx.DiGraph()
 
     # l = create_blue_red_color_gradient_list()
@@ -196,7 +217,8 @@ def main(q: Questionnaire, output_file_prefix: str, output_file_suffix: str, mod
         page_to_remove_transitions = ['episodeDispatcher']
         q.remove_transitions(page_to_remove_transitions)
         g = create_digraph(q=q, color_edges=color_edges, color_nodes=None, remove_dead_ends=True, label_edges=False)
-        g = nx.nx_agraph.to_agraph(g)
+        from networkx.drawing.nx_agraph import to_agraph
+        g = to_agraph(g)
 
         g.layout('dot')
 
@@ -1,7 +1,8 @@
 import argparse
-import copy
+import hashlib
 from collections import defaultdict, OrderedDict
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, List, Dict, Union, Tuple, Any
 from xml.etree import ElementTree
@@ -10,6 +11,7 @@ from lxml.etree import ElementTree as lEt
 from lxml.etree import _Element as _lE
 from lxml.etree import _Comment as _lC
 from lxml.etree import tostring as l_to_string
+from lxml.etree import XPath
 
 from qrt.util.qmlutil import flatten, ZOFAR_NS, NS, ZOFAR_PAGE_TAG, ZOFAR_SCRIPT_ITEM_TAG, ZOFAR_SECTION_TAG, \
     ZOFAR_BODY_TAG, ZOFAR_QUESTION_OPEN_TAG, ZOFAR_CALENDAR_EPISODES_TAG, ZOFAR_CALENDAR_EPISODES_TABLE_TAG, \
@@ -17,6 +19,7 @@ from qrt.util.qmlutil import flatten, ZOFAR_NS, NS, ZOFAR_PAGE_TAG, ZOFAR_SCRIPT
     ZOFAR_MATRIX_MULTIPLE_CHOICE_TAG, ON_EXIT_DEFAULT, DIRECTION_DEFAULT, CONDITION_DEFAULT, ZOFAR_QUESTION_ELEMENTS, \
     RE_VAL, RE_VAL_OF, RE_AS_NUM, RE_TO_LOAD, RE_TO_RESET, RE_TO_PERSIST, RE_REDIRECT_TRIG, RE_REDIRECT_TRIG_AUX
 from qrt.util.questionnaire import ZofarJumper
+from qrt.util.timing import stage, count
 
 
 @dataclass(kw_only=True)
@@ -93,6 +96,8 @@ class VarRef:
     variable: Variable
     # list of conditions (as spring expression) that have to be fulfilled in order to reach the variable reference
     condition: List[str] = field(default_factory=list)
+    # type of the question the variable belongs to (tag without namespace, e.g. "questionSingleChoice")
+    question_type: Optional[str] = None
 
     def __str__(self):
         return f'{self.variable.name}: {self.variable.type}; {self.condition}'
@@ -514,6 +519,9 @@ class Page:
     warnings: List[str] = field(default_factory=list)
     source_element: _lE = field(default_factory=_lE)
     jumpers: List[ZofarJumper] = field(default_factory=list)
+    source_hash: Optional[str] = None
+    # values of EXTRACTED_ATTRIBUTES within the page by attribute name
+    attribute_values: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
 
     @property
     def triggers_list(self):
@@ -528,8 +536,27 @@ class Questionnaire:
     pages: List[Page] = field(default_factory=list)
     var_declarations: Dict[str, Variable] = field(default_factory=list)
     warnings: List[str] = field(default_factory=list)
-    xml_root: lEt = field(default_factory=lEt)
     pages_unmasked: List[Page] = field(default_factory=list)
+    # uids of pages that had to be extracted (i.e. were not taken over from a previous upload)
+    changed_pages: List[str] = field(default_factory=list)
+    source_path: Optional[Path] = None
+
+    @property
+    def xml_root(self) -> Optional[lEt]:
+        """
+        :return: the document, parsed again from source_path (the tree is not kept with the questionnaire: it takes
+         about ten times the memory of the extracted data)
+        """
+        if self.source_path is None:
+            return None
+        return lEt(file=self.source_path)
+
+    def attribute_values(self, attr_name: str) -> List[str]:
+        """
+        :param attr_name: one of EXTRACTED_ATTRIBUTES
+        :return: values of the attribute on all pages (including the filtered ones)
+        """
+        return flatten([p.attribute_values.get(attr_name, ()) for p in self.pages_unmasked])
 
     def filter(self, filter_list: List[str], filter_startswith_list: List[str]) -> None:
         self.pages = [p for p in self.pages_unmasked if
@@ -670,33 +697,58 @@ def vars_used(page: _lE) -> List[VarRef]:
                 condition_list.append(element.attrib['condition'])
             element = element.getparent()
 
-        var_list.append(VarRef(variable=Variable(name=var_name, type=var_type), condition=condition_list))
+        var_list.append(VarRef(variable=Variable(name=var_name, type=var_type), condition=condition_list,
+                               question_type=question_type.replace(ZOFAR_NS, '') if question_type else None))
     return var_list
 
 
-def read_xml(xml_path: Path) -> Questionnaire:
-    xml_root = ElementTree.parse(xml_path)
-    lxml_root = lEt(file=xml_path)
-    q = Questionnaire()
-    q.xml_root = copy.deepcopy(lxml_root)
-    q.var_declarations = variables(xml_root)
+# attributes whose values are kept for the questionnaire wide reports (see util.all_zofar_functions)
+EXTRACTED_ATTRIBUTES = ('condition', 'visible', 'command')
 
-    for l_page in lxml_root.iterfind(ZOFAR_PAGE_TAG, NS):
-        p = Page(l_page.attrib['uid'])
 
-        p.body_vars = vars_used(l_page)
-        # tmp_q, tmp_v = body_questions_vars_lxml(l_page)
-        p = Page(l_page.attrib['uid'])
+def attribute_values(page: _lE, attr_names: Tuple[str, ...] = EXTRACTED_ATTRIBUTES) -> Dict[str, Tuple[str, ...]]:
+    """
+    :param page: page element
+    :param attr_names: names of the attributes
+    :return: values of the attributes of the page and all its descendants (in document order) by attribute name
+    """
+    results = {attr_name: [] for attr_name in attr_names}
+    for value in _attribute_values_xpath(attr_names)(page):
+        # str(): the XPath result keeps a reference to its element (and therefore to the whole document)
+        results[value.attrname].append(str(value))
+    return {attr_name: tuple(values) for attr_name, values in results.items()}
+
 
+@lru_cache(maxsize=None)
+def _attribute_values_xpath(attr_names: Tuple[str, ...]) -> XPath:
+    # all attributes in a single traversal of the subtree
+    return XPath(' | '.join(f'descendant-or-self::*/@{attr_name}' for attr_name in attr_names))
+
+
+def page_hash(page: _lE) -> str:
+    # hash of the canonical serialization of the page subtree, used to detect unchanged pages on re-upload
+    return hashlib.sha1(l_to_string(page, method='c14n')).hexdigest()
+
+
+def read_page(l_page: _lE) -> Page:
+    p = Page(l_page.attrib['uid'])
+
+    with stage('read_xml.transitions'):
         p.transitions = transitions(l_page)
 
+    with stage('read_xml.jumpers'):
         p.jumpers = process_jumpers(l_page)
 
+    with stage('read_xml.var_refs'):
         p.var_ref = var_refs(l_page)
+    with stage('read_xml.triggers'):
         p._triggers_list = process_triggers(l_page)
+    with stage('read_xml.vars_used'):
         p.body_vars = vars_used(l_page)
+    with stage('read_xml.body_questions'):
         p.body_questions = body_questions_vars(l_page)
 
+    with stage('read_xml.trigger_vars'):
         p.triggers_vars_explicit = list(
             {trig.variable for trig in p.triggers_list if isinstance(trig, TriggerVariable)})
         p.triggers_vars_explicit += list(
@@ -706,35 +758,52 @@ def read_xml(xml_path: Path) -> Questionnaire:
                                          flatten([trig.children for trig in p.triggers_list if
                                                   isinstance(trig, TriggerAction)]) if
                                          ch.value.startswith("zofar.setVariableValue(")})
+    with stage('read_xml.triggers_json'):
         p.triggers_json_save = triggers_json_vars_save(l_page)
         p.triggers_json_load = triggers_json_vars_load(l_page)
         p.triggers_json_reset = triggers_json_vars_reset(l_page)
+    with stage('read_xml.visible_conditions'):
         p.visible_conditions = visible_conditions(l_page)
+    with stage('read_xml.attribute_values'):
+        p.attribute_values = attribute_values(l_page)
 
+    with stage('read_xml.redirect_triggers'):
         p.trig_redirect_on_exit_true = redirect_triggers(p.triggers_list, 'true')
         p.trig_redirect_on_exit_false = redirect_triggers(p.triggers_list, 'false')
+    return p
+
+
+def read_xml(xml_path: Path, previous: Optional[Questionnaire] = None) -> Questionnaire:
+    """
+    :param xml_path: path of the QML file
+    :param previous: questionnaire of an earlier upload of the same file; pages whose subtree is unchanged
+     are taken over from it instead of being extracted again
+    :return: questionnaire object
+    """
+    with stage('read_xml.parse'):
+        xml_root = ElementTree.parse(xml_path)
+        lxml_root = lEt(file=xml_path)
+    q = Questionnaire(source_path=Path(xml_path))
+    with stage('read_xml.variables'):
+        q.var_declarations = variables(xml_root)
+
+    previous_pages = {}
+    if previous is not None:
+        previous_pages = {p.source_hash: p for p in previous.pages_unmasked if p.source_hash is not None}
 
+    for l_page in lxml_root.iterfind(ZOFAR_PAGE_TAG, NS):
+        with stage('read_xml.page_hash'):
+            source_hash = page_hash(l_page)
+        if source_hash in previous_pages:
+            p = previous_pages[source_hash]
+            count('read_xml.pages_reused')
+        else:
+            p = read_page(l_page)
+            p.source_hash = source_hash
+            q.changed_pages.append(p.uid)
+            count('read_xml.pages_read')
         q.pages.append(p)
 
-    # for page in xml_root.findall('./zofar:page', NS):
-    #     continue
-    #     p = Page(page.attrib['uid'])
-    #
-    #     p.transitions = transitions(page)
-    #     p.var_ref = var_refs(page)
-    #     p._triggers_list = process_triggers(page)
-    #
-    #     p.triggers_vars_explicit = [trig.variable for trig in p.triggers_list if isinstance(trig, TriggerVariable)]
-    #     p.trig_json_save = trig_json_vars_save(page)
-    #     p.trig_json_load = trig_json_vars_load(page)
-    #     p.trig_json_reset = trig_json_vars_reset(page)
-    #     p.visible_conditions = visible_conditions(page)
-    #
-    #     p.trig_redirect_on_exit_true = redirect_triggers(p.triggers_list, 'true')
-    #     p.trig_redirect_on_exit_false = redirect_triggers(p.triggers_list, 'false')
-    #
-    #     q.pages.append(p)
-
     q.pages_unmasked = q.pages.copy()
 
     return q
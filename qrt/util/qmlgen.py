@@ -1,8 +1,5 @@
-import html
-import pprint
-import re
 from pathlib import Path
-from typing import Dict, Union, List
+from typing import Dict, Union, List, Any, Callable, Generator, Iterable, Optional, Tuple
 
 from lxml.etree import _Element as _lE, ElementTree as lEt, tostring as l_to_string
 
@@ -11,29 +8,22 @@ from qrt.util.questionnaire import HeaderQuestion, HeaderTitle, HeaderInstructio
     MatrixResponseDomain, VarRef, Variable, VAR_TYPE_SC, VAR_TYPE_BOOL, SCMatrixItem, SCResponseDomain, \
     ZofarQuestionSCMatrix, \
     ZofarQuestionSC, HeaderObject, MCAnswerOption, ZofarQuestionOpen, VAR_TYPE_STR, SC_TYPE_DROPDOWN, MCResponseDomain, \
-    ZofarQuestionMC, MCMatrixItem, ZofarQuestionMCMatrix
+    ZofarQuestionMC, MCMatrixItem, ZofarQuestionMCMatrix, Question, ZofarLabel, ZofarAttachedOpen, ao_templates, \
+    Questionnaire, Page, Transition, collect_var_refs
+from qrt.util import textnorm
+from qrt.util.qmlwriter import iter_questionnaire
 
 
 def unescape_html(escaped_str: str) -> str:
-    char_list = ['ä', 'Ä', 'ö', 'Ö', 'ü', 'Ü', 'ß']
-    char_dict = {html.escape(char): char for char in char_list}
-    special_chars = ["&amp;", "&lt;", "&gt;"]
-    typo_quotes = ['&#8221;', '&#8220;', '&#8222;']
-    list_of_escaped_chars = set(re.findall(r'&#?[a-z0-9A-Z]{,6};', escaped_str))
-    dict_of_escaped_chars = {char: html.unescape(char) for char in list_of_escaped_chars if
-                             char not in special_chars + typo_quotes}
-    pprint.pprint(sorted(dict_of_escaped_chars))
-    output_str = escaped_str
-    for escaped_char, unescaped_char in dict_of_escaped_chars.items():
-        output_str = output_str.replace(escaped_char, unescaped_char)
-    return output_str
+    # see textnorm.unescape_html
+    return textnorm.unescape_html(escaped_str)
 
 
 def create_headers(data_dict: Dict[str, Dict[str, str]]) -> List[HeaderObject]:
     header_list = []
     for i, header in data_dict.items():
         _dict = {'uid': header['uid'],
-                 'visible': header['visible'] if header['visible'].strip() != "" else "true",
+                 'visible': header.get('visible', '') if header.get('visible', '').strip() != "" else "true",
                  'content': header['text']}
         if header['type'] == 'question':
             header_list.append(HeaderQuestion(**_dict))
@@ -44,7 +34,11 @@ def create_headers(data_dict: Dict[str, Dict[str, str]]) -> List[HeaderObject]:
     return header_list
 
 
-def gen_qsc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
+def serialize_question(question: Question) -> str:
+    return replace_zofar_ns(l_to_string(question.gen_xml(), pretty_print=True).decode('utf-8'))
+
+
+def build_qsc(data_dict: Dict[str, Union[List, Dict, str]]) -> ZofarQuestionSC:
     header_list = create_headers(data_dict=data_dict['headers'])
 
     ao_list = [SCAnswerOption(uid=ao['uid'], value=ao['value'], label=ao['label'])
@@ -62,118 +56,176 @@ def gen_qsc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
         rd_dict.update({'rd_type': SC_TYPE_DROPDOWN})
     rd = SCResponseDomain(**rd_dict)
 
-    qsc = ZofarQuestionSC(uid=data_dict['q_uid'], header_list=header_list, response_domain=rd,
-                          visible=data_dict['q_visible'])
+    return ZofarQuestionSC(uid=data_dict['q_uid'], header_list=header_list, response_domain=rd,
+                           visible=data_dict['q_visible'])
+
 
-    return replace_zofar_ns(l_tostring(qsc.gen_xml(), pretty_print=True).decode('utf-8'))
+def gen_qsc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
+    return serialize_question(build_qsc(data_dict))
 
 
 def replace_zofar_ns(text: str) -> str:
     return text.replace('xmlns:zofar="http://www.his.de/zofar/xml/questionnaire" ', '')
 
 
+def build_qo(data_dict: Dict[str, Union[List, Dict, str]]) -> ZofarQuestionOpen:
+    header_list = create_headers(data_dict=data_dict.get('headers', {}))
+    assert check_for_unique_uids(header_list)
+
+    qo_dict = {'uid': data_dict['q_uid'], 'header_list': header_list,
+               'var_ref': VarRef(variable=Variable(name=data_dict['q_variable'], type=VAR_TYPE_STR))}
+    if data_dict.get('q_visible', '').strip() != '':
+        qo_dict['visible'] = data_dict['q_visible']
+    if 'size' in data_dict:
+        qo_dict['size'] = str(data_dict['size'])
+    if 'prefix' in data_dict:
+        qo_dict['prefix_list'] = [ZofarLabel(uid='prelabel', content=data_dict['prefix'])]
+    if 'postfix' in data_dict:
+        qo_dict['postfix_list'] = [ZofarLabel(uid='postlabel', content=data_dict['postfix'])]
+    return ZofarQuestionOpen(**qo_dict)
+
+
 def gen_qo(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
-    pass
+    return serialize_question(build_qo(data_dict))
 
 
-def gen_mc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
-    header_list = create_headers(data_dict=data_dict['headers'])
+def attached_opens(att_opens: Dict[int, Dict[str, str]]) -> List[ZofarAttachedOpen]:
+    att_open_list = []
+    for j, att_open in att_opens.items():
+        att_open_dict = {'uid': att_open['uid'],
+                         'var_ref': VarRef(variable=Variable(name=att_open['variable'], type=VAR_TYPE_STR))}
+        if att_open.get('prefix', '') != '':
+            att_open_dict['prefix_list'] = [ZofarLabel(uid='prelabel', content=att_open['prefix'])]
+        if att_open.get('postfix', '') != '':
+            att_open_dict['postfix_list'] = [ZofarLabel(uid='postlabel', content=att_open['postfix'])]
+        att_open_list.append(ZofarAttachedOpen(**att_open_dict))
+    return att_open_list
+
+
+def is_missing(ao: Dict[str, Any]) -> bool:
+    # form data ("on") and JSON/TOML specs (true, "true")
+    return ao.get('missing') in [True, 'true', 'on']
+
+
+def question_visible(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
+    return data_dict['q_visible'] if data_dict.get('q_visible', '').strip() != '' else 'true'
 
+
+def element_visible(element: Dict[str, str]) -> str:
+    # visible condition of an answer option or item, 'true' if not given
+    return element['visible'] if element.get('visible', '').strip() != '' else 'true'
+
+
+def mc_answer_options(aos: Dict[int, Dict[str, str]],
+                      variables: Optional[Dict[int, str]] = None) -> List[MCAnswerOption]:
+    # variables: answer option index -> variable name (default: the "variable" of each answer option)
     ao_list = []
-    for i, ao in data_dict['aos'].items():
+    for i, ao in aos.items():
         ao_dict = {'uid': ao['uid'], 'label': ao['label'],
-                   'var_ref': VarRef(variable=Variable(name=ao['variable'], type=VAR_TYPE_BOOL))}
-        if 'exclusive' in ao:
-            ao_dict.update({'exclusive': ao['exclusive']})
+                   'var_ref': VarRef(variable=Variable(name=variables[i] if variables is not None else ao['variable'],
+                                                       type=VAR_TYPE_BOOL))}
+        if ao.get('visible', '').strip() != '':
+            ao_dict['visible'] = ao['visible']
+        if ao.get('exclusive') in [True, 'true', 'on']:
+            ao_dict['exclusive'] = True
+        if is_missing(ao):
+            ao_dict['missing'] = True
         if 'attached_open' in ao:
-            attached_open_list = []
-            # raise NotImplementedError
-            for j, attached_open in ao['attached_open'].items():
-                att_open_obj = ZofarQuestionOpen(uid="open",
-                                                 var_ref=VarRef(variable=Variable(name="ap09g", type=VAR_TYPE_STR)))
-                attached_open_list.append(att_open_obj)
+            ao_dict['attached_open_list'] = attached_opens(ao['attached_open'])
         ao_list.append(MCAnswerOption(**ao_dict))
+    return ao_list
 
-    # ao_list = []
-    # ao_list.append(MCAnswerOption(uid="ao1", label="Keine Zeit",
-    #                               var_ref=VarRef(variable=Variable(name="ap09a", type=VAR_TYPE_BOOL))))
-    # ao_list.append(MCAnswerOption(uid="ao2", label="Format gefällt nicht",
-    #                               var_ref=VarRef(variable=Variable(name="ap09b", type=VAR_TYPE_BOOL))))
-    # ao_list.append(MCAnswerOption(uid="ao3", label="Themen interessieren nicht",
-    #                               var_ref=VarRef(variable=Variable(name="ap09c", type=VAR_TYPE_BOOL))))
-    # ao_list.append(MCAnswerOption(uid="ao4", label="Keine Notwendigkeit",
-    #                               var_ref=VarRef(variable=Variable(name="ap09d", type=VAR_TYPE_BOOL))))
-    # ao_list.append(MCAnswerOption(uid="ao5", label=" Betreuer*in unterstützt Teilnahme nicht",
-    #                               var_ref=VarRef(variable=Variable(name="ap09e", type=VAR_TYPE_BOOL))))
-    # ao_list.append(MCAnswerOption(uid="ao6", label="Zu teuer",
-    #                               var_ref=VarRef(variable=Variable(name="ap09f", type=VAR_TYPE_BOOL))))
-    #
-    # att_open =
-    # ao_list.append(MCAnswerOption(uid="ao7", label="Sonstige, und zwar:",
-    #                               var_ref=VarRef(variable=Variable(name="ap09h", type=VAR_TYPE_BOOL)),
-    #                               attached_open_list=[att_open]))
-    #
-    # # integrity check: unique uids
-    # assert check_for_unique_uids(ao_list)
-    # assert check_for_unique_uids(header_list)
-    #
-    # rd = MCResponseDomain(ao_list=ao_list)
-    #
-    # mc = ZofarQuestionMC(uid="mce", header_list=header_list, response_domain=rd)
-
-    raise NotImplementedError
-    return mc
 
+def build_mc(data_dict: Dict[str, Union[List, Dict, str]]) -> ZofarQuestionMC:
+    header_list = create_headers(data_dict=data_dict['headers'])
+    ao_list = mc_answer_options(data_dict['aos'])
 
-def gen_mqmc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
-    pass
+    # integrity check: unique uids
+    assert check_for_unique_uids(ao_list)
+    assert check_for_unique_uids(header_list)
 
+    rd = MCResponseDomain(ao_list=ao_list)
 
-def gen_mqqo(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
-    pass
+    return ZofarQuestionMC(uid=data_dict['q_uid'], header_list=header_list, response_domain=rd,
+                           visible=question_visible(data_dict))
+
+
+def gen_mc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
+    return serialize_question(build_mc(data_dict))
+
+
+def matrix_title_headers(aos: Dict[int, Dict[str, str]]) -> Tuple[List[HeaderTitle], List[HeaderTitle]]:
+    title_header_list = []
+    title_missing_list = []
+    for i, ao in aos.items():
+        # set title header according to answer option label
+        if is_missing(ao):
+            # if answer option marked as missing -> add to missing header
+            title_missing_list.append(HeaderTitle(uid=f'ti{i}', content=ao['label'],
+                                                  visible=ao.get('visible') or 'true'))
+            continue
+        # if else -> add to regular title
+        title_header_list.append(HeaderTitle(uid=ao['uid'], content=ao['label'], visible=ao.get('visible') or 'true'))
+    return title_header_list, title_missing_list
+
+
+def build_mqmc(data_dict: Dict[str, Union[List, Dict, str]]) -> ZofarQuestionMCMatrix:
+    header_list = create_headers(data_dict['headers'])
+    title_header_list, title_missing_list = matrix_title_headers(data_dict['aos'])
+
+    it_list = []
+    for j, it in data_dict['items'].items():
+        # one boolean variable per item and answer option: explicitly given or variable prefix + a, b, c, ...
+        if 'variables' in it:
+            variables = indexed(it['variables'])
+        else:
+            variables = {i: f'{it["variable"]}{chr(ord("a") + n)}' for n, i in enumerate(data_dict['aos'].keys())}
+        ao_list_it = mc_answer_options(data_dict['aos'], variables=variables)
+        assert check_for_unique_uids(ao_list_it)
+        it_list.append(MCMatrixItem(uid=it['uid'],
+                                    header_list=[HeaderQuestion(uid=f"q{j}", content=it['text'])],
+                                    response_domain=MCResponseDomain(uid=f"rd{j}", ao_list=ao_list_it),
+                                    visible=it['visible'] if it.get('visible', '').strip() != '' else 'true'))
+
+    assert check_for_unique_uids(header_list)
+    assert check_for_unique_uids(title_header_list + title_missing_list)
+    assert check_for_unique_uids(it_list)
+
+    matrix_rd = MatrixResponseDomain(uid='rd', no_response_options=str(len(data_dict['aos'])), item_list=it_list)
+
+    return ZofarQuestionMCMatrix(uid=data_dict['q_uid'], header_list=header_list, response_domain=matrix_rd,
+                                 title_header=title_header_list, missing_header=title_missing_list,
+                                 visible=question_visible(data_dict))
+
+
+def gen_mqmc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
+    return serialize_question(build_mqmc(data_dict))
 
 
 def unescape_characters(input_str: str) -> str:
     # umlaute etc. get automatically replaced by their html escape codes when being written by the parser
     # replace them back (remove html escapes and replace by non-ascii characters)
-    matches = re.findall(r'(&#.{,5};)', input_str)
-    matches_set = set(matches)
-    if len(matches_set) > 0:
-        print('\n' + f'The following characters will be replaced:')
-        for match in matches_set:
-            match_replacement = html.unescape(match)
-            print(f'    {match=} -> {match_replacement}')
-            input_str = input_str.replace(match, match_replacement)
-    return input_str
+    return textnorm.unescape_numeric(input_str)
 
 
-def gen_mqsc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
+def build_mqsc(data_dict: Dict[str, Union[List, Dict, str]]) -> ZofarQuestionSCMatrix:
     header_list = create_headers(data_dict['headers'])
 
-    title_header_list = []
-    ao_list_it = []
-    title_missing_list = []
-    for i, ao in data_dict['aos'].items():
-        # set answer option object
-        ao_list_it.append(SCAnswerOption(uid=ao['uid'], value=ao['value'], label=ao['label']))
-
-        # set title header according to answer option label
-        if 'missing' in ao:
-            if ao['missing'] == 'on':
-                # if answer option marked as missing -> add to missing header
-                title_missing_list.append(HeaderTitle(uid=f'ti{i}', content=ao['label'], visible=ao['visible']))
-                continue
-        # if else -> add to regular title
-        title_header_list.append(HeaderTitle(uid=ao['uid'], content=ao['label'], visible=ao['visible']))
+    ao_list_it = [SCAnswerOption(uid=ao['uid'], value=ao['value'], label=ao['label'], visible=element_visible(ao))
+                  for i, ao in data_dict['aos'].items()]
+    title_header_list, title_missing_list = matrix_title_headers(data_dict['aos'])
 
     it_list = []
 
     for j, it in data_dict['items'].items():
         var_ref = VarRef(variable=Variable(name=it['variable'], type=VAR_TYPE_SC))
+        att_open_list = attached_opens(it.get('attached_open', {}))
         it_element = SCMatrixItem(uid=it['uid'],
                                   header_list=[HeaderQuestion(uid=f"q{j}",
                                                               content=it['text'])],
-                                  response_domain=SCResponseDomain(uid=f"rd{j}", ao_list=ao_list_it, var_ref=var_ref))
+                                  response_domain=SCResponseDomain(uid=f"rd{j}", ao_list=ao_list_it, var_ref=var_ref),
+                                  attached_open_list=att_open_list,
+                                  visible=element_visible(it))
         it_list.append(it_element)
 
     assert check_for_unique_uids(header_list)
@@ -185,11 +237,141 @@ def gen_mqsc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
 
     matrix_rd = MatrixResponseDomain(uid='rd', no_response_options=str(len(ao_list_it)), item_list=it_list)
 
-    mqsc = ZofarQuestionSCMatrix(uid=data_dict['q_uid'], header_list=header_list, response_domain=matrix_rd,
+    return ZofarQuestionSCMatrix(uid=data_dict['q_uid'], header_list=header_list, response_domain=matrix_rd,
                                  title_header=title_header_list, missing_header=title_missing_list,
                                  visible=data_dict['q_visible'])
 
-    return replace_zofar_ns(l_tostring(mqsc.gen_xml(), pretty_print=True).decode('utf-8'))
+
+def gen_mqsc(data_dict: Dict[str, Union[List, Dict, str]]) -> str:
+    return serialize_question(build_mqsc(data_dict))
+
+
+QUESTION_BUILDERS: Dict[str, Callable[[Dict[str, Union[List, Dict, str]]], Question]] = {
+    'mqsc': build_mqsc,
+    'qsc': build_qsc,
+    'mc': build_mc,
+    'mqmc': build_mqmc,
+    'qo': build_qo,
+}
+
+
+def indexed(data: Union[List[Dict[str, Any]], Dict[Any, Dict[str, Any]]]) -> Dict[int, Dict[str, Any]]:
+    # lists (JSON) and dicts with str keys (JSON) or int keys (form data) -> {1: ..., 2: ...} in index order
+    if isinstance(data, list):
+        return {i + 1: v for i, v in enumerate(data)}
+    return {int(k): v for k, v in sorted(data.items(), key=lambda x: int(x[0]))}
+
+
+def normalize_spec(spec: Dict[str, Any]) -> Dict[str, Any]:
+    spec = dict(spec)
+    for key in ['headers', 'aos', 'items']:
+        if key in spec:
+            spec[key] = indexed(spec[key])
+    for key in ['aos', 'items']:
+        if key in spec:
+            # copies, the caller's spec is not changed
+            spec[key] = {i: dict(element, attached_open=indexed(element['attached_open']))
+                         if 'attached_open' in element else element
+                         for i, element in spec[key].items()}
+    return spec
+
+
+def build_questions(specs: Iterable[Dict[str, Any]]) -> List[Question]:
+    """
+    :param specs: question specs, each with "q_type" (one of QUESTION_BUILDERS) and the data expected by the
+     corresponding build_* function
+    :return: question objects
+    :raises ValueError: for unknown question types and incomplete or inconsistent specs
+    """
+    questions = []
+    for n, spec in enumerate(specs):
+        q_type = spec.get('q_type', spec.get('type'))
+        if q_type not in QUESTION_BUILDERS:
+            raise ValueError(f'question {n + 1}: unknown question type "{q_type}"; '
+                             f'expected one of: {list(QUESTION_BUILDERS)}')
+        try:
+            questions.append(QUESTION_BUILDERS[q_type](normalize_spec(spec)))
+        except KeyError as err:
+            raise ValueError(f'question {n + 1} ("{spec.get("q_uid")}"): missing key {err.args[0]}')
+        except AssertionError:
+            raise ValueError(f'question {n + 1} ("{spec.get("q_uid")}"): uids are not unique')
+    return questions
+
+
+SERIALIZED_CACHE_SIZE = 64
+
+
+def serialize_questions(questions: Iterable[Question]) -> Generator[str, None, None]:
+    """
+    Serialize questions one after another; answer option elements are generated once per distinct answer option
+    and copied afterwards.
+
+    :return: pretty printed XML, one string per question
+    """
+    templates = {}
+    # structurally equal questions are serialized once; the keys are frozen copies (hash computed once, not
+    #  affected by later changes of the caller's question objects)
+    serialized = {}
+    for question in questions:
+        key = question.frozen()
+        xml_str = serialized.get(key)
+        if xml_str is None:
+            with ao_templates(templates):
+                xml_str = serialize_question(question)
+            if len(serialized) >= SERIALIZED_CACHE_SIZE:
+                del serialized[next(iter(serialized))]
+            serialized[key] = xml_str
+        yield xml_str
+
+
+def gen_batch(specs: Iterable[Dict[str, Any]]) -> Generator[str, None, None]:
+    """
+    All questions are built first, so that invalid specs are reported before any output is generated.
+
+    :param specs: see build_questions
+    :return: pretty printed XML, one string per question
+    """
+    return serialize_questions(build_questions(specs))
+
+
+def questionnaire_from_pages(pages: List[Page]) -> Questionnaire:
+    """
+    :param pages: pages with question objects as body_questions
+    :return: questionnaire with the pages linked by transitions (in the given order) and a declaration for every
+     variable used by the questions (in order of first use)
+    """
+    q = Questionnaire(pages=pages, var_declarations={})
+    for page in pages:
+        page.body_vars = []
+        for question in page.body_questions:
+            for var_ref in collect_var_refs(question):
+                page.body_vars.append(var_ref)
+                q.var_declarations.setdefault(var_ref.variable.name, var_ref.variable)
+    for page, next_page in zip(pages, pages[1:]):
+        page.transitions.append(Transition(target_uid=next_page.uid))
+    return q
+
+
+def build_questionnaire(spec: Dict[str, Any]) -> Questionnaire:
+    """
+    :param spec: {"pages": [{"uid": ..., "questions": [question specs, see build_questions]}, ...]}
+    :raises ValueError: for missing pages and invalid question specs
+    """
+    pages = spec.get('pages')
+    if not isinstance(pages, list) or not all(isinstance(page, dict) and 'uid' in page for page in pages):
+        raise ValueError('expected a list of pages, each with "uid" and "questions"')
+    return questionnaire_from_pages([Page(uid=page['uid'], body_questions=build_questions(page.get('questions', [])))
+                                     for page in pages])
+
+
+def gen_questionnaire(spec: Dict[str, Any]) -> Generator[bytes, None, None]:
+    """
+    Whole questionnaire document, written incrementally page by page (see qmlwriter.iter_questionnaire).
+
+    :param spec: {"name": ..., "pages": [...]}, see build_questionnaire
+    :raises ValueError: for invalid specs, before any output is generated
+    """
+    return iter_questionnaire(build_questionnaire(spec), name=spec.get('name', 'questionnaire'))
 
 
 if __name__ == '__main__':
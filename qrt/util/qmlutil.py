@@ -21,6 +21,7 @@ NS = {
 }
 ZOFAR_QUESTIONNAIRE_TAG = f"{ZOFAR_NS}questionnaire"
 ZOFAR_NAME_TAG = f"{ZOFAR_NS}name"
+ZOFAR_DESCRIPTION_TAG = f"{ZOFAR_NS}description"
 ZOFAR_PAGE_TAG = f"{ZOFAR_NS}page"
 ZOFAR_TRANSITIONS_TAG = f"{ZOFAR_NS}transitions"
 ZOFAR_TRANSITION_TAG = f"{ZOFAR_NS}transition"
@@ -50,6 +51,7 @@ ZOFAR_MATRIX_QUESTION_OPEN_TAG = f"{ZOFAR_NS}matrixQuestionOpen"
 ZOFAR_MATRIX_SINGLE_CHOICE_TAG = f"{ZOFAR_NS}matrixQuestionSingleChoice"
 ZOFAR_MATRIX_MULTIPLE_CHOICE_TAG = f"{ZOFAR_NS}matrixQuestionMultipleChoice"
 DISPLAY_NAMESPACE = "{http://www.dzhw.eu/zofar/xml/display}"
+DISPLAY_NS_URI = "http://www.dzhw.eu/zofar/xml/display"
 ZOFAR_DISPLAY_TEXT_TAG = f"{DISPLAY_NAMESPACE}text"
 ON_EXIT_DEFAULT = 'true'
 DIRECTION_DEFAULT = 'forward'
@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Generator, Iterable, Optional, Union
+from pathlib import Path
+
+from lxml import etree
+from lxml.etree import _Element as _lE
+
+from qrt.util.qmlutil import ZOFAR_NS_URI, ZOFAR_QUESTIONNAIRE_TAG, ZOFAR_NAME_TAG, ZOFAR_VARIABLES_TAG, \
+    ZOFAR_VARIABLE_TAG, ZOFAR_PAGE_TAG, ZOFAR_HEADER_TAG, ZOFAR_BODY_TAG, ZOFAR_TRANSITIONS_TAG, \
+    ZOFAR_TRANSITION_TAG, ZOFAR_DESCRIPTION_TAG, DISPLAY_NS_URI
+from qrt.util.questionnaire import Questionnaire, Page, Variable, ao_templates
+
+QML_NSMAP = {'zofar': ZOFAR_NS_URI, 'display': DISPLAY_NS_URI}
+
+
+class QmlWriter:
+    """
+    Incremental QML writer on top of lxml.etree.xmlfile: elements are written (indented) as soon as they are
+    generated, the zofar namespace is declared once on the root element.
+    """
+
+    def __init__(self, xf, indent: str = '  '):
+        self.xf = xf
+        self.indent = indent
+        self.depth = 0
+
+    def _newline(self) -> None:
+        self.xf.write('\n' + self.indent * self.depth)
+
+    @contextmanager
+    def element(self, tag: str, attrib: Optional[Dict[str, str]] = None, nsmap: Optional[Dict[str, str]] = None):
+        """
+        Open an element; everything written within the context becomes its content.
+        """
+        if self.depth > 0:
+            self._newline()
+        with self.xf.element(tag, attrib or {}, nsmap=nsmap):
+            self.depth += 1
+            self._has_children = False
+            yield
+            self.depth -= 1
+            if self._has_children:
+                self._newline()
+        self._has_children = True
+
+    def write_element(self, el: _lE) -> None:
+        """
+        Write an element (with its subtree); namespaces already declared by an enclosing element are not
+        declared again.
+        """
+        self._write_subtree(el, self.depth)
+        self._has_children = True
+
+    def _write_subtree(self, el: _lE, depth: int) -> None:
+        # hot path (every generated element): no context manager and no bookkeeping
+        xf = self.xf
+        xf.write('\n' + self.indent * depth)
+        if not isinstance(el.tag, str):
+            # comments, processing instructions
+            xf.write(el)
+            return
+        with xf.element(el.tag, el.attrib):
+            if len(el) == 0:
+                if el.text:
+                    xf.write(el.text)
+            else:
+                for child in el:
+                    self._write_subtree(child, depth + 1)
+                xf.write('\n' + self.indent * depth)
+
+    def write_variables(self, variables: Iterable[Variable]) -> None:
+        with self.element(ZOFAR_VARIABLES_TAG):
+            for variable in variables:
+                with self.element(ZOFAR_VARIABLE_TAG, {'name': variable.name, 'type': variable.type}):
+                    pass
+
+    def write_page(self, page: Page) -> None:
+        """
+        :param page: page with question objects (having gen_xml) as body_questions
+        """
+        with self.element(ZOFAR_PAGE_TAG, {'uid': page.uid}):
+            with self.element(ZOFAR_HEADER_TAG):
+                pass
+            with self.element(ZOFAR_BODY_TAG, {'uid': 'b'}):
+                for question in page.body_questions:
+                    self.write_element(question.gen_xml())
+            if page.transitions:
+                with self.element(ZOFAR_TRANSITIONS_TAG):
+                    for transition in page.transitions:
+                        attrib = {'target': transition.target_uid}
+                        if transition.condition is not None:
+                            attrib['condition'] = transition.condition
+                        with self.element(ZOFAR_TRANSITION_TAG, attrib):
+                            pass
+
+
+@contextmanager
+def qml_writer(out: Union[str, Path, BinaryIO], name: str, language: str = 'de', indent: str = '  '):
+    """
+    Open a QML document (declaration, questionnaire root element, name and description); pages etc. are written
+    within the context.
+
+    :param out: file name or binary file-like object (e.g. a response stream)
+    """
+    with etree.xmlfile(str(out) if isinstance(out, Path) else out, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        w = QmlWriter(xf, indent=indent)
+        with w.element(ZOFAR_QUESTIONNAIRE_TAG, {'language': language}, nsmap=QML_NSMAP):
+            with w.element(ZOFAR_NAME_TAG):
+                xf.write(name)
+            with w.element(ZOFAR_DESCRIPTION_TAG):
+                pass
+            yield w
+
+
+class ChunkSink:
+    """
+    File-like target for xmlfile that keeps the written bytes until they are taken (for streamed responses).
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> None:
+        self._chunks.append(data)
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _write_questionnaire_content(w: QmlWriter, q: Questionnaire, variables: Optional[Iterable[Variable]]):
+    # generator: yields after each page
+    w.write_variables(variables if variables is not None else q.var_declarations.values())
+    for page in q.pages:
+        w.write_page(page)
+        yield
+
+
+def write_questionnaire(out: Union[str, Path, BinaryIO], q: Questionnaire, name: str,
+                        variables: Optional[Iterable[Variable]] = None) -> None:
+    """
+    :param out: file name or binary file-like object
+    :param q: questionnaire with question objects as body_questions of its pages
+    :param name: questionnaire name
+    :param variables: variable declarations; defaults to q.var_declarations
+    """
+    with qml_writer(out, name=name) as w, ao_templates():
+        for _ in _write_questionnaire_content(w, q, variables):
+            pass
+
+
+def iter_questionnaire(q: Questionnaire, name: str,
+                       variables: Optional[Iterable[Variable]] = None) -> Generator[bytes, None, None]:
+    """
+    Like write_questionnaire, but yields the document page by page (e.g. for a streamed HTTP response); only the
+    elements of the current page are kept in memory.
+    """
+    sink = ChunkSink()
+    with qml_writer(sink, name=name) as w, ao_templates():
+        for _ in _write_questionnaire_content(w, q, variables):
+            w.xf.flush()
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    yield sink.take()
@@ -1,5 +1,8 @@
+import copy
 from collections import defaultdict
-from dataclasses import dataclass, field
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, fields, is_dataclass, FrozenInstanceError
 from typing import Optional, Tuple, NewType, List, Union, Dict, Any
 # noinspection PyProtectedMember
 from lxml.etree import _Element as _lE, ElementTree as lEt
@@ -30,26 +33,161 @@ ResponseDomain = NewType('ResponseDomain', None)
 
 # MatrixItem = NewType('MatrixItem', None)
 
+# answer option element templates, see ao_templates()
+AO_TEMPLATES: ContextVar[Optional[Dict[tuple, _lE]]] = ContextVar('AO_TEMPLATES', default=None)
+
+
+@contextmanager
+def ao_templates(templates: Optional[Dict[tuple, _lE]] = None):
+    """
+    Within this context, answer option elements are generated once per distinct answer option and copied on
+    further use (e.g. for every item of a matrix question, or across many questions with the same scale).
+
+    :param templates: template dict to (re)use, e.g. for several questions
+    """
+    token = AO_TEMPLATES.set(templates if templates is not None else {})
+    try:
+        yield
+    finally:
+        AO_TEMPLATES.reset(token)
+
+
+def structural_key(value: Any) -> Any:
+    """
+    :return: hashable representation of value (model objects, lists and dicts are converted recursively)
+    """
+    if isinstance(value, StructuralObject):
+        return value.structural_key()
+    if isinstance(value, (list, tuple)):
+        return tuple(structural_key(v) for v in value)
+    if isinstance(value, dict):
+        return tuple((k, structural_key(v)) for k, v in value.items())
+    return value
+
+
+def _values_equal(value: Any, other: Any) -> bool:
+    # lists of mutable objects are tuples in frozen objects
+    if isinstance(value, (list, tuple)) and isinstance(other, (list, tuple)):
+        return len(value) == len(other) and all(_values_equal(v, o) for v, o in zip(value, other))
+    return value == other
+
+
+def _frozen_value(value: Any) -> Any:
+    if isinstance(value, StructuralObject):
+        return value.freeze()
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen_value(v) for v in value)
+    return value
+
+
+class StructuralObject:
+    """
+    Base of the model dataclasses (declared with eq=False): equality and hash are structural, i.e. based on the
+    type and the field values. Frozen objects (see freeze) are immutable and cache their hash, so equality of frozen
+    objects short-circuits on different hashes and they can be used as dict/set keys for deduplication. The hash of
+    a mutable object is computed from its current content on every call.
+    """
+    _frozen: bool = False
+    _hash: Optional[int] = None
+
+    @classmethod
+    def _model_class(cls) -> type:
+        # the class a frozen object was created from
+        return cls.__dict__.get('_mutable_class', cls)
+
+    def structural_key(self) -> tuple:
+        return (self._model_class().__name__,) + tuple(structural_key(getattr(self, f.name)) for f in fields(self))
+
+    def __hash__(self):
+        if self._hash is not None:
+            return self._hash
+        value = hash(self.structural_key())
+        if self._frozen:
+            object.__setattr__(self, '_hash', value)
+        return value
 
-@dataclass(kw_only=True)
-class ZofarPageObject:
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, StructuralObject) or other._model_class() is not self._model_class():
+            return NotImplemented
+        if self._hash is not None and other._hash is not None and self._hash != other._hash:
+            return False
+        return all(_values_equal(getattr(self, f.name), getattr(other, f.name)) for f in fields(self))
+
+    def __setstate__(self, state):
+        # copy/pickle (VarRef shadows __dict__)
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def __reduce_ex__(self, protocol):
+        if not self._frozen:
+            return super().__reduce_ex__(protocol)
+        # frozen classes are created at runtime and cannot be pickled by reference
+        state = {f.name: getattr(self, f.name) for f in fields(self)}
+        return _restore_frozen, (self._model_class(), state)
+
+    def freeze(self):
+        """
+        Make this object (and all model objects within it) immutable; lists become tuples.
+
+        :return: self
+        """
+        if not self._frozen:
+            for f in fields(self):
+                object.__setattr__(self, f.name, _frozen_value(getattr(self, f.name)))
+            # mutable objects do not pay for the check in __setattr__
+            object.__setattr__(self, '__class__', _frozen_class(type(self)))
+        return self
+
+    def frozen(self):
+        """
+        :return: frozen deep copy of this object
+        """
+        return self if self._frozen else copy.deepcopy(self).freeze()
+
+
+def _frozen_setattr(self, name, value):
+    raise FrozenInstanceError(f'cannot assign to field "{name}" of a frozen {type(self).__name__}')
+
+
+def _frozen_delattr(self, name):
+    raise FrozenInstanceError(f'cannot delete field "{name}" of a frozen {type(self).__name__}')
+
+
+_FROZEN_CLASSES: Dict[type, type] = {}
+
+
+def _frozen_class(cls: type) -> type:
+    if cls not in _FROZEN_CLASSES:
+        _FROZEN_CLASSES[cls] = type(cls.__name__, (cls,), {
+            '__setattr__': _frozen_setattr, '__delattr__': _frozen_delattr, '_frozen': True, '_mutable_class': cls,
+            '__qualname__': cls.__qualname__, '__module__': cls.__module__})
+    return _FROZEN_CLASSES[cls]
+
+
+def _restore_frozen(cls: type, state: Dict[str, Any]) -> StructuralObject:
+    obj = cls.__new__(cls)
+    obj.__setstate__(state)
+    return obj.freeze()
+
+
+@dataclass(kw_only=True, eq=False)
+class ZofarPageObject(StructuralObject):
     uid: str
     # parent_uid: Optional[str] = None
     # full_uid: Optional[str] = None
     visible: str = 'true'
 
-    def __eq__(self, other):
-        return eq_attributes_and_values(self, other)
-
 
-@dataclass(kw_only=True)
-class Variable:
+@dataclass(kw_only=True, eq=False)
+class Variable(StructuralObject):
     name: str
     type: str
 
 
-@dataclass(kw_only=True)
-class VarRef:
+@dataclass(kw_only=True, eq=False)
+class VarRef(StructuralObject):
     variable: Variable
     # list of conditions (as spring expression) that have to be fulfilled in order to reach the variable reference
     condition: List[str] = field(default_factory=list)
@@ -82,7 +220,7 @@ class VarRef:
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class HeaderObject(ZofarPageObject):
     type: str
     content: str
@@ -92,7 +230,7 @@ class HeaderObject(ZofarPageObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class HeaderTitle(HeaderObject):
     type: str = 'title'
 
@@ -101,19 +239,19 @@ class HeaderTitle(HeaderObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
-class ZofarJumper:
+@dataclass(kw_only=True, eq=False)
+class ZofarJumper(StructuralObject):
     target: str
     value: Optional[str]
 
 
-@dataclass(kw_only=True)
-class TextObject:
+@dataclass(kw_only=True, eq=False)
+class TextObject(StructuralObject):
     jumper: List[ZofarJumper]
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class HeaderText(HeaderObject, TextObject):
     type: str = 'text'
 
@@ -122,7 +260,7 @@ class HeaderText(HeaderObject, TextObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class HeaderQuestion(HeaderObject):
     type: str = 'question'
 
@@ -131,7 +269,7 @@ class HeaderQuestion(HeaderObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class HeaderIntroduction(HeaderObject):
     type: str = 'introduction'
 
@@ -140,7 +278,7 @@ class HeaderIntroduction(HeaderObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class HeaderInstruction(HeaderObject):
     type: str = 'instruction'
 
@@ -149,7 +287,7 @@ class HeaderInstruction(HeaderObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class Section(ZofarPageObject):
     header_list: list
     children: List[Union[ZofarPageObject, Section]] = field(default_factory=list)
@@ -157,17 +295,14 @@ class Section(ZofarPageObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
-class ResponseDomain:
+@dataclass(kw_only=True, eq=False)
+class ResponseDomain(StructuralObject):
     uid: str = "rd"
     header_list: List[HeaderObject] = field(default_factory=list)
 
-    def __eq__(self, other):
-        return eq_attributes_and_values(self, other)
-
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class Question(ZofarPageObject):
     type: Optional[str]
     var_ref: Optional[VarRef] = None
@@ -178,7 +313,7 @@ class Question(ZofarPageObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class ZofarLabel(ZofarPageObject):
     content: str
 
@@ -187,14 +322,14 @@ class ZofarLabel(ZofarPageObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class ZofarQuestionOpen(Question):
     var_ref: VarRef
     type: str = 'questionOpen'
     size: str = "40"
     small_option: bool = True
-    prefix_list: List[Any]
-    postfix_list: List[Any]
+    prefix_list: List[Any] = field(default_factory=list)
+    postfix_list: List[Any] = field(default_factory=list)
 
     def gen_xml(self):
         if self.header_list:
@@ -213,27 +348,55 @@ class ZofarQuestionOpen(Question):
 
 class ZofarAttachedOpen(ZofarQuestionOpen):
     def gen_xml(self):
-        return ATTQO(uid=self.uid, variable=self.var_ref.variable.name)
+        children = []
+        if self.prefix_list:
+            children.append(PRE(*[pre.gen_xml() for pre in self.prefix_list]))
+        if self.postfix_list:
+            children.append(POST(*[post.gen_xml() for post in self.postfix_list]))
+        return ATTQO(*children, uid=self.uid, variable=self.var_ref.variable.name)
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class AnswerOption(ZofarPageObject):
     label: Optional[str]
     missing: Optional[bool] = False
     var_ref: Optional[VarRef] = None
     attached_open_list: List[ZofarQuestionOpen] = field(default_factory=list)
 
-    def gen_xml(self) -> _lE:
+    def _gen_xml(self) -> _lE:
         raise NotImplementedError
 
+    def signature(self) -> tuple:
+        # everything but the variable: the answer options of all items of a matrix question have the same signature
+        return (type(self).__name__, self.uid, self.label, self.visible, self.missing, getattr(self, 'value', None),
+                getattr(self, 'exclusive', None), structural_key(self.attached_open_list))
+
+    def template_key(self) -> Optional[tuple]:
+        # answer options with attached opens are not cached
+        if self.attached_open_list:
+            return None
+        return self.signature()
+
+    def gen_xml(self) -> _lE:
+        templates = AO_TEMPLATES.get()
+        key = self.template_key() if templates is not None else None
+        if key is None:
+            return self._gen_xml()
+        if key not in templates:
+            templates[key] = self._gen_xml()
+        element = copy.deepcopy(templates[key])
+        if element.get('variable') is not None:
+            element.set('variable', self.var_ref.variable.name)
+        return element
+
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class SCAnswerOption(AnswerOption):
     value: Optional[str]
 
-    def gen_xml(self) -> _lE:
+    def _gen_xml(self) -> _lE:
         if self.missing:
             return AO(*[qo.gen_xml() for qo in self.attached_open_list], uid=self.uid, label=html.escape(self.label),
                       visible=self.visible, value=self.value, missing=str(self.missing).lower())
@@ -243,12 +406,12 @@ class SCAnswerOption(AnswerOption):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class MCAnswerOption(AnswerOption):
     var_ref: VarRef
     exclusive: bool = False
 
-    def gen_xml(self) -> _lE:
+    def _gen_xml(self) -> _lE:
         if not self.exclusive:
             return AO(*[qo.gen_xml() for qo in self.attached_open_list], uid=self.uid, label=html.escape(self.label),
                       visible=self.visible, variable=self.var_ref.variable.name)
@@ -258,7 +421,7 @@ class MCAnswerOption(AnswerOption):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class SCResponseDomain(ResponseDomain):
     var_ref: VarRef
     ao_list: List[AnswerOption]
@@ -282,7 +445,7 @@ class SCResponseDomain(ResponseDomain):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class MCResponseDomain(ResponseDomain):
     ao_list: List[MCAnswerOption] = field(default_factory=list)
 
@@ -294,7 +457,7 @@ class MCResponseDomain(ResponseDomain):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class MatrixItem(ZofarPageObject):
     header_list: List[HeaderObject]
     attached_open_list: List[ZofarAttachedOpen] = field(default_factory=list)
@@ -304,7 +467,7 @@ class MatrixItem(ZofarPageObject):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class QOMatrixItem(MatrixItem):
     var_ref: Optional[VarRef]
     response_domain: SCResponseDomain
@@ -317,7 +480,7 @@ class QOMatrixItem(MatrixItem):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class SCMatrixItem(MatrixItem):
     response_domain: SCResponseDomain
 
@@ -331,14 +494,8 @@ class SCMatrixItem(MatrixItem):
                     uid=self.uid, visible=self.visible)
 
 
-def eq_attributes_and_values(obj1: object, obj2: object) -> bool:
-    if obj1.__dict__.keys() != obj2.__dict__.keys():
-        return False
-    return all([getattr(obj1, attr) == getattr(obj2, attr) for attr in obj1.__dict__.keys()])
-
-
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class MCMatrixItem(MatrixItem):
     response_domain: MCResponseDomain
 
@@ -352,7 +509,7 @@ class MCMatrixItem(MatrixItem):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class MatrixResponseDomain(ResponseDomain):
     no_response_options: Optional[str]
     # for singleChoice -> "dropDown"
@@ -369,25 +526,32 @@ class MatrixResponseDomain(ResponseDomain):
         # ensure that each item uid is unique
         assert len(self.item_list) == len(set([it.uid for it in self.item_list]))
 
-        ref_ao_list = None
-        for it in self.item_list:
-            if ref_ao_list is None:
-                ref_ao_list = it.response_domain.ao_list
+        # all items have to have the same answer options (multiple choice items have their own variables);
+        #  items usually share one list, so signatures are computed once per distinct list
+        ref_ao_list = self.item_list[0].response_domain.ao_list
+        ref_signature = [ao.signature() for ao in ref_ao_list]
+        checked = {id(ref_ao_list)}
+        for it in self.item_list[1:]:
+            ao_list = it.response_domain.ao_list
+            if id(ao_list) in checked:
                 continue
-            assert it.response_domain.ao_list == ref_ao_list
+            assert [ao.signature() for ao in ao_list] == ref_signature
+            checked.add(id(ao_list))
 
+        # (title uids are numbered by the position of the answer option, also in the missing header)
         header_titles_list = [TITLE(ao.label, uid=f'ti{i + 1}') for i, ao in enumerate(ref_ao_list) if not ao.missing]
-        header_missing_list = [TITLE(ao.label, uid=f'ti{i + 1 + len([a for a in ref_ao_list if not ao.missing])}') for
-                               i, ao in enumerate(ref_ao_list)
-                               if ao.missing]
+        header_missing_list = [TITLE(ao.label, uid=f'ti{i + 1}') for i, ao in enumerate(ref_ao_list) if ao.missing]
+
+        # answer option elements are rendered once and copied for every item
+        with ao_templates(AO_TEMPLATES.get()):
+            item_elements = [it.gen_xml() for it in self.item_list]
 
         return RD(HEADER(*header_titles_list), MIS_HEADER(*header_missing_list),
-                  *[it.gen_xml() for it in self.item_list], uid=self.uid,
-                  noResponseOptions=str(max([len(it.response_domain.ao_list) for it in self.item_list])))
+                  *item_elements, uid=self.uid, noResponseOptions=str(len(ref_ao_list)))
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class ZofarQuestionSC(Question):
     response_domain: SCResponseDomain
     type: str = 'questionSingleChoice'
@@ -402,7 +566,7 @@ class ZofarQuestionSC(Question):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class ZofarQuestionMC(Question):
     response_domain: MCResponseDomain
     type: str = 'multipleChoice'
@@ -410,11 +574,11 @@ class ZofarQuestionMC(Question):
     def gen_xml(self):
         return MC(HEADER(*[h.gen_xml() for h in self.header_list]),
                   self.response_domain.gen_xml(),
-                  uid=self.uid)
+                  uid=self.uid, visible=self.visible)
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class ZofarQuestionMCMatrix(Question):
     response_domain: MatrixResponseDomain
     title_header: List[ZofarPageObject]
@@ -427,12 +591,12 @@ class ZofarQuestionMCMatrix(Question):
 
     def gen_xml(self) -> _lE:
         return MMC(HEADER(*[h.gen_xml() for h in self.header_list]),
-                   self.response_domain.gen_xml(), uid=self.uid,
+                   self.response_domain.gen_xml(), uid=self.uid, visible=self.visible,
                    block="true")
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class ZofarQuestionSCMatrix(Question):
     title_header: List[ZofarPageObject]
     missing_header: List[ZofarPageObject]
@@ -447,7 +611,7 @@ class ZofarQuestionSCMatrix(Question):
 
 
 # noinspection PyDataclass
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class ZofarQuestionQOMatrix(Question):
     title_header: List[ZofarPageObject]
     response_domain: MatrixResponseDomain
@@ -593,3 +757,31 @@ class Questionnaire:
 
 def check_for_unique_uids(list_of_elements: List[ZofarPageObject]) -> bool:
     return len({ao.uid for ao in list_of_elements}) == len(list_of_elements)
+
+
+def collect_var_refs(obj: Any) -> List[VarRef]:
+    """
+    :param obj: page object (question, response domain, answer option, ...) or list of page objects
+    :return: all variable references within obj, in field order
+    """
+    var_refs = []
+    _collect_var_refs(obj, var_refs, set())
+    return var_refs
+
+
+def _collect_var_refs(obj: Any, var_refs: List[VarRef], seen: set) -> None:
+    if isinstance(obj, (str, int, float, type(None), HeaderObject)):
+        return
+    if isinstance(obj, VarRef):
+        var_refs.append(obj)
+        return
+    # answer option lists are usually shared by all items of a matrix question
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    if isinstance(obj, (list, tuple)):
+        for child in obj:
+            _collect_var_refs(child, var_refs, seen)
+    elif is_dataclass(obj):
+        for value in obj.__dict__.values():
+            _collect_var_refs(value, var_refs, seen)
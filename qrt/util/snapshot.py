@@ -0,0 +1,334 @@
+"""
+Versioned binary snapshots of parsed questionnaires, so that a questionnaire does not have to be parsed again
+(e.g. after a restart or in another worker process):
+
+    write_snapshot(q, path)
+    q = read_snapshot(path)
+
+Layout (little endian):
+
+    header          magic, format version, number of strings, number of tokens
+    string offsets  uint32 * (number of strings + 1), relative to the start of the string data
+    string data     UTF-8, every distinct string once
+    tokens          uint32 * number of tokens (4-byte aligned): the class table, followed by the encoded value;
+                    a string is a single token (STRING_BASE + its index), other values start with a type token
+
+The class table lists the model classes used in the snapshot with their field names, so that a snapshot written by
+an older version can be detected (SnapshotError) instead of being restored with shifted fields. Objects are encoded
+as their class index followed by their field values; an object that occurs several times (e.g. a page in pages and
+pages_unmasked) is encoded once and referenced afterwards. lxml elements (Page.source_element) are not stored, the
+field gets its default value.
+
+The file is memory-mapped when it is read: the string data is decoded on first use of each string.
+"""
+import dataclasses
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from pathlib import Path, PurePath
+from typing import Any, Dict, List, Tuple, Union
+
+from lxml.etree import _Element as _lE
+
+from qrt.util import qml, questionnaire
+from qrt.util.qml import Questionnaire
+
+MAGIC = b'QRTQ'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<4sHHII')
+
+# modules the classes of a snapshot may come from
+MODEL_MODULES = {module.__name__: module for module in (qml, questionnaire)}
+
+# token types
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_LIST, T_TUPLE, T_DICT, T_OBJECT, T_REF, T_DEFAULT, T_PATH = range(12)
+STRING_BASE = 16
+
+_DOUBLE = struct.Struct('<d')
+_INT64 = struct.Struct('<q')
+_UINT32_PAIR = struct.Struct('<II')
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class _Encoder:
+    def __init__(self):
+        self.strings: Dict[str, int] = {}
+        self.classes: Dict[type, int] = {}
+        self.class_fields: List[Tuple[type, Tuple[str, ...]]] = []
+        self.objects: Dict[int, int] = {}
+        # encoded objects are kept alive until the end, so that their ids are not reused
+        self._keep = []
+        self.tokens = array('I')
+
+    def string(self, value: str) -> int:
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def class_index(self, cls: type) -> int:
+        index = self.classes.get(cls)
+        if index is None:
+            model_class = cls.__dict__.get('_mutable_class', cls)
+            if model_class.__module__ not in MODEL_MODULES or not dataclasses.is_dataclass(model_class):
+                raise TypeError(f'cannot store objects of type {cls.__qualname__} in a snapshot')
+            index = self.classes[cls] = len(self.class_fields)
+            self.class_fields.append((cls, tuple(f.name for f in dataclasses.fields(model_class))))
+        return index
+
+    def encode(self, value: Any) -> None:
+        tokens = self.tokens
+        if value is None:
+            tokens.append(T_NONE)
+        elif value is True:
+            tokens.append(T_TRUE)
+        elif value is False:
+            tokens.append(T_FALSE)
+        elif isinstance(value, str):
+            tokens.append(STRING_BASE + self.string(value))
+        elif isinstance(value, int):
+            tokens.append(T_INT)
+            tokens.extend(_UINT32_PAIR.unpack(_INT64.pack(value)))
+        elif isinstance(value, float):
+            tokens.append(T_FLOAT)
+            tokens.extend(_UINT32_PAIR.unpack(_DOUBLE.pack(value)))
+        elif isinstance(value, (list, tuple)):
+            tokens.extend((T_LIST if isinstance(value, list) else T_TUPLE, len(value)))
+            for v in value:
+                self.encode(v)
+        elif isinstance(value, dict):
+            tokens.extend((T_DICT, len(value)))
+            for k, v in value.items():
+                self.encode(k)
+                self.encode(v)
+        elif isinstance(value, _lE):
+            tokens.append(T_DEFAULT)
+        elif isinstance(value, PurePath):
+            tokens.extend((T_PATH, self.string(str(value))))
+        elif id(value) in self.objects:
+            tokens.extend((T_REF, self.objects[id(value)]))
+        else:
+            class_index = self.class_index(type(value))
+            self.objects[id(value)] = len(self.objects)
+            self._keep.append(value)
+            tokens.extend((T_OBJECT, class_index))
+            for name in self.class_fields[class_index][1]:
+                self.encode(getattr(value, name))
+
+    def to_bytes(self, body: array) -> bytes:
+        # the class table is encoded in front of the value
+        header = array('I')
+        header.append(len(self.class_fields))
+        for cls, field_names in self.class_fields:
+            model_class = cls.__dict__.get('_mutable_class', cls)
+            header.extend((self.string(f'{model_class.__module__}:{model_class.__qualname__}'),
+                           int(model_class is not cls), len(field_names)))
+            header.extend(self.string(name) for name in field_names)
+        tokens = header + body
+
+        encoded = [s.encode('utf-8') for s in self.strings]
+        offsets = array('I', [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        string_data = b''.join(encoded)
+        string_data += b'\0' * (-(HEADER.size + 4 * len(offsets) + len(string_data)) % 4)
+        for a in (offsets, tokens):
+            if a.itemsize != 4:
+                raise RuntimeError('unsigned int is not 32 bit on this platform')
+        return b''.join([HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(self.strings), len(tokens)),
+                         _little_endian(offsets), string_data, _little_endian(tokens)])
+
+
+def _little_endian(a: array) -> bytes:
+    if struct.pack('=I', 1) != struct.pack('<I', 1):
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def dumps(value: Any) -> bytes:
+    """
+    :param value: questionnaire (or another value made of model objects, lists, tuples, dicts, strings and numbers)
+    :return: snapshot
+    """
+    encoder = _Encoder()
+    encoder.encode(value)
+    return encoder.to_bytes(encoder.tokens)
+
+
+class _Decoder:
+    def __init__(self, buffer: Union[bytes, memoryview, mmap.mmap]):
+        self.view = memoryview(buffer)
+        self.data = None
+        try:
+            self._read_tables()
+        except (StopIteration, IndexError):
+            self.close()
+            raise SnapshotError('truncated snapshot')
+        except BaseException:
+            self.close()
+            raise
+
+    def _read_tables(self) -> None:
+        view = self.view
+        if len(view) < HEADER.size:
+            raise SnapshotError('not a questionnaire snapshot (too short)')
+        magic, version, _, n_strings, n_tokens = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise SnapshotError('not a questionnaire snapshot')
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f'snapshot format version {version} is not supported (expected {FORMAT_VERSION})')
+        offsets_start = HEADER.size
+        data_start = offsets_start + 4 * (n_strings + 1)
+        if len(view) < data_start:
+            raise SnapshotError('truncated snapshot')
+        self.offsets = _uint32_list(view[offsets_start:data_start])
+        data_end = data_start + self.offsets[-1]
+        tokens_start = data_end + (-data_end % 4)
+        if len(view) != tokens_start + 4 * n_tokens:
+            raise SnapshotError('truncated snapshot')
+        self.data = view[data_start:data_end]
+        self.strings: List[Union[str, None]] = [None] * n_strings
+        # StopIteration at the end of the tokens
+        self.next = iter(_uint32_list(view[tokens_start:])).__next__
+        self.objects = []
+        self.classes = [self.read_class() for _ in range(self.next())]
+
+    def close(self) -> None:
+        # views of a memory map have to be released before it can be closed
+        if self.data is not None:
+            self.data.release()
+        self.view.release()
+
+    def string(self, index: int) -> str:
+        value = self.strings[index]
+        if value is None:
+            value = self.strings[index] = str(self.data[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+        return value
+
+    def read_class(self) -> Tuple[type, bool, List[str], Dict[str, dataclasses.Field], Dict[str, dataclasses.Field]]:
+        name = self.string(self.next())
+        frozen = bool(self.next())
+        field_names = [self.string(self.next()) for _ in range(self.next())]
+        module_name, _, qualname = name.partition(':')
+        cls = getattr(MODEL_MODULES.get(module_name), qualname, None)
+        if not isinstance(cls, type) or not dataclasses.is_dataclass(cls):
+            raise SnapshotError(f'unknown class {name} in snapshot')
+        class_fields = {f.name: f for f in dataclasses.fields(cls)}
+        if not set(field_names) <= set(class_fields):
+            raise SnapshotError(f'snapshot of an older version: fields of {qualname} changed')
+        # fields added since the snapshot was written
+        missing = {name: f for name, f in class_fields.items() if name not in field_names}
+        for f in missing.values():
+            if f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING:
+                raise SnapshotError(f'snapshot of an older version: field {qualname}.{f.name} is missing')
+        return cls, frozen, field_names, class_fields, missing
+
+    def decode(self, f: dataclasses.Field = None) -> Any:
+        token = self.next()
+        if token >= STRING_BASE:
+            value = self.strings[token - STRING_BASE]
+            return value if value is not None else self.string(token - STRING_BASE)
+        if token == T_OBJECT:
+            cls, frozen, field_names, class_fields, missing = self.classes[self.next()]
+            obj = cls.__new__(cls)
+            self.objects.append(obj)
+            for name in field_names:
+                object.__setattr__(obj, name, self.decode(class_fields[name]))
+            for name, missing_field in missing.items():
+                object.__setattr__(obj, name, _default(missing_field))
+            return obj.freeze() if frozen else obj
+        if token == T_LIST:
+            return [self.decode() for _ in range(self.next())]
+        if token == T_TUPLE:
+            return tuple([self.decode() for _ in range(self.next())])
+        if token == T_DICT:
+            result = {}
+            for _ in range(self.next()):
+                key = self.decode()
+                result[key] = self.decode()
+            return result
+        if token == T_REF:
+            return self.objects[self.next()]
+        if token == T_NONE:
+            return None
+        if token == T_TRUE:
+            return True
+        if token == T_FALSE:
+            return False
+        if token == T_INT:
+            return _INT64.unpack(_UINT32_PAIR.pack(self.next(), self.next()))[0]
+        if token == T_FLOAT:
+            return _DOUBLE.unpack(_UINT32_PAIR.pack(self.next(), self.next()))[0]
+        if token == T_PATH:
+            return Path(self.string(self.next()))
+        if token == T_DEFAULT and f is not None:
+            return _default(f)
+        raise SnapshotError(f'invalid token {token}')
+
+
+def _uint32_list(view: memoryview) -> List[int]:
+    a = array('I')
+    a.frombytes(view)
+    if struct.pack('=I', 1) != struct.pack('<I', 1):
+        a.byteswap()
+    return a.tolist()
+
+
+def _default(f: dataclasses.Field) -> Any:
+    return f.default_factory() if f.default_factory is not dataclasses.MISSING else f.default
+
+
+def loads(buffer: Union[bytes, memoryview, mmap.mmap]) -> Any:
+    """
+    :param buffer: snapshot, see dumps
+    :return: the stored value
+    """
+    decoder = _Decoder(buffer)
+    try:
+        return decoder.decode()
+    except (StopIteration, IndexError):
+        raise SnapshotError('truncated snapshot')
+    finally:
+        decoder.close()
+
+
+def write_snapshot(q: Questionnaire, path: Union[str, Path]) -> int:
+    """
+    :param q: questionnaire
+    :param path: snapshot file (replaced atomically)
+    :return: size of the snapshot in bytes
+    """
+    data = dumps(q)
+    path = Path(path)
+    # unique temporary file: the same snapshot may be written by several threads at the same time
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return len(data)
+
+
+def read_snapshot(path: Union[str, Path]) -> Questionnaire:
+    """
+    :param path: snapshot file written by write_snapshot
+    :return: questionnaire
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise SnapshotError('empty snapshot')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            q = loads(mm)
+    if not isinstance(q, Questionnaire):
+        raise SnapshotError(f'snapshot does not contain a questionnaire, but {type(q).__name__}')
+    return q
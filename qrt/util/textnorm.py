@@ -0,0 +1,169 @@
+"""
+Text normalization for questionnaire files: html character references (umlauts etc.), as written by some editors
+and parsers, are replaced by the characters themselves.
+
+    python -m qrt.util.textnorm [--numeric] [--in-place] questionnaire.xml ...
+"""
+import argparse
+import html
+import os
+import re
+import sys
+import tempfile
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Generator, Iterable, List, Optional, Pattern
+
+# character references: named ("&auml;") and numeric ("&#228;", "&#xe4;")
+RE_ENTITY = re.compile(r'&#?[a-z0-9A-Z]{,6};')
+# numeric character references only
+RE_NUMERIC_ENTITY = re.compile(r'&#.{,5};')
+# longest possible match of the patterns above
+MAX_ENTITY_LEN = 9
+
+# references that have to stay escaped in XML, and typographic quotes (kept escaped on purpose)
+KEEP_ESCAPED = frozenset(['&amp;', '&lt;', '&gt;', '&quot;', '&apos;', '&#8221;', '&#8220;', '&#8222;'])
+# characters that are markup (in text or attribute values), references to them are never replaced
+XML_SPECIAL_CHARACTERS = frozenset('&<>"\'')
+
+CHUNK_SIZE = 2 ** 20
+
+
+@lru_cache(maxsize=4096)
+def _unescape_entity(entity: str) -> str:
+    return html.unescape(entity)
+
+
+def _html_replacement(counts: Optional[Counter]) -> Callable[[re.Match], str]:
+    def repl(match: re.Match) -> str:
+        entity = match.group(0)
+        if entity in KEEP_ESCAPED:
+            return entity
+        replacement = _unescape_entity(entity)
+        if replacement in XML_SPECIAL_CHARACTERS:
+            return entity
+        if counts is not None and replacement != entity:
+            counts[entity] += 1
+        return replacement
+
+    return repl
+
+
+def _numeric_replacement(counts: Optional[Counter]) -> Callable[[re.Match], str]:
+    def repl(match: re.Match) -> str:
+        entity = match.group(0)
+        replacement = _unescape_entity(entity)
+        if replacement in XML_SPECIAL_CHARACTERS:
+            return entity
+        if counts is not None and replacement != entity:
+            counts[entity] += 1
+        return replacement
+
+    return repl
+
+
+def unescape_html(text: str, counts: Optional[Counter] = None) -> str:
+    """
+    Replace character references by the characters, except for those in KEEP_ESCAPED and references to
+    XML_SPECIAL_CHARACTERS (one pass over the text).
+
+    :param counts: if given, the number of replacements per reference is added to it
+    """
+    return RE_ENTITY.sub(_html_replacement(counts), text)
+
+
+def unescape_numeric(text: str, counts: Optional[Counter] = None) -> str:
+    """
+    Replace all numeric character references by the characters, except for references to XML_SPECIAL_CHARACTERS
+    (one pass over the text).
+
+    :param counts: if given, the number of replacements per reference is added to it
+    """
+    return RE_NUMERIC_ENTITY.sub(_numeric_replacement(counts), text)
+
+
+def sub_chunks(pattern: Pattern, repl: Callable[[re.Match], str], chunks: Iterable[str],
+               max_match_len: int = MAX_ENTITY_LEN) -> Generator[str, None, None]:
+    """
+    pattern.sub over a text given in chunks; matches may span chunk boundaries, as long as they are not longer
+    than max_match_len.
+    """
+    tail = ''
+    for chunk in chunks:
+        text = tail + chunk
+        # matches starting before cut are complete within text
+        cut = max(len(text) - (max_match_len - 1), 0)
+        pieces = []
+        pos = 0
+        for match in pattern.finditer(text):
+            if match.start() >= cut:
+                break
+            pieces.append(text[pos:match.start()])
+            pieces.append(repl(match))
+            pos = match.end()
+        pieces.append(text[pos:max(pos, cut)])
+        tail = text[max(pos, cut):]
+        yield ''.join(pieces)
+    if tail:
+        yield pattern.sub(repl, tail)
+
+
+def normalize_chunks(chunks: Iterable[str], numeric: bool = False,
+                     counts: Optional[Counter] = None) -> Generator[str, None, None]:
+    """
+    Streaming variant of unescape_html (or unescape_numeric).
+    """
+    if numeric:
+        return sub_chunks(RE_NUMERIC_ENTITY, _numeric_replacement(counts), chunks)
+    return sub_chunks(RE_ENTITY, _html_replacement(counts), chunks)
+
+
+def read_chunks(path: Path, chunk_size: int = CHUNK_SIZE) -> Generator[str, None, None]:
+    with open(path, encoding='utf-8', newline='') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def normalize_file(path: Path, output: Optional[Path] = None, numeric: bool = False) -> Counter:
+    """
+    Normalize a (large) file chunk by chunk; the result is written to a temporary file that replaces the output
+    (default: the input file) when complete.
+
+    :return: number of replacements per character reference
+    """
+    output = output if output is not None else path
+    counts = Counter()
+    fd, tmp_name = tempfile.mkstemp(dir=output.parent, prefix=f'.{output.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            for piece in normalize_chunks(read_chunks(path), numeric=numeric, counts=counts):
+                f.write(piece)
+        os.replace(tmp_name, output)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return counts
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m qrt.util.textnorm',
+                                     description='replace html character references by the characters')
+    parser.add_argument('files', nargs='+', type=Path)
+    parser.add_argument('--numeric', action='store_true', help='replace all numeric references (and only those)')
+    parser.add_argument('--in-place', action='store_true', help='overwrite the files (default: write to stdout)')
+    parsed = parser.parse_args(args)
+
+    for path in parsed.files:
+        if parsed.in_place:
+            counts = normalize_file(path, numeric=parsed.numeric)
+            print(f'{path}: {sum(counts.values())} replacements', file=sys.stderr)
+            for entity, count in sorted(counts.items()):
+                print(f'    {entity} -> {_unescape_entity(entity)}: {count}', file=sys.stderr)
+        else:
+            for piece in normalize_chunks(read_chunks(path), numeric=parsed.numeric):
+                sys.stdout.write(piece)
+
+
+if __name__ == '__main__':
+    main()
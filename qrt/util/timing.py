@@ -0,0 +1,153 @@
+"""
+Per-stage timing instrumentation. Stages and counters are recorded only while a recorder is active:
+
+    with recording() as recorder:
+        q = read_xml(path)
+    recorder.summary()  # {'stages': {'read_xml.parse': {'seconds': ..., 'calls': 1}, ...}, 'counters': {...}}
+
+Without an active recorder, stage() and count() cost a context variable lookup.
+
+With TimingRecorder(trace_memory=True) and tracemalloc tracing (see qrt.util.memprofile), the peak of the traced
+memory within each stage (above its level at the start of the stage) and the memory still allocated at its end are
+recorded as well.
+"""
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Generator, Optional, Union
+
+
+class TimingRecorder:
+    """
+    Accumulates the (wall clock) seconds and number of calls per stage name, and named counters. Nested stages are
+    recorded independently, i.e. the time of an inner stage is also part of the time of the enclosing stage.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+        self.trace_memory = trace_memory
+        # bytes: maximum over the calls of a stage / sum over the calls
+        self.peak_bytes = Counter()
+        self.retained_bytes = Counter()
+        # tracemalloc has a single peak, which every stage resets: per open stage, the highest peak seen before the
+        # last reset (by nested stages)
+        self._peaks = []
+
+    def add(self, name: str, seconds: float) -> None:
+        self.seconds[name] += seconds
+        self.calls[name] += 1
+
+    def add_memory(self, name: str, peak_bytes: int, retained_bytes: int) -> None:
+        self.peak_bytes[name] = max(self.peak_bytes[name], peak_bytes)
+        self.retained_bytes[name] += retained_bytes
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def summary(self) -> Dict[str, Dict[str, Union[int, Dict[str, Union[float, int]]]]]:
+        stages = {name: {'seconds': round(seconds, 6), 'calls': self.calls[name]}
+                  for name, seconds in self.seconds.items()}
+        for name in self.peak_bytes:
+            stages[name].update({'peak_bytes': self.peak_bytes[name], 'retained_bytes': self.retained_bytes[name]})
+        return {'stages': stages, 'counters': dict(self.counters)}
+
+
+RECORDER: ContextVar[Optional[TimingRecorder]] = ContextVar('timing_recorder', default=None)
+
+
+class _Stage:
+    __slots__ = ('recorder', 'name', 'start', 'memory_start')
+
+    def __init__(self, recorder: TimingRecorder, name: str):
+        self.recorder = recorder
+        self.name = name
+        self.memory_start = None
+
+    def __enter__(self):
+        if self.recorder.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peaks = self.recorder._peaks
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+            peaks.append(current)
+            tracemalloc.reset_peak()
+            self.memory_start = current
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.recorder.add(self.name, time.perf_counter() - self.start)
+        if self.memory_start is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            peaks = self.recorder._peaks
+            peak = max(peak, peaks.pop())
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+            self.recorder.add_memory(self.name, peak - self.memory_start, current - self.memory_start)
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NO_STAGE = _NoStage()
+
+
+def stage(name: str) -> Union[_Stage, _NoStage]:
+    """
+    :return: context manager that adds its run time to the stage name of the active recorder (if any)
+    """
+    recorder = RECORDER.get()
+    if recorder is None:
+        return NO_STAGE
+    return _Stage(recorder, name)
+
+
+def count(name: str, n: int = 1) -> None:
+    recorder = RECORDER.get()
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator: every call of the function is recorded as stage name.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs) -> Any:
+            recorder = RECORDER.get()
+            if recorder is None:
+                return func(*args, **kwargs)
+            with _Stage(recorder, name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def recording(recorder: Optional[TimingRecorder] = None) -> Generator[TimingRecorder, None, None]:
+    """
+    Activate a recorder (a new one by default) for the current context.
+    """
+    recorder = recorder if recorder is not None else TimingRecorder()
+    token = RECORDER.set(recorder)
+    try:
+        yield recorder
+    finally:
+        RECORDER.reset(token)
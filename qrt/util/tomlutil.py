@@ -1,89 +1,145 @@
+import argparse
 import datetime
+import sys
 import tomllib
-from typing import Dict, Union, List, Tuple
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Union
 
-from qrt.util.questionnaire import Questionnaire, Page, Question, ZofarQuestionMCMatrix, AnswerOption, SCAnswerOption, \
-    SCMatrixItem, SCResponseDomain, VarRef, Variable, VAR_TYPE_SC, HeaderQuestion, ZofarAttachedOpen, VAR_TYPE_STR, \
-    MatrixResponseDomain, ZofarPageObject, HeaderTitle, HeaderInstruction, HeaderIntroduction
+from qrt.util.qmlgen import QUESTION_BUILDERS, normalize_spec, questionnaire_from_pages
+from qrt.util.qmlwriter import write_questionnaire
+from qrt.util.questionnaire import Questionnaire, Page, Question
+
+TomlValue = Union[int, float, str, dict, list, datetime.datetime, bool]
+
+# question types of the programming template (Programmiervorlage) -> qmlgen.QUESTION_BUILDERS
+TOML_QUESTION_TYPES = {
+    'matrixQuestionSingleChoice': 'mqsc',
+    'questionSingleChoice': 'qsc',
+    'questionsSingleChoice': 'qsc',
+    'multipleChoice': 'mc',
+    'matrixMultipleChoice': 'mqmc',
+    'questionOpen': 'qo',
+}
+
+
+def toml_elements(elements: List[Dict[str, TomlValue]]) -> List[Dict[str, TomlValue]]:
+    # headers, answer options and items: template key names -> qmlgen key names
+    converted = []
+    for element in elements:
+        element = dict(element)
+        if element.get('missing') is True:
+            element['missing'] = 'on'
+        if 'attachedOpen' in element:
+            element['attached_open'] = toml_elements(element.pop('attachedOpen'))
+        for key in ['prefix', 'postfix']:
+            # empty tables ("prefix = { }") are placeholders in the template
+            if key in element and not isinstance(element[key], str):
+                del element[key]
+        converted.append(element)
+    return converted
+
+
+def toml_to_spec(q_uid: str, q_data: Dict[str, TomlValue]) -> Dict[str, Any]:
+    """
+    :param q_uid: question uid (table name in the template)
+    :param q_data: question table
+    :return: question spec for qmlgen.QUESTION_BUILDERS
+    """
+    spec = {'q_type': TOML_QUESTION_TYPES[q_data['type']], 'q_uid': q_uid,
+            'q_visible': q_data.get('visible', '').strip() or 'true',
+            'headers': toml_elements(q_data.get('headers', []))}
+    for key in ['aos', 'items']:
+        if key in q_data:
+            spec[key] = toml_elements(q_data[key])
+    if 'variable' in q_data:
+        spec['q_variable'] = q_data['variable']
+    for key in ['size', 'rd_type']:
+        if key in q_data:
+            spec[key] = q_data[key]
+    for key in ['prefix', 'postfix']:
+        # empty tables ("prefix = { }") are placeholders in the template
+        if isinstance(q_data.get(key), str) and q_data[key] != '':
+            spec[key] = q_data[key]
+    return spec
+
+
+def build_toml_question(q_uid: str, q_data: Dict[str, TomlValue]) -> Question:
+    """
+    :raises ValueError: for incomplete or inconsistent question tables
+    """
+    spec = toml_to_spec(q_uid, q_data)
+    try:
+        return QUESTION_BUILDERS[spec['q_type']](normalize_spec(spec))
+    except KeyError as err:
+        raise ValueError(f'question "{q_uid}": missing key {err.args[0]}')
+    except AssertionError:
+        raise ValueError(f'question "{q_uid}": uids are not unique')
 
 
 def read_pv(input_str: str) -> Questionnaire:
+    """
+    :param input_str: TOML template
+    :return: questionnaire with question objects as body_questions of its pages
+    """
+    return pv_questionnaire(tomllib.loads(input_str))
+
+
+def pv_questionnaire(pv_dict: Dict[str, TomlValue]) -> Questionnaire:
+    """
+    Questions are grouped by page (pages in order of their first appearance), variables are declared in order of
+    their first use. Question types that cannot be generated yet are reported in the warnings of the questionnaire.
+
+    :param pv_dict: parsed TOML template
+    """
+    warnings = []
+    pages = {}
+    for q_uid, q_data in pv_dict.items():
+        if not isinstance(q_data, dict):
+            # survey name etc.
+            continue
+        if 'page' not in q_data or 'type' not in q_data:
+            raise ValueError(f'question "{q_uid}": "page" and "type" are required')
+        if q_data['page'] not in pages:
+            pages[q_data['page']] = Page(uid=q_data['page'])
+        page = pages[q_data['page']]
+        if q_data['type'] not in TOML_QUESTION_TYPES:
+            warnings.append(f'page "{page.uid}", question "{q_uid}": question type "{q_data["type"]}" '
+                            f'is not supported')
+            page.warnings.append(f'question "{q_uid}": question type "{q_data["type"]}" is not supported')
+            continue
+        page.body_questions.append(build_toml_question(q_uid, q_data))
+
+    q = questionnaire_from_pages(list(pages.values()))
+    q.warnings.extend(warnings)
+    return q
+
+
+def compile_pv(input_str: str, out: Union[str, Path, BinaryIO]) -> Questionnaire:
+    """
+    Compile a TOML programming template to a questionnaire.xml.
+
+    :param input_str: TOML template
+    :param out: file name or binary file-like object
+    :return: the compiled questionnaire (with warnings)
+    """
     pv_dict = tomllib.loads(input_str)
-    survey = pv_dict.pop('survey')
-    pages = sorted(list({q_data['page'] for q_id, q_data in pv_dict.items()}))
-    q = Questionnaire()
-    for page in pages:
-        p = Page(uid=page)
-        page_questions = {q_uid: q_data for q_uid, q_data in pv_dict.items() if q_data['page'] == page}
-        for q_id, q_data in page_questions.items():
-            if q_data['type'] == 'matrixQuestionSingleChoice':
-                p.body_questions.append(toml_parse_mqsc(q_id, q_data))
-                pass
-            elif q_data['type'] == 'questionsSingleChoice':
-                pass
-            elif q_data['type'] == 'multipleChoice':
-                pass
-            elif q_data['type'] == 'matrixMultipleChoice':
-                pass
-            elif q_data['type'] == 'questionOpen':
-                pass
-            elif q_data['type'] == 'monthpicker':
-                pass
-            elif q_data['type'] == 'openMatrix':
-                pass
-        pass
-    pass
-
-
-def ao_list_to_header_list(ao_list: List[AnswerOption]) -> Tuple[List[ZofarPageObject], List[ZofarPageObject]]:
-    reg_header = [HeaderTitle(uid=ao.uid, content=ao.label) for ao in ao_list if not ao.missing]
-    mis_header = [HeaderTitle(uid=ao.uid, content=ao.label) for ao in ao_list if ao.missing]
-    return reg_header, mis_header
-
-
-def toml_parse_mqsc(q_uid: str,
-                    q_data: Dict[str, Union[int, float, str, dict, list, datetime.datetime, bool]]) -> Question:
-    ao_list = [SCAnswerOption(**ao) for ao in q_data['aos']]
-    it_list = []
-    q_header_list = []
-    for header in q_data['headers']:
-        assert isinstance(header, dict)
-        if header['type'] == 'question':
-            q_header_list.append(HeaderQuestion(uid=header['uid'], content=header['text']))
-        elif header['type'] == 'instruction':
-            q_header_list.append(HeaderInstruction(uid=header['uid'], content=header['text']))
-        elif header['type'] == 'introduction':
-            q_header_list.append(HeaderIntroduction(uid=header['uid'], content=header['text']))
-
-    for item in q_data['items']:
-        assert isinstance(item, dict)
-        var_ref = VarRef(variable=Variable(name=item['variable'], type=VAR_TYPE_SC))
-        rd = SCResponseDomain(ao_list=ao_list, var_ref=var_ref)
-        header_list = [HeaderQuestion(uid='q', content=item['text'])]
-        att_open_list = []
-        if 'attachedOpen' in item.keys():
-            prefix = None
-            postfix = None
-            for att_open_raw in item['attachedOpen']:
-                att_open_var_ref = VarRef(variable=Variable(name=att_open_raw['variable'], type=VAR_TYPE_STR))
-                if 'prefix' in att_open_raw:
-                    if att_open_raw['prefix'] != {}:
-                        prefix = att_open_raw['prefix']
-                if 'postfix' in att_open_raw:
-                    if att_open_raw['postfix'] != {}:
-                        postfix = att_open_raw['postfix']
-                att_open_list.append(ZofarAttachedOpen(uid='att_open_list',
-                                                       var_ref=att_open_var_ref,
-                                                       prefix=prefix,
-                                                       postfix=postfix))
-
-        it_list.append(SCMatrixItem(uid=item['uid'], header_list=header_list,
-                                    response_domain=rd,
-                                    attached_open_list=att_open_list))
-
-    rd = MatrixResponseDomain(no_response_options=str(len(ao_list)), item_list=it_list)
-    title_header, missing_header = ao_list_to_header_list(ao_list)
-    q = ZofarQuestionMCMatrix(type='matrixQuestionSingleChoice', uid=q_uid, response_domain=rd,
-                              title_header=title_header, missing_header=missing_header,
-                              header_list=q_header_list)
+    q = pv_questionnaire(pv_dict)
+    write_questionnaire(out, q, name=pv_dict.get('survey', 'questionnaire'))
     return q
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(prog='python -m qrt.util.tomlutil',
+                                     description='compile a TOML programming template to a questionnaire.xml')
+    parser.add_argument('input', type=Path)
+    parser.add_argument('-o', '--output', type=Path, default=None, help='default: stdout')
+    parsed = parser.parse_args(args)
+
+    out = parsed.output if parsed.output is not None else sys.stdout.buffer
+    q = compile_pv(parsed.input.read_text(encoding='utf-8'), out)
+    for warning in q.warnings:
+        print(f'warning: {warning}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
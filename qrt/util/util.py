@@ -6,9 +6,9 @@ from typing import Any, Dict, Optional, Generator, List, Union, Tuple
 # import qrt.util.questionnaire
 from qrt.util.qml import Questionnaire, Page
 from qrt.util.qmlutil import NS, ZOFAR_PAGE_TAG
+from qrt.util.timing import stage
 # from qrt.util.questionnaire import Questionnaire
 from lxml.etree import ElementTree as lEt
-from qrt.util.graph import prepare_digraph, topologically_sorted_nodes, remove_self_loops, find_cycles
 
 
 def flatten(ll: List[Union[List[Any], Tuple[Any]]]) -> Generator[Any, Any, None]:
@@ -33,44 +33,51 @@ def find_json_episode_data(q: Questionnaire) -> Dict[str, Dict[str, List[str]]]:
 def qml_details(q: Questionnaire, filename: Optional[str] = None) -> Dict[str, Dict[str, Union[str, list, dict]]]:
     warnings_list = []
     vars_dict = OrderedDict()
-    for page, var_list in q.body_vars_per_page_dict().items():
-        for var_ref in var_list:
-            if var_ref.variable.name in vars_dict:
-                if var_ref.variable.type != vars_dict[var_ref.variable.name]:
-                    warnings_list.append(f'variable "{var_ref.variable.name}" already found as '
-                                         f'type "{vars_dict[var_ref.variable.name]}", found '
-                                         f'on page "{page}" as type "{var_ref.variable.type}"')
-                # else -> continue
-            else:
-                vars_dict[var_ref.variable.name] = var_ref.variable.type
+    with stage('qml_details.warnings'):
+        for page, var_list in q.body_vars_per_page_dict().items():
+            for var_ref in var_list:
+                if var_ref.variable.name in vars_dict:
+                    if var_ref.variable.type != vars_dict[var_ref.variable.name]:
+                        warnings_list.append(f'variable "{var_ref.variable.name}" already found as '
+                                             f'type "{vars_dict[var_ref.variable.name]}", found '
+                                             f'on page "{page}" as type "{var_ref.variable.type}"')
+                    # else -> continue
+                else:
+                    vars_dict[var_ref.variable.name] = var_ref.variable.type
     # ToDo: CF 2023-01-04: I do not use the above code - is it obsolete?
 
-    g = prepare_digraph(q)
-    g_cleaned = remove_self_loops(g)
-    topo_sorted_pages = topologically_sorted_nodes(g_cleaned)
-    cycles = find_cycles(g_cleaned)
-
-    json_data_dict = find_json_episode_data(q)
-
-    all_aux_trig_var_impl = {var for var in flatten([v for v in json_data_dict['aux_var_impl'].values()])}
-    all_aux_trig_var_expl = {var for var in flatten([v for v in json_data_dict['aux_var_expl'].values()])}
-
-    all_aux_trig_var = all_aux_trig_var_impl.union(all_aux_trig_var_expl)
-
-    unused_variables = {k: v for k, v in q.vars_declared_not_used().items() if
-                        k not in all_aux_trig_var and not k.startswith('PRELOAD') and k != 'language'}
-
-    headers = ('page', *sorted(json_data_dict.keys()))
-    json_episode_data_table = [['page', *sorted(json_data_dict.keys())]]
-    for p in q.pages:
-        tmp_list = [p.uid]
-        for key in [*sorted(json_data_dict.keys())]:
-            if p.uid in json_data_dict[key]:
-                tmp_list.append(json_data_dict[key][p.uid])
-            else:
-                tmp_list.append(None)
-        assert len(headers) == len(tmp_list)
-        json_episode_data_table.append({k: v for k, v in zip(headers, tmp_list)})
+    # networkx is imported on first use only
+    from qrt.util.graph import prepare_digraph, topologically_sorted_nodes, remove_self_loops, find_cycles
+    with stage('qml_details.graph'):
+        g = prepare_digraph(q)
+        g_cleaned = remove_self_loops(g)
+        topo_sorted_pages = topologically_sorted_nodes(g_cleaned)
+        cycles = find_cycles(g_cleaned)
+
+    with stage('qml_details.json_episode_data'):
+        json_data_dict = find_json_episode_data(q)
+
+    with stage('qml_details.unused_variables'):
+        all_aux_trig_var_impl = {var for var in flatten([v for v in json_data_dict['aux_var_impl'].values()])}
+        all_aux_trig_var_expl = {var for var in flatten([v for v in json_data_dict['aux_var_expl'].values()])}
+
+        all_aux_trig_var = all_aux_trig_var_impl.union(all_aux_trig_var_expl)
+
+        unused_variables = {k: v for k, v in q.vars_declared_not_used().items() if
+                            k not in all_aux_trig_var and not k.startswith('PRELOAD') and k != 'language'}
+
+    with stage('qml_details.json_episode_data'):
+        headers = ('page', *sorted(json_data_dict.keys()))
+        json_episode_data_table = [['page', *sorted(json_data_dict.keys())]]
+        for p in q.pages:
+            tmp_list = [p.uid]
+            for key in [*sorted(json_data_dict.keys())]:
+                if p.uid in json_data_dict[key]:
+                    tmp_list.append(json_data_dict[key][p.uid])
+                else:
+                    tmp_list.append(None)
+            assert len(headers) == len(tmp_list)
+            json_episode_data_table.append({k: v for k, v in zip(headers, tmp_list)})
 
     # manueller Input:
     # Liste aller Episoden-Pages
@@ -99,9 +106,10 @@ def qml_details(q: Questionnaire, filename: Optional[str] = None) -> Dict[str, D
 
     ### all_conditions = [p for p in q.pages]
 
-    variable_declarations_per_page = '\t<zofar:variables>\n'
-    variable_declarations_per_page += '\t\t' + '\n\t\t'.join(commented_var_declarations(q))
-    variable_declarations_per_page += '\n\t</zofar:variables>\n'
+    with stage('qml_details.var_declarations'):
+        variable_declarations_per_page = '\t<zofar:variables>\n'
+        variable_declarations_per_page += '\t\t' + '\n\t\t'.join(commented_var_declarations(q))
+        variable_declarations_per_page += '\n\t</zofar:variables>\n'
 
     details_dict = OrderedDict()
     if filename is not None:
@@ -109,9 +117,10 @@ def qml_details(q: Questionnaire, filename: Optional[str] = None) -> Dict[str, D
                                     'data': filename}
     details_dict['warnings'] = {'title': 'warnings',
                                 'data': warnings_list}
-    details_dict['inconsistent_vartypes'] = {'title': 'inconsistent variable types',
-                                             'description': 'variables that are being used as different types throughout the QML',
-                                             'data': q.vars_declared_used_inconsistent()}
+    with stage('qml_details.inconsistent_vartypes'):
+        details_dict['inconsistent_vartypes'] = {'title': 'inconsistent variable types',
+                                                 'description': 'variables that are being used as different types throughout the QML',
+                                                 'data': q.vars_declared_used_inconsistent()}
     details_dict['pages_order_declared'] = {'title': 'pages (in QML order)',
                                             'description': 'according to order within QML',
                                             'data': [p.uid for p in q.pages]}
@@ -120,47 +129,65 @@ def qml_details(q: Questionnaire, filename: Optional[str] = None) -> Dict[str, D
                                                'data': topo_sorted_pages if topo_sorted_pages != [] else '-> cycles found!'}
     details_dict['graph_cycles'] = {'title': 'graph cycles / "loops"',
                                     'data': cycles}
-    details_dict['triggers_json_reset'] = {'title': 'JSON reset triggers',
-                                           'data': find_json_episode_data(q)['triggers_json_reset']}
-    details_dict['triggers_json_load'] = {'title': 'JSON load triggers',
-                                          'data': find_json_episode_data(q)['triggers_json_load']}
-    details_dict['triggers_json_save'] = {'title': 'JSON save trigger',
-                                          'data': find_json_episode_data(q)['triggers_json_save']}
+    with stage('qml_details.triggers_json_reset'):
+        details_dict['triggers_json_reset'] = {'title': 'JSON reset triggers',
+                                               'data': find_json_episode_data(q)['triggers_json_reset']}
+    with stage('qml_details.triggers_json_load'):
+        details_dict['triggers_json_load'] = {'title': 'JSON load triggers',
+                                              'data': find_json_episode_data(q)['triggers_json_load']}
+    with stage('qml_details.triggers_json_save'):
+        details_dict['triggers_json_save'] = {'title': 'JSON save trigger',
+                                              'data': find_json_episode_data(q)['triggers_json_save']}
     details_dict['triggers_json_table'] = {'title': 'JSON episode table',
                                            'comment': '',
                                            'data': json_episode_data_table,
                                            'table': True}
-    details_dict['dead_end_pages'] = {'title': 'dead end pages',
-                                      'data': q.dead_end_pages()}
-    details_dict['page_questions'] = {'title': 'questions per page',
-                                      'data': q.all_page_questions_dict()}
-    details_dict['all_variables_used_per_page'] = {'title': 'variables per page',
-                                                   'data': q.body_vars_per_page_dict()}
-    details_dict['all_variables_declared'] = {'title': 'variables declared',
-                                              'data': q.all_vars_declared()}
+    with stage('qml_details.dead_end_pages'):
+        details_dict['dead_end_pages'] = {'title': 'dead end pages',
+                                          'data': q.dead_end_pages()}
+    with stage('qml_details.page_questions'):
+        details_dict['page_questions'] = {'title': 'questions per page',
+                                          'data': q.all_page_questions_dict()}
+    with stage('qml_details.all_variables_used_per_page'):
+        details_dict['all_variables_used_per_page'] = {'title': 'variables per page',
+                                                       'data': q.body_vars_per_page_dict()}
+    with stage('qml_details.all_variables_declared'):
+        details_dict['all_variables_declared'] = {'title': 'variables declared',
+                                                  'data': q.all_vars_declared()}
     details_dict['declared_but_unused_vars'] = {'title': 'variables declared but not used',
                                                 'data': unused_variables}
-    details_dict['used_but_undeclared_vars'] = {'title': 'variables used but not declared',
-                                                'data': q.vars_used_not_declared()}
+    with stage('qml_details.used_but_undeclared_vars'):
+        details_dict['used_but_undeclared_vars'] = {'title': 'variables used but not declared',
+                                                    'data': q.vars_used_not_declared()}
     # variable declarations
-    details_dict['used_but_undeclared_variables_declarations'] = {'title': 'declarations for missing variables',
-                                                                  'data': '\n'.join(sorted(generate_var_declarations(
-                                                                      q.vars_used_not_declared()))),
-                                                                  'raw': True}
-    details_dict['used_zofar_functions'] = {'title': 'zofar functions used',
-                                            'description': 'no description yet',
-                                            'data': all_zofar_functions(q)}
-    details_dict['all_variables_per_type'] = {'title': 'variables per type',
-                                              'description': 'variables sorted by type',
-                                              'data': all_vars_per_type(q)}
+    with stage('qml_details.used_but_undeclared_variables_declarations'):
+        details_dict['used_but_undeclared_variables_declarations'] = {'title': 'declarations for missing variables',
+                                                                      'data': '\n'.join(sorted(generate_var_declarations(
+                                                                          q.vars_used_not_declared()))),
+                                                                      'raw': True}
+    with stage('qml_details.used_zofar_functions'):
+        zofar_functions = zofar_function_usage(q)
+        details_dict['used_zofar_functions'] = {'title': 'zofar functions used',
+                                                'description': 'no description yet',
+                                                'data': all_zofar_functions(q, zofar_functions)}
+        details_dict['zofar_function_usage'] = {'title': 'zofar function usage',
+                                                'description': 'uses per page in condition, visible and command '
+                                                               'attributes',
+                                                'data': zofar_function_usage_table(zofar_functions),
+                                                'table': True}
+    with stage('qml_details.all_variables_per_type'):
+        details_dict['all_variables_per_type'] = {'title': 'variables per type',
+                                                  'description': 'variables sorted by type',
+                                                  'data': all_vars_per_type(q)}
     details_dict['all_var_declarations_commented_pages'] = {'title': 'all var declarations sorted per page',
                                                             'description': '',
                                                             'data': variable_declarations_per_page,
                                                             'raw': True}
 
-    used_varnames_per_page = {k: sorted(list({var.variable.name for var in v})) for k, v in
-                              q.body_vars_per_page_dict().items()}
-    saved_variables = find_json_episode_data(q)['triggers_json_save']
+    with stage('qml_details.vars_used_but_not_saved'):
+        used_varnames_per_page = {k: sorted(list({var.variable.name for var in v})) for k, v in
+                                  q.body_vars_per_page_dict().items()}
+        saved_variables = find_json_episode_data(q)['triggers_json_save']
     details_dict['vars_used_but_not_saved'] = {'title': 'all vars created on a page but not saved per json trigger',
                                                'description': '',
                                                'data': variable_declarations_per_page,
@@ -224,6 +251,12 @@ RE_ALL_ZOFAR_FUNCTIONS = {'zofar.asNumber()': RE_ZOFAR_FN_AS_NUMBER,
                           'zofar.isMissing()': RE_ZOFAR_FN_IS_MISSING,
                           '.value': RE_ZOFAR_FN_VALUE}
 
+# all of RE_ALL_ZOFAR_FUNCTIONS as one alternation (each with one group for the argument): group fn<i> is the i-th
+# function, the group following it its argument
+RE_ZOFAR_FUNCTIONS_COMBINED = re.compile('|'.join(f'(?P<fn{i}>{re_fn.pattern})'
+                                                  for i, re_fn in enumerate(RE_ALL_ZOFAR_FUNCTIONS.values())))
+ZOFAR_FUNCTION_GROUPS = {f'fn{i}': re_name for i, re_name in enumerate(RE_ALL_ZOFAR_FUNCTIONS.keys())}
+
 
 def all_vars_per_type(q: Questionnaire) -> Dict[str, List[str]]:
     results = defaultdict(list)
@@ -241,15 +274,47 @@ def extract_attribute_values(root: lEt, attr_name: str) -> List[str]:
     return results
 
 
-def all_zofar_functions(q: Questionnaire) -> Dict[str, List[str]]:
-    a_c = extract_attribute_values(q.xml_root, 'condition')
-    a_vc = extract_attribute_values(q.xml_root, 'visible')
-    a_si = extract_attribute_values(q.xml_root, 'command')
-
-    all_lists = a_c + a_vc + a_si
-    all_str = ' '.join(all_lists)
-
-    return {re_name: to_set_to_sorted_list(re_fn.findall(all_str)) for re_name, re_fn in RE_ALL_ZOFAR_FUNCTIONS.items()}
+def zofar_function_usage(q: Questionnaire) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """
+    Scans the condition, visible and command attributes of all pages (including the filtered ones) once.
+
+    :param q: questionnaire
+    :return: for each of RE_ALL_ZOFAR_FUNCTIONS: argument -> page uid -> number of uses
+    """
+    usage = {re_name: defaultdict(lambda: defaultdict(int)) for re_name in RE_ALL_ZOFAR_FUNCTIONS}
+    for p in q.pages_unmasked:
+        page_str = ' '.join(flatten([p.attribute_values.get(attr_name, ()) for attr_name in
+                                     ['condition', 'visible', 'command']]))
+        for match in RE_ZOFAR_FUNCTIONS_COMBINED.finditer(page_str):
+            usage[ZOFAR_FUNCTION_GROUPS[match.lastgroup]][match.group(match.lastindex + 1)][p.uid] += 1
+    return {re_name: {argument: dict(pages) for argument, pages in arguments.items()}
+            for re_name, arguments in usage.items()}
+
+
+def zofar_function_usage_table(usage: Dict[str, Dict[str, Dict[str, int]]]) -> List[Union[List[str], Dict[str, Any]]]:
+    """
+    :param usage: see zofar_function_usage
+    :return: header and one row per function and argument (for the details table)
+    """
+    headers = ['function', 'argument', 'count', 'pages']
+    rows = [headers]
+    for re_name, arguments in usage.items():
+        for argument, pages in sorted(arguments.items()):
+            rows.append({'function': re_name, 'argument': argument, 'count': sum(pages.values()),
+                         'pages': ', '.join(f'{uid} ({n})' if n > 1 else uid for uid, n in pages.items())})
+    return rows
+
+
+def all_zofar_functions(q: Questionnaire, usage: Optional[Dict[str, Dict[str, Dict[str, int]]]] = None) \
+        -> Dict[str, List[str]]:
+    """
+    :param q: questionnaire
+    :param usage: result of zofar_function_usage(q), if already available
+    :return: sorted arguments per zofar function
+    """
+    if usage is None:
+        usage = zofar_function_usage(q)
+    return {re_name: sorted(arguments) for re_name, arguments in usage.items()}
 
 
 def to_set_to_sorted_list(in_list: List[str]) -> List[str]:
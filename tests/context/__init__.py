@@ -18,24 +18,24 @@ MQSC_XML_STR_01 = """<zofar:matrixQuestionSingleChoice uid="mqsc" block="true">
       <zofar:title uid="ti3">lab3</zofar:title>
     </zofar:header>
     <zofar:missingHeader/>
-    <zofar:item uid="it1" visible="true">
+    <zofar:item uid="it1" visible="itvis1">
       <zofar:header>
         <zofar:question uid="q1" visible="true" block="true">itlab1</zofar:question>
       </zofar:header>
       <zofar:responseDomain variable="itvar01" itemClasses="true" uid="rd1">
-        <zofar:answerOption uid="ao1" label="lab1" visible="true" value="val1"/>
-        <zofar:answerOption uid="ao2" label="lab2" visible="true" value="val2"/>
-        <zofar:answerOption uid="ao3" label="lab3" visible="true" value="val3"/>
+        <zofar:answerOption uid="ao1" label="lab1" visible="vis1" value="val1"/>
+        <zofar:answerOption uid="ao2" label="lab2" visible="vis2" value="val2"/>
+        <zofar:answerOption uid="ao3" label="lab3" visible="vis3" value="val3"/>
       </zofar:responseDomain>
     </zofar:item>
-    <zofar:item uid="it2" visible="true">
+    <zofar:item uid="it2" visible="itvis2">
       <zofar:header>
         <zofar:question uid="q2" visible="true" block="true">itlab2</zofar:question>
       </zofar:header>
       <zofar:responseDomain variable="itvar02" itemClasses="true" uid="rd2">
-        <zofar:answerOption uid="ao1" label="lab1" visible="true" value="val1"/>
-        <zofar:answerOption uid="ao2" label="lab2" visible="true" value="val2"/>
-        <zofar:answerOption uid="ao3" label="lab3" visible="true" value="val3"/>
+        <zofar:answerOption uid="ao1" label="lab1" visible="vis1" value="val1"/>
+        <zofar:answerOption uid="ao2" label="lab2" visible="vis2" value="val2"/>
+        <zofar:answerOption uid="ao3" label="lab3" visible="vis3" value="val3"/>
       </zofar:responseDomain>
     </zofar:item>
   </zofar:responseDomain>
@@ -0,0 +1,36 @@
+import gzip
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from qform.artifacts import precompress_artifact, select_encoding, content_etag, encoded_etag
+
+
+class TestArtifacts(TestCase):
+    def setUp(self) -> None:
+        # setting up the temporary directory
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_precompress_artifact(self):
+        path = Path(self.tmp_dir.name, 'flowchart.svg')
+        data = b'<svg>' + b'<g/>' * 1000 + b'</svg>'
+        path.write_bytes(data)
+        etag = precompress_artifact(path)
+        self.assertEqual(content_etag(data), etag)
+
+        encoded_path, encoding = select_encoding(path, ['gzip'])
+        self.assertEqual('gzip', encoding)
+        self.assertEqual(data, gzip.decompress(encoded_path.read_bytes()))
+
+        encoded_path, encoding = select_encoding(path, [])
+        self.assertIsNone(encoding)
+        self.assertEqual(path, encoded_path)
+
+    def test_encoded_etag(self):
+        etag = content_etag(b'data')
+        self.assertEqual(etag, encoded_etag(etag, None))
+        self.assertEqual({etag, f'{etag}-gzip', f'{etag}-br'},
+                         {encoded_etag(etag, encoding) for encoding in [None, 'gzip', 'br']})
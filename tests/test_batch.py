@@ -0,0 +1,80 @@
+import json
+import multiprocessing
+import os
+import shutil
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from qrt.util import batch
+from qrt.util.batch import analyse_directory, file_sha256
+from tests.context import test_qml_path
+
+ANALYSE_FILE = batch.analyse_file
+
+
+def analyse_or_die(path, relative_path, sha256):
+    # the worker process is killed, like by the OOM killer
+    if path.name == 'huge.xml':
+        os._exit(9)
+    return ANALYSE_FILE(path, relative_path, sha256)
+
+
+class TestBatch(TestCase):
+    def setUp(self) -> None:
+        # setting up the temporary directory
+        self.tmp_dir = TemporaryDirectory()
+        self.archive = Path(self.tmp_dir.name, 'archive')
+        Path(self.archive, 'wave1').mkdir(parents=True)
+        Path(self.archive, 'wave2').mkdir()
+        shutil.copy(test_qml_path(), Path(self.archive, 'wave1', 'questionnaire.xml'))
+        Path(self.archive, 'wave2', 'broken.xml').write_text('<zofar:questionnaire', encoding='utf-8')
+        self.output = Path(self.tmp_dir.name, 'results.jsonl')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def results(self):
+        results = []
+        for line in self.output.read_text(encoding='utf-8').splitlines():
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+        return results
+
+    def test_analyse_directory(self):
+        counts = analyse_directory(self.archive, self.output, jobs=2)
+        self.assertEqual({'ok': 1, 'error': 1, 'skipped': 0}, counts)
+        results = {r['path']: r for r in self.results()}
+        self.assertEqual({'wave1/questionnaire.xml', 'wave2/broken.xml'}, set(results))
+        ok = results['wave1/questionnaire.xml']
+        self.assertEqual('ok', ok['status'])
+        self.assertEqual(file_sha256(test_qml_path()), ok['sha256'])
+        self.assertEqual('questionnaire.xml', ok['details']['filename']['data'])
+        self.assertIn('read_xml', ok['timings']['stages'])
+        self.assertTrue(results['wave2/broken.xml']['error'].startswith('ParseError'))
+
+    def test_resume(self):
+        analyse_directory(self.archive, self.output)
+        # a new file and a line cut off by an interruption
+        shutil.copy(test_qml_path(), Path(self.archive, 'wave2', 'copy.xml'))
+        Path(self.archive, 'wave2', 'changed.xml').write_text(
+            Path(test_qml_path()).read_text(encoding='utf-8').replace('A01', 'B01'), encoding='utf-8')
+        with open(self.output, 'a', encoding='utf-8') as f:
+            f.write('{"path": "wave2/chan')
+        counts = analyse_directory(self.archive, self.output)
+        # copy.xml has the content of an analysed file
+        self.assertEqual({'ok': 1, 'error': 0, 'skipped': 3}, counts)
+        self.assertEqual('wave2/changed.xml', self.results()[-1]['path'])
+
+    def test_worker_died(self):
+        if multiprocessing.get_start_method() != 'fork':
+            self.skipTest('the patched function is only inherited by forked worker processes')
+        Path(self.archive, 'wave2', 'huge.xml').write_text('<huge/>', encoding='utf-8')
+        with mock.patch('qrt.util.batch.analyse_file', analyse_or_die):
+            counts = analyse_directory(self.archive, self.output, jobs=2)
+        results = {r['path']: r for r in self.results()}
+        self.assertEqual({'ok': 1, 'error': 2, 'skipped': 0}, counts)
+        self.assertTrue(results['wave2/huge.xml']['error'].startswith('BrokenProcessPool'))
+        self.assertEqual('ok', results['wave1/questionnaire.xml']['status'])
@@ -0,0 +1,54 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from qrt.util.catalog import build_catalog, VariableCatalog, wave_labels
+from qrt.util.qml import read_xml
+from tests.context import test_qml_path
+
+
+class TestCatalog(TestCase):
+    def setUp(self) -> None:
+        # setting up the temporary directory
+        self.tmp_dir = TemporaryDirectory()
+        # second wave: url is removed, width is retyped, url2 is added
+        xml = Path(test_qml_path()).read_text(encoding='utf-8')
+        xml = xml.replace('<zofar:variable name="url" type="string"/>', '<zofar:variable name="url2" type="string"/>')
+        xml = xml.replace('<zofar:variable name="width" type="number"/>', '<zofar:variable name="width" type="string"/>')
+        wave2_path = Path(self.tmp_dir.name, 'wave2.xml')
+        wave2_path.write_text(xml, encoding='utf-8')
+        self.q1 = read_xml(test_qml_path())
+        self.catalog = build_catalog({'wave1': self.q1, 'wave2': read_xml(wave2_path)})
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_diff(self):
+        self.assertEqual({'added': ['url2'], 'removed': ['url'], 'retyped': {'width': ('number', 'string')}},
+                         self.catalog.diff('wave1', 'wave2'))
+        self.assertEqual(['wave1', 'wave2'], self.catalog.waves_present()['width'])
+        self.assertEqual(['wave1'], self.catalog.waves_present()['url'])
+        with self.assertRaises(KeyError):
+            self.catalog.added('wave1', 'wave3')
+
+    def test_questionnaire_queries(self):
+        self.assertEqual(sorted(self.q1.vars_declared_not_used()), self.catalog.declared_not_used('wave1'))
+        self.assertEqual(sorted(self.q1.vars_used_not_declared()), self.catalog.used_not_declared('wave1'))
+        rows = {row['name']: row for row in self.catalog.rows('wave1')}
+        self.assertEqual({'wave': 'wave1', 'name': 'comment01', 'declared_type': '', 'used_type': 'string',
+                          'question_type': 'questionOpen', 'pages': 'A01'}, rows['comment01'])
+
+    def test_save_load(self):
+        path = Path(self.tmp_dir.name, 'catalog.npz')
+        self.catalog.save(path)
+        catalog = VariableCatalog.load(path)
+        self.assertEqual(self.catalog.rows(), catalog.rows())
+        self.assertEqual(self.catalog.diff('wave1', 'wave2'), catalog.diff('wave1', 'wave2'))
+
+    def test_wave_labels(self):
+        self.assertEqual(['w1', 'w2'], wave_labels([Path('a', 'w1.xml'), Path('a', 'w2.xml')]))
+        self.assertEqual(['wave1/questionnaire', 'wave2/questionnaire'],
+                         wave_labels([Path('archive', 'wave1', 'questionnaire.xml'),
+                                      Path('archive', 'wave2', 'questionnaire.xml')]))
+        with self.assertRaises(ValueError):
+            wave_labels([Path('w1.xml'), Path('.', 'w1.xml')])
@@ -0,0 +1,160 @@
+import importlib.util
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+import lxml.etree
+import networkx as nx
+
+from qrt.util.graph import make_flowchart, digraph, select_layout_engine, collapse_uid_prefixes, \
+    LAYOUT_DOT_MAX_NODES, LAYOUT_DOT_FAST_MAX_NODES, layered_layout, graph_data, available_layout_engines
+from qrt.util.graphcache import LayoutCache, graph_fingerprint
+from tests.context import test_questionnaire
+
+
+class TestLayoutCache(TestCase):
+    def setUp(self) -> None:
+        # setting up the temporary directory
+        self.tmp_dir = TemporaryDirectory()
+        self.q = test_questionnaire()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_graph_fingerprint(self):
+        g1 = digraph(self.q, show_var=True, show_cond=True)
+        g2 = digraph(self.q, show_var=True, show_cond=True)
+        g3 = digraph(self.q, show_var=False, show_cond=True)
+        self.assertEqual(graph_fingerprint(g1), graph_fingerprint(g2))
+        self.assertNotEqual(graph_fingerprint(g1), graph_fingerprint(g3))
+        self.assertNotEqual(graph_fingerprint(g1), graph_fingerprint(g1, engine='sfdp'))
+
+    def test_make_flowchart_cached(self):
+        cache = LayoutCache(Path(self.tmp_dir.name, 'cache'))
+        out_file1 = Path(self.tmp_dir.name, 'flowchart1.svg')
+        out_file2 = Path(self.tmp_dir.name, 'flowchart2.svg')
+        make_flowchart(self.q, out_file=out_file1, cache=cache)
+        self.assertEqual(1, len(cache.entries()))
+
+        with mock.patch('networkx.nx_agraph.to_agraph', side_effect=AssertionError('layout not cached')):
+            make_flowchart(self.q, out_file=out_file2, cache=cache)
+        self.assertEqual(out_file1.read_bytes(), out_file2.read_bytes())
+
+    def test_eviction(self):
+        cache = LayoutCache(Path(self.tmp_dir.name, 'cache'), max_bytes=250)
+        src = Path(self.tmp_dir.name, 'src.svg')
+        src.write_bytes(b'x' * 100)
+        for i, key in enumerate(['a', 'b', 'c']):
+            entry = cache.put(key, 'svg', src)
+            os.utime(entry, (1000 * (i + 1), 1000 * (i + 1)))
+        self.assertIsNone(cache.get('a', 'svg'))
+        self.assertIsNotNone(cache.get('c', 'svg'))
+        self.assertLessEqual(cache.size(), 250)
+
+    def test_copy_evicted_entry(self):
+        cache = LayoutCache(Path(self.tmp_dir.name, 'cache'))
+        src = Path(self.tmp_dir.name, 'src.svg')
+        src.write_bytes(b'<svg/>')
+        entry = cache.put('a', 'svg', src)
+        target = Path(self.tmp_dir.name, 'target.svg')
+        self.assertTrue(cache.copy_to('a', 'svg', target))
+        self.assertEqual(b'<svg/>', target.read_bytes())
+        # evicted by another process
+        entry.unlink()
+        self.assertFalse(cache.copy_to('a', 'svg', target))
+
+
+class TestLayoutEngine(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.q = test_questionnaire()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_select_layout_engine(self):
+        self.assertEqual('dot', select_layout_engine(digraph(self.q)))
+        g = nx.DiGraph()
+        g.add_edges_from([(f'p{i}', f'p{i + 1}') for i in range(LAYOUT_DOT_MAX_NODES + 1)])
+        self.assertEqual('dot-fast', select_layout_engine(g))
+        g.add_edges_from([(f'p{i}', f'p{i + 1}') for i in range(LAYOUT_DOT_FAST_MAX_NODES + 1)])
+        self.assertEqual('sfdp', select_layout_engine(g))
+
+    def test_collapse_uid_prefixes(self):
+        g = nx.DiGraph()
+        g.add_edges_from([('index', 'A01'), ('A01', 'A02'), ('A02', 'B01'), ('A01', 'B02'), ('B02', 'end')])
+        c = collapse_uid_prefixes(g)
+        self.assertEqual({'index', 'A', 'B', 'end'}, set(c.nodes))
+        self.assertEqual({('index', 'A'), ('A', 'B'), ('B', 'end')}, set(c.edges))
+        self.assertEqual('2', c.edges['A', 'B']['label'])
+        # a page that is the only one with its prefix keeps its uid (and attributes)
+        g.add_node('C01', label='C01', fillcolor='red')
+        g.add_edges_from([('B01', 'C01'), ('C01', 'end')])
+        c = collapse_uid_prefixes(g)
+        self.assertEqual({'index', 'A', 'B', 'C01', 'end'}, set(c.nodes))
+        self.assertEqual({('index', 'A'), ('A', 'B'), ('B', 'C01'), ('C01', 'end'), ('B', 'end')}, set(c.edges))
+        self.assertEqual({'label': 'C01', 'fillcolor': 'red'}, c.nodes['C01'])
+
+    def test_make_flowchart_engines(self):
+        for engine in ['dot-fast', 'sfdp']:
+            out_file = Path(self.tmp_dir.name, f'flowchart_{engine}.svg')
+            make_flowchart(self.q, out_file=out_file, engine=engine, collapse_prefixes=True)
+            self.assertTrue(out_file.exists())
+        with self.assertRaises(ValueError):
+            make_flowchart(self.q, out_file=Path(self.tmp_dir.name, 'x.svg'), engine='neato-fast')
+
+
+class TestLayeredLayout(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.q = test_questionnaire()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_layered_layout(self):
+        g = nx.DiGraph()
+        g.add_edges_from([('index', 'A01'), ('A01', 'A02'), ('A02', 'A01'), ('A01', 'A03'), ('A02', 'A03'),
+                          ('A03', 'A03'), ('index', 'A03')])
+        boxes, routes = layered_layout(g)
+        self.assertEqual(set(g.nodes), set(boxes.keys()))
+        self.assertEqual(set(g.edges), {(u, v) for u, v, _ in routes})
+        # layers are ordered top to bottom along the (acyclic part of the) graph
+        self.assertLess(boxes['index'][1], boxes['A01'][1])
+        self.assertLess(boxes['A01'][1], boxes['A02'][1])
+        self.assertLess(boxes['A02'][1], boxes['A03'][1])
+
+    def test_make_flowchart_without_pygraphviz(self):
+        out_file = Path(self.tmp_dir.name, 'flowchart.svg')
+        find_spec = importlib.util.find_spec
+        with mock.patch('importlib.util.find_spec',
+                        side_effect=lambda name, *args: None if name == 'pygraphviz' else find_spec(name, *args)), \
+                mock.patch('networkx.nx_agraph.to_agraph', side_effect=ModuleNotFoundError('pygraphviz')):
+            make_flowchart(self.q, out_file=out_file, show_var=True, show_cond=True)
+        svg = lxml.etree.parse(str(out_file)).getroot()
+        titles = {t.text for t in svg.iterfind('.//{http://www.w3.org/2000/svg}g[@class="node"]/'
+                                               '{http://www.w3.org/2000/svg}title')}
+        self.assertEqual(len(digraph(self.q).nodes), len(titles))
+
+    def test_explicit_engine_without_pygraphviz(self):
+        out_file = Path(self.tmp_dir.name, 'flowchart.svg')
+        find_spec = importlib.util.find_spec
+        with mock.patch('importlib.util.find_spec',
+                        side_effect=lambda name, *args: None if name == 'pygraphviz' else find_spec(name, *args)):
+            self.assertEqual(['layered'], available_layout_engines())
+            with self.assertRaises(ValueError):
+                make_flowchart(self.q, out_file=out_file, engine='dot')
+
+
+class TestGraphData(TestCase):
+    def test_graph_data(self):
+        q = test_questionnaire()
+        data = graph_data(q)
+        g = digraph(q, show_var=False)
+        self.assertEqual(set(g.nodes), {n['id'] for n in data['nodes']})
+        self.assertEqual(set(g.edges), {(e['source'], e['target']) for e in data['edges']})
+        vars_d = {n['id']: n.get('vars', []) for n in data['nodes']}
+        for p in q.pages:
+            for var_ref in p.body_vars:
+                self.assertIn(var_ref.variable.name, vars_d[p.uid])
@@ -0,0 +1,97 @@
+import threading
+import time
+from dataclasses import astuple
+from unittest import TestCase, mock
+
+import qform.hash
+from qform.hash import hash_salt_password, verify_password, verify_password_offloaded, parse_hash, VerifierBusy, \
+    COST_PROFILES, cost_profile, needs_rehash, rehash_if_needed, benchmark, pending_verifications, VerifySlots
+
+
+class TestHash(TestCase):
+    def setUp(self) -> None:
+        # cheap parameters, the defaults take hundreds of ms
+        self.pw_hash = hash_salt_password('pass', n=1024, r=8, p=1)
+
+    def test_verify_password(self):
+        self.assertTrue(verify_password('pass', self.pw_hash))
+        self.assertFalse(verify_password('wrong', self.pw_hash))
+        params = parse_hash(self.pw_hash)
+        self.assertEqual((1024, 8, 1), (params.n, params.r, params.p))
+        self.assertIs(params, parse_hash(self.pw_hash))
+        with self.assertRaises(ValueError):
+            parse_hash('$s9$' + self.pw_hash[4:])
+
+    def test_verify_password_offloaded(self):
+        count = qform.hash.VERIFICATION_STATS.summary()['count']
+        self.assertTrue(verify_password_offloaded('pass', self.pw_hash))
+        self.assertFalse(verify_password_offloaded('wrong', self.pw_hash))
+        self.assertEqual(count + 2, qform.hash.VERIFICATION_STATS.summary()['count'])
+
+    def test_verifier_busy(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking_verify(*args):
+            started.set()
+            release.wait(10)
+            return True
+
+        with mock.patch('qform.hash._VERIFY_SLOTS', VerifySlots(1)), \
+                mock.patch('qform.hash.verify_password', side_effect=blocking_verify):
+            results = []
+            t = threading.Thread(target=lambda: results.append(verify_password_offloaded('pass', self.pw_hash)))
+            t.start()
+            started.wait(10)
+            self.assertEqual(1, pending_verifications())
+            with self.assertRaises(VerifierBusy):
+                verify_password_offloaded('pass', self.pw_hash)
+            release.set()
+            t.join()
+        self.assertEqual([True], results)
+
+    def test_verify_timeout(self):
+        release = threading.Event()
+        with mock.patch('qform.hash._VERIFY_SLOTS', VerifySlots(1)), \
+                mock.patch('qform.hash.verify_password', side_effect=lambda *args: release.wait(10)):
+            with self.assertRaises(VerifierBusy):
+                verify_password_offloaded('pass', self.pw_hash, timeout=0.01)
+            # the slot is released when the verification is done
+            self.assertEqual(1, pending_verifications())
+            release.set()
+            deadline = time.monotonic() + 10
+            while pending_verifications() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(0, pending_verifications())
+
+
+class TestCostProfiles(TestCase):
+    def test_cost_profile(self):
+        self.assertEqual(COST_PROFILES['interactive'], cost_profile('interactive'))
+        self.assertEqual((1024, 8, 2), astuple(cost_profile('1024,8,2'))[1:])
+        with mock.patch.dict('os.environ', {'FLASK_PW_PROFILE': 'strong'}):
+            self.assertEqual(COST_PROFILES['strong'], cost_profile())
+        for spec in ['fastest', '1000,8,1', '1024,8']:
+            with self.assertRaises(ValueError):
+                cost_profile(spec)
+
+    def test_rehash(self):
+        old_profile = cost_profile('1024,8,1')
+        new_profile = cost_profile('2048,8,1')
+        pw_hash = hash_salt_password('pass', profile=old_profile)
+        self.assertFalse(needs_rehash(pw_hash, old_profile))
+        self.assertTrue(needs_rehash(pw_hash, new_profile))
+        self.assertIsNone(rehash_if_needed('pass', pw_hash, old_profile))
+
+        new_hash = rehash_if_needed('pass', pw_hash, new_profile)
+        self.assertEqual((2048, 8, 1), astuple(parse_hash(new_hash))[1:4])
+        self.assertTrue(verify_password('pass', new_hash))
+        # rehashing takes a slot of the verification executor
+        with mock.patch('qform.hash._VERIFY_SLOTS', VerifySlots(0)):
+            with self.assertRaises(VerifierBusy):
+                rehash_if_needed('pass', pw_hash, new_profile)
+
+    def test_benchmark(self):
+        profile, ms, measurements = benchmark(target_ms=1, max_mem_mb=1, repeat=1)
+        self.assertLessEqual(profile.memory(), 2 ** 20)
+        self.assertTrue(measurements)
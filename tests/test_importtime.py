@@ -0,0 +1,54 @@
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict
+from unittest import TestCase
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# modules that must only be imported on first use (flowcharts, module graphs)
+HEAVY_MODULES = ['networkx', 'pygraphviz', 'numpy', 'matplotlib']
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """
+    :param module: module to be imported in a fresh interpreter
+    :return: cumulative import time in microseconds per imported module (python -X importtime)
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestImportTime(TestCase):
+    def assert_no_heavy_imports(self, module: str):
+        times = import_times(module)
+        self.assertIn(module, times)
+        heavy = [name for name in times if name.split('.')[0] in HEAVY_MODULES]
+        self.assertEqual([], heavy, f'{module} imports heavy modules at startup')
+
+    def test_qform_startup(self):
+        self.assert_no_heavy_imports('qform.qform')
+
+    def test_util_startup(self):
+        self.assert_no_heavy_imports('qrt.util.util')
+        self.assert_no_heavy_imports('qrt.util.qmlgen')
+
+    def test_module_graph_without_numpy(self):
+        times = import_times('qrt.util.module_graph')
+        self.assertFalse([name for name in times if name.split('.')[0] in ['numpy', 'matplotlib']])
+
+
+if __name__ == '__main__':
+    # startup benchmark: python tests/test_importtime.py [module]
+    module_name = sys.argv[1] if len(sys.argv) > 1 else 'qform.qform'
+    module_times = import_times(module_name)
+    print(f'{module_name}: {module_times[module_name] / 1000:.1f} ms')
+    for name, us in sorted(module_times.items(), key=lambda x: -x[1])[1:21]:
+        print(f'{us / 1000:8.1f} ms  {name}')
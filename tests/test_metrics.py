@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from qform.metrics import MetricsRegistry, SnapshotWriter, gauge_snapshot, merge_snapshots, read_snapshots, render, \
+    process_id, ACCUMULATED_FILE
+
+
+class TestMetrics(TestCase):
+    def setUp(self) -> None:
+        # setting up the temporary directory
+        self.tmp_dir = TemporaryDirectory()
+        self.registry = MetricsRegistry()
+        self.requests = self.registry.counter('requests_total', 'requests', ['route'])
+        self.latency = self.registry.histogram('latency_seconds', 'latency', ['route'], buckets=[0.1, 1.0])
+        self.in_progress = self.registry.gauge('in_progress', 'requests "in progress"')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_render(self):
+        self.requests.inc(route='/api/upload')
+        self.requests.inc(2, route='/api/upload')
+        for seconds in [0.05, 0.5, 5.0]:
+            self.latency.observe(seconds, route='/api/upload')
+        self.in_progress.inc()
+        snapshot = self.registry.snapshot()
+        snapshot['files'] = gauge_snapshot('files\nregistered', 4)
+        self.assertEqual('# HELP files files\\nregistered\n'
+                         '# TYPE files gauge\n'
+                         'files 4\n'
+                         '# HELP in_progress requests "in progress"\n'
+                         '# TYPE in_progress gauge\n'
+                         'in_progress 1\n'
+                         '# HELP latency_seconds latency\n'
+                         '# TYPE latency_seconds histogram\n'
+                         'latency_seconds_bucket{route="/api/upload",le="0.1"} 1\n'
+                         'latency_seconds_bucket{route="/api/upload",le="1"} 2\n'
+                         'latency_seconds_bucket{route="/api/upload",le="+Inf"} 3\n'
+                         'latency_seconds_sum{route="/api/upload"} 5.55\n'
+                         'latency_seconds_count{route="/api/upload"} 3\n'
+                         '# HELP requests_total requests\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{route="/api/upload"} 3\n', render(snapshot))
+
+        with self.assertRaises(ValueError):
+            self.requests.inc(route='/api/upload', method='GET')
+        with self.assertRaises(ValueError):
+            self.requests.inc(-1, route='/api/upload')
+
+    def test_merge_snapshots(self):
+        self.requests.inc(route='/a')
+        self.latency.observe(0.5, route='/a')
+        self.in_progress.set(2)
+        first = self.registry.snapshot()
+        self.requests.inc(route='/b')
+        merged = merge_snapshots([first, self.registry.snapshot()])
+        self.assertEqual([[['/a'], 2.0], [['/b'], 1.0]], merged['requests_total']['samples'])
+        self.assertEqual([0, 2, 0], merged['latency_seconds']['samples'][0][1]['counts'])
+        self.assertEqual([[[], 4.0]], merged['in_progress']['samples'])
+
+    def test_snapshot_files(self):
+        directory = Path(self.tmp_dir.name, 'metrics')
+        self.requests.inc(route='/a')
+        self.in_progress.set(1)
+        SnapshotWriter(self.registry).write(directory)
+        own_snapshot = Path(directory, f'{process_id()}.json')
+        self.assertTrue(own_snapshot.exists())
+        # snapshots of exited worker processes (one with the pid of this process, started earlier): counters are
+        #  kept, gauges are dropped
+        Path(directory, '999999999-1.json').write_text(own_snapshot.read_text())
+        Path(directory, f'{os.getpid()}-0.json').write_text(own_snapshot.read_text())
+        merged = merge_snapshots(read_snapshots(directory))
+        self.assertEqual([[['/a'], 3.0]], merged['requests_total']['samples'])
+        self.assertEqual([[[], 1.0]], merged['in_progress']['samples'])
+        # the exited workers are folded into one file
+        self.assertEqual(sorted([ACCUMULATED_FILE, own_snapshot.name]),
+                         sorted(p.name for p in directory.glob('*.json')))
+
+        Path(directory, '999999999-2.json').write_text(own_snapshot.read_text())
+        self.requests.inc(route='/a')
+        SnapshotWriter(self.registry).write(directory)
+        merged = merge_snapshots(read_snapshots(directory))
+        self.assertEqual([[['/a'], 5.0]], merged['requests_total']['samples'])
@@ -0,0 +1,45 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from qrt.util.qml import read_xml
+from qrt.util.util import extract_attribute_values
+from tests.context import test_qml_path
+
+
+class TestReadXml(TestCase):
+    def setUp(self) -> None:
+        # setting up the temporary directory
+        self.tmp_dir = TemporaryDirectory()
+        self.xml_str = Path(test_qml_path()).read_text(encoding='utf-8')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_read_xml_incremental(self):
+        q1 = read_xml(test_qml_path())
+        self.assertEqual([p.uid for p in q1.pages], q1.changed_pages)
+
+        edited_path = Path(self.tmp_dir.name, 'questionnaire.xml')
+        edited_path.write_text(self.xml_str.replace('<zofar:transition target="A01"/>',
+                                                    '<zofar:transition target="A02"/>', 1), encoding='utf-8')
+        q2 = read_xml(edited_path, previous=q1)
+
+        self.assertEqual(['offer'], q2.changed_pages)
+        self.assertEqual([p.uid for p in q1.pages], [p.uid for p in q2.pages])
+        for p1, p2 in zip(q1.pages, q2.pages):
+            if p1.uid == 'offer':
+                self.assertIsNot(p1, p2)
+                self.assertEqual(['A02'], [t.target_uid for t in p2.transitions])
+            else:
+                self.assertIs(p1, p2)
+
+    def test_attribute_values(self):
+        q = read_xml(test_qml_path())
+        # the document is read again from the file on demand
+        xml_root = q.xml_root
+        self.assertTrue(q.attribute_values('visible'))
+        for attr_name in ['condition', 'visible', 'command']:
+            values = extract_attribute_values(xml_root, attr_name)
+            self.assertEqual(values, [v for p in q.pages_unmasked for v in p.attribute_values[attr_name]])
+            self.assertEqual(sorted(values), sorted(q.attribute_values(attr_name)))
@@ -1,6 +1,10 @@
-from unittest import TestCase
-from qrt.util.qmlgen import gen_mqsc, gen_qsc
-from qrt.util.qmlutil import NS
+import json
+from unittest import TestCase, mock
+import lxml.etree
+
+from qrt.util.qmlgen import gen_mqsc, gen_qsc, gen_batch, gen_mc, gen_mqmc, gen_qo, gen_questionnaire, build_mqmc, \
+    normalize_spec, serialize_question, serialize_questions, build_questions
+from qrt.util.qmlutil import NS, ZOFAR_NS_URI, ZOFAR_PAGE_TAG, ZOFAR_TRANSITION_TAG, ZOFAR_BODY_TAG, ZOFAR_VARIABLE_TAG, DISPLAY_NS_URI
 from context import QSC_XML_STR_01, MQSC_XML_STR_01, QSC_XML_STR_02
 
 HEADERS = {1: {'uid': 'q1', 'type': 'question', 'text': 'qtext1', 'visible': 'qvis1'},
@@ -35,3 +39,140 @@ class Test(TestCase):
              'aos': SC_AOS}
         q_str = gen_qsc(d)
         self.assertEqual(QSC_XML_STR_02, q_str)
+
+
+MQSC_SPEC = {'q_type': 'mqsc', 'q_uid': 'mqsc', 'q_visible': 'mqscvisible',
+             'headers': HEADERS,
+             'aos': SC_AOS,
+             'items': {1: {'uid': 'it1', 'variable': 'itvar01', 'text': 'itlab1', 'visible': 'itvis1'},
+                       2: {'uid': 'it2', 'variable': 'itvar02', 'text': 'itlab2', 'visible': 'itvis2'}}}
+MC_SPEC = {'q_type': 'mc', 'q_uid': 'mc',
+           'headers': HEADERS,
+           'aos': {1: {'uid': 'ao1', 'label': 'lab1', 'variable': 'mcvar1'},
+                   2: {'uid': 'ao2', 'label': 'lab2', 'variable': 'mcvar2', 'exclusive': 'on',
+                       'attached_open': {1: {'uid': 'open1', 'variable': 'mcvar2o'}}}}}
+MQMC_SPEC = {'q_type': 'mqmc', 'q_uid': 'mqmc',
+             'headers': HEADERS,
+             'aos': {1: {'uid': 'ao1', 'label': 'lab1'}, 2: {'uid': 'ao2', 'label': 'lab2'}},
+             'items': {1: {'uid': 'it1', 'variable': 'mqmc1', 'text': 'itlab1'},
+                       2: {'uid': 'it2', 'variables': {1: 'x1', 2: 'x2'}, 'text': 'itlab2'}}}
+QO_SPEC = {'q_type': 'qo', 'q_uid': 'qo', 'q_variable': 'qovar', 'headers': HEADERS, 'postfix': 'Euro'}
+
+
+class TestBatch(TestCase):
+    def test_gen_batch(self):
+        specs = [MQSC_SPEC, MC_SPEC, MQMC_SPEC, QO_SPEC] * 3
+        # JSON round trip: str keys
+        json_specs = json.loads(json.dumps(specs))
+        xml_strs = list(gen_batch(json_specs))
+        self.assertEqual(MQSC_XML_STR_01, xml_strs[0])
+        self.assertEqual([gen_mqsc(MQSC_SPEC), gen_mc(MC_SPEC), gen_mqmc(MQMC_SPEC), gen_qo(QO_SPEC)] * 3, xml_strs)
+
+    def test_gen_mqmc(self):
+        root = lxml.etree.fromstring(gen_mqmc(MQMC_SPEC).replace('<zofar:', '<').replace('</zofar:', '</'))
+        self.assertEqual(['mqmc1a', 'mqmc1b', 'x1', 'x2'], [ao.get('variable') for ao in root.iter('answerOption')])
+
+    def test_serialize_mutated_question(self):
+        question = build_questions([MC_SPEC])[0]
+        xml_strs = serialize_questions(iter([question, build_questions([MC_SPEC])[0]]))
+        first = next(xml_strs)
+        # changed by the caller after its XML was generated: the cache entry of the original content is kept
+        question.response_domain.ao_list[0].label = 'changed'
+        with mock.patch('qrt.util.qmlgen.serialize_question', side_effect=AssertionError('not cached')):
+            self.assertEqual(first, next(xml_strs))
+        self.assertIn('changed', next(serialize_questions([question])))
+
+    def test_gen_batch_invalid(self):
+        with self.assertRaises(ValueError):
+            list(gen_batch([MQSC_SPEC, {'q_type': 'xyz'}]))
+        with self.assertRaises(ValueError):
+            list(gen_batch([{k: v for k, v in MC_SPEC.items() if k != 'aos'}]))
+
+
+class TestMatrix(TestCase):
+    def test_mqsc_visible(self):
+        xml_str = next(gen_batch(json.loads(json.dumps([MQSC_SPEC]))))
+        root = lxml.etree.fromstring(xml_str.replace('zofar:', ''))
+        items = root.find('responseDomain').findall('item')
+        self.assertEqual(['itvis1', 'itvis2'], [it.get('visible') for it in items])
+        self.assertEqual(['vis1', 'vis2', 'vis3'], [ao.get('visible') for ao in items[0].iter('answerOption')])
+
+    def test_mqmc_missing_titles(self):
+        spec = normalize_spec({**MQMC_SPEC, 'aos': [{'uid': 'ao1', 'label': 'lab1'},
+                                                    {'uid': 'ao2', 'label': 'lab2', 'missing': 'on'},
+                                                    {'uid': 'ao3', 'label': 'lab3'}],
+                                      'items': [MQMC_SPEC['items'][1],
+                                                {**MQMC_SPEC['items'][2], 'variables': ['x1', 'x2', 'x3']}]})
+        root = lxml.etree.fromstring(serialize_question(build_mqmc(spec)).replace('zofar:', ''))
+        rd = root.find('responseDomain')
+        self.assertEqual(['ti1', 'ti3'], [ti.get('uid') for ti in rd.find('header')])
+        self.assertEqual(['ti2'], [ti.get('uid') for ti in rd.find('missingHeader')])
+        self.assertEqual('3', rd.get('noResponseOptions'))
+        # answer option elements are copied from templates, with the variable of each item
+        self.assertEqual(['mqmc1a', 'mqmc1b', 'mqmc1c', 'x1', 'x2', 'x3'],
+                         [ao.get('variable') for ao in rd.iter('answerOption')])
+        self.assertEqual(['ao1', 'ao2', 'ao3'] * 2, [ao.get('uid') for ao in rd.iter('answerOption')])
+
+    def test_mqmc_missing_json(self):
+        # JSON specs mark missing answer options with true
+        spec = normalize_spec({**MQMC_SPEC, 'q_visible': 'mqmcvisible',
+                               'aos': [{'uid': 'ao1', 'label': 'lab1'}, {'uid': 'ao2', 'label': 'lab2', 'missing': True}],
+                               'items': [MQMC_SPEC['items'][1]]})
+        root = lxml.etree.fromstring(serialize_question(build_mqmc(spec)).replace('zofar:', ''))
+        rd = root.find('responseDomain')
+        self.assertEqual(['ti1'], [ti.get('uid') for ti in rd.find('header')])
+        self.assertEqual(['ti2'], [ti.get('uid') for ti in rd.find('missingHeader')])
+        self.assertEqual('mqmcvisible', root.get('visible'))
+
+    def test_mc_visible(self):
+        root = lxml.etree.fromstring(gen_mc({**MC_SPEC, 'q_visible': 'mcvisible'}).replace('zofar:', ''))
+        self.assertEqual('mcvisible', root.get('visible'))
+        root = lxml.etree.fromstring(gen_mc(MC_SPEC).replace('zofar:', ''))
+        self.assertEqual('true', root.get('visible'))
+
+    def test_normalize_spec_copies(self):
+        spec = json.loads(json.dumps(MC_SPEC))
+        normalize_spec(spec)
+        self.assertEqual(json.loads(json.dumps(MC_SPEC)), spec)
+
+    def test_items_with_different_answer_options(self):
+        question = build_mqmc(normalize_spec(MQMC_SPEC))
+        question.response_domain.item_list[1].response_domain.ao_list[0].label = 'other'
+        with self.assertRaises(AssertionError):
+            question.gen_xml()
+
+
+def canonical(el: lxml.etree._Element) -> bytes:
+    parser = lxml.etree.XMLParser(remove_blank_text=True)
+    return lxml.etree.tostring(lxml.etree.fromstring(lxml.etree.tostring(el), parser), method='c14n')
+
+
+class TestQuestionnaire(TestCase):
+    SPEC = {'name': 'gen', 'pages': [{'uid': 'A01', 'questions': [MQSC_SPEC, MC_SPEC]},
+                                     {'uid': 'A02', 'questions': [MQMC_SPEC, QO_SPEC]},
+                                     {'uid': 'end'}]}
+
+    def test_gen_questionnaire(self):
+        chunks = list(gen_questionnaire(json.loads(json.dumps(self.SPEC))))
+        # streamed page by page
+        self.assertGreaterEqual(len(chunks), 3)
+        xml_bytes = b''.join(chunks)
+        self.assertEqual(1, xml_bytes.count(b'xmlns:zofar='))
+        root = lxml.etree.fromstring(xml_bytes)
+        self.assertEqual(['A01', 'A02', 'end'], [page.get('uid') for page in root.iter(ZOFAR_PAGE_TAG)])
+        self.assertEqual(['A02', 'end'], [t.get('target') for t in root.iter(ZOFAR_TRANSITION_TAG)])
+        questions = [q for body in root.iter(ZOFAR_BODY_TAG) for q in body]
+        for question, xml_str in zip(questions, [gen_mqsc(MQSC_SPEC), gen_mc(MC_SPEC), gen_mqmc(MQMC_SPEC),
+                                                 gen_qo(QO_SPEC)]):
+            fragment = lxml.etree.fromstring(f'<zofar:r xmlns:zofar="{ZOFAR_NS_URI}" xmlns:display="{DISPLAY_NS_URI}">'
+                                             f'{xml_str}</zofar:r>')[0]
+            self.assertEqual(canonical(fragment), canonical(question))
+        declared = [v.get('name') for v in root.iter(ZOFAR_VARIABLE_TAG)]
+        self.assertEqual(len(set(declared)), len(declared))
+        self.assertIn('itvar01', declared)
+
+    def test_gen_questionnaire_invalid(self):
+        with self.assertRaises(ValueError):
+            gen_questionnaire({'pages': [{'questions': [MQSC_SPEC]}]})
+        with self.assertRaises(ValueError):
+            gen_questionnaire({'pages': [{'uid': 'A01', 'questions': [{'q_type': 'xyz'}]}]})
@@ -534,3 +534,39 @@ class TestQuestionnaire(TestCase):
         z = unescape_html(y.replace('xmlns:zofar="http://www.his.de/zofar/xml/questionnaire" ', ''))
 
         pass
+
+
+class TestStructuralEquality(TestCase):
+    @staticmethod
+    def matrix(label: str = 'lab1') -> ZofarQuestionSCMatrix:
+        ao_list = [SCAnswerOption(uid='ao1', value='1', label=label), SCAnswerOption(uid='ao2', value='2', label='lab2')]
+        items = [SCMatrixItem(uid=f'it{i}', header_list=[HeaderQuestion(uid=f'q{i}', content=f'item {i}')],
+                              response_domain=SCResponseDomain(uid=f'rd{i}', ao_list=ao_list,
+                                                               var_ref=VarRef(variable=Variable(name=f'v{i}',
+                                                                                                type=VAR_TYPE_SC))))
+                 for i in range(3)]
+        return ZofarQuestionSCMatrix(uid='mqsc', header_list=[], title_header=[], missing_header=[],
+                                     response_domain=MatrixResponseDomain(no_response_options='2', item_list=items))
+
+    def test_equality_and_hash(self):
+        self.assertEqual(self.matrix(), self.matrix())
+        self.assertEqual(hash(self.matrix()), hash(self.matrix()))
+        self.assertNotEqual(self.matrix(), self.matrix(label='other'))
+        self.assertNotEqual(VarRef(variable=Variable(name='v', type=VAR_TYPE_SC)),
+                            VarRef(variable=Variable(name='v', type=VAR_TYPE_STR)))
+        # same fields, different types
+        self.assertNotEqual(HeaderQuestion(uid='q', content='x'), HeaderInstruction(uid='q', content='x'))
+
+    def test_frozen(self):
+        q = self.matrix()
+        frozen = q.frozen()
+        self.assertIsNot(q, frozen)
+        self.assertEqual(q, frozen)
+        self.assertEqual(hash(q), hash(frozen))
+        self.assertEqual(l_tostring(q.gen_xml()), l_tostring(frozen.gen_xml()))
+        with self.assertRaises(AttributeError):
+            frozen.uid = 'other'
+        with self.assertRaises(AttributeError):
+            frozen.response_domain.item_list[0].uid = 'other'
+        # frozen objects as keys, e.g. for deduplication
+        self.assertEqual(2, len({frozen, self.matrix().frozen(), self.matrix(label='other').frozen()}))
@@ -0,0 +1,67 @@
+import threading
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from qform.registry import FileRegistry
+
+
+class TestFileRegistry(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        # two instances on the same directory, as used by two worker processes
+        self.registry1 = FileRegistry(Path(self.tmp_dir.name, 'registry'))
+        self.registry2 = FileRegistry(Path(self.tmp_dir.name, 'registry'))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_shared_entries(self):
+        self.registry1['abc'] = {'file_id': 'abc', 'filename': 'test.xml', 'session_uid': 'uid1'}
+        self.registry1['def'] = {'file_id': 'def', 'filename': 'test2.xml', 'session_uid': 'uid1'}
+        self.assertEqual(['abc', 'def'], list(self.registry2))
+        self.assertEqual('test.xml', self.registry2['abc']['filename'])
+
+        # updates are written through
+        self.registry1['abc']['flowchart'] = ['a.svg', 'b.svg']
+        self.assertEqual(['a.svg', 'b.svg'], self.registry2['abc']['flowchart'])
+        self.registry2['abc'].pop('flowchart')
+        self.assertNotIn('flowchart', self.registry1['abc'])
+
+        self.registry2.pop('def')
+        self.assertNotIn('def', self.registry1)
+        with self.assertRaises(KeyError):
+            self.registry1['def']
+
+    def test_local_keys(self):
+        self.registry1['abc'] = {'file_id': 'abc', 'session_uid': 'uid1'}
+        self.registry1['abc']['questionnaire'] = object()
+        self.assertIn('questionnaire', self.registry1['abc'])
+        self.assertNotIn('questionnaire', self.registry2['abc'])
+        self.assertEqual({'file_id': 'abc', 'session_uid': 'uid1'}, dict(self.registry2['abc']))
+
+        self.registry2.pop('abc')
+        self.assertEqual([], list(self.registry1))
+        self.assertEqual({}, self.registry1._local)
+
+    def test_concurrent_writes(self):
+        # threads of one worker process writing the same key
+        self.registry1['abc'] = {'file_id': 'abc', 'session_uid': 'uid1'}
+        errors = []
+
+        def write(n: int):
+            try:
+                for i in range(50):
+                    self.registry1['abc']['flowchart'] = [n, i]
+            except OSError as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], errors)
+        self.assertEqual(49, self.registry2['abc']['flowchart'][1])
+        self.assertEqual(['.created', 'file_id.json', 'flowchart.json', 'session_uid.json'],
+                         sorted(p.name for p in self.registry1.entry_dir('abc').iterdir()))
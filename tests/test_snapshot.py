@@ -0,0 +1,63 @@
+import dataclasses
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from qrt.util.qml import read_xml, Questionnaire
+from qrt.util.questionnaire import ZofarJumper
+from qrt.util.snapshot import dumps, loads, read_snapshot, write_snapshot, SnapshotError, HEADER
+from qrt.util.util import qml_details
+from tests.context import test_qml_path
+
+
+class TestSnapshot(TestCase):
+    def setUp(self) -> None:
+        # setting up the temporary directory
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        q = read_xml(test_qml_path())
+        path = Path(self.tmp_dir.name, 'questionnaire.snapshot')
+        size = write_snapshot(q, path)
+        self.assertEqual(path.stat().st_size, size)
+        q2 = read_snapshot(path)
+
+        self.assertIsInstance(q2, Questionnaire)
+        self.assertEqual(q.source_path, q2.source_path)
+        self.assertEqual(q.var_declarations, q2.var_declarations)
+        self.assertEqual([p.uid for p in q.pages], [p.uid for p in q2.pages])
+        for p1, p2 in zip(q.pages, q2.pages):
+            for f in dataclasses.fields(p1):
+                if f.name != 'source_element':
+                    self.assertEqual(getattr(p1, f.name), getattr(p2, f.name))
+        # pages are shared between pages and pages_unmasked
+        self.assertTrue(all(p1 is p2 for p1, p2 in zip(q2.pages, q2.pages_unmasked)))
+        self.assertEqual(qml_details(q, 'questionnaire.xml'), qml_details(q2, 'questionnaire.xml'))
+
+    def test_values(self):
+        jumper = ZofarJumper(target='A01', value=None).freeze()
+        value = {'a': [1, -2 ** 40, 0.5, True, None, ('x', 'ä')], 'jumpers': [jumper, jumper]}
+        restored = loads(dumps(value))
+        self.assertEqual(value, restored)
+        self.assertIs(restored['jumpers'][0], restored['jumpers'][1])
+        self.assertTrue(restored['jumpers'][0]._frozen)
+
+        with self.assertRaises(TypeError):
+            dumps({'a': object()})
+
+    def test_invalid(self):
+        data = dumps(read_xml(test_qml_path()))
+        for invalid in [b'', data[:3], b'XXXX' + data[4:], data[:len(data) // 2], data[:-4]]:
+            with self.assertRaises(SnapshotError):
+                loads(invalid)
+        magic, version, flags, n_strings, n_tokens = HEADER.unpack_from(data)
+        with self.assertRaises(SnapshotError):
+            loads(HEADER.pack(magic, version + 1, flags, n_strings, n_tokens) + data[HEADER.size:])
+        # snapshot of a value that is not a questionnaire
+        path = Path(self.tmp_dir.name, 'list.snapshot')
+        path.write_bytes(dumps([1, 2]))
+        with self.assertRaises(SnapshotError):
+            read_snapshot(path)
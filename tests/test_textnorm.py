@@ -0,0 +1,50 @@
+import tempfile
+from collections import Counter
+from pathlib import Path
+from unittest import TestCase
+
+import lxml.etree
+
+from qrt.util.textnorm import unescape_html, unescape_numeric, normalize_chunks, normalize_file
+
+TEXT = ('<zofar:question uid="q1">F&uuml;r &#8222;Sie&#8220;: Gr&ouml;&szlig;e &amp; Gewicht &lt; 5 &#228;&#xe4;'
+        ' &unknown; &;</zofar:question>\n')
+
+
+class TestTextNorm(TestCase):
+    def test_unescape_html(self):
+        counts = Counter()
+        self.assertEqual('<zofar:question uid="q1">Für &#8222;Sie&#8220;: Größe &amp; Gewicht &lt; 5 ää'
+                         ' &unknown; &;</zofar:question>\n', unescape_html(TEXT, counts))
+        self.assertEqual({'&uuml;': 1, '&ouml;': 1, '&szlig;': 1, '&#228;': 1, '&#xe4;': 1}, counts)
+
+    def test_unescape_numeric(self):
+        self.assertEqual('&uuml; „ä &amp;', unescape_numeric('&uuml; &#8222;&#228; &amp;'))
+
+    def test_chunks(self):
+        text = TEXT * 20
+        for chunk_size in range(1, 12):
+            chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+            self.assertEqual(unescape_html(text), ''.join(normalize_chunks(chunks)))
+            self.assertEqual(unescape_numeric(text), ''.join(normalize_chunks(chunks, numeric=True)))
+
+    def test_normalize_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir, 'questionnaire.xml')
+            path.write_text(TEXT * 3, encoding='utf-8')
+            counts = normalize_file(path)
+            self.assertEqual(unescape_html(TEXT * 3), path.read_text(encoding='utf-8'))
+            self.assertEqual(3, counts['&uuml;'])
+            self.assertEqual(['questionnaire.xml'], [p.name for p in Path(tmp_dir).iterdir()])
+
+    def test_markup_references(self):
+        xml = '<a b="x &quot;y&quot; &#60; z &#x27;&apos;">&#38; &#62; &#34; &#39; &#228;</a>'
+        for numeric in [False, True]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = Path(tmp_dir, 'questionnaire.xml')
+                path.write_text(xml, encoding='utf-8')
+                normalize_file(path, numeric=numeric)
+                self.assertEqual(xml.replace('&#228;', 'ä'), path.read_text(encoding='utf-8'))
+                root = lxml.etree.parse(str(path)).getroot()
+                self.assertEqual('x "y" < z \'\'', root.get('b'))
+                self.assertEqual('& > " \' ä', root.text)
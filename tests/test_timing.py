@@ -0,0 +1,93 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from qrt.util import memprofile
+from qrt.util.graph import make_flowchart
+from qrt.util.qml import read_xml
+from qrt.util.timing import recording, stage, count, timed, RECORDER, TimingRecorder
+from qrt.util.util import qml_details
+from tests.context import test_qml_path
+
+
+class TestTiming(TestCase):
+    def setUp(self) -> None:
+        # setting up the temporary directory
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_recording(self):
+        @timed('outer')
+        def outer():
+            with stage('inner'):
+                count('items', 3)
+
+        # without a recorder, nothing is recorded
+        outer()
+        self.assertIsNone(RECORDER.get())
+
+        with recording() as recorder:
+            outer()
+            outer()
+        self.assertIsNone(RECORDER.get())
+        summary = recorder.summary()
+        self.assertEqual({'outer', 'inner'}, set(summary['stages']))
+        self.assertEqual(2, summary['stages']['inner']['calls'])
+        self.assertGreaterEqual(summary['stages']['outer']['seconds'], summary['stages']['inner']['seconds'])
+        self.assertEqual({'items': 6}, summary['counters'])
+
+    def test_pipeline_stages(self):
+        with recording() as recorder:
+            q = read_xml(test_qml_path())
+            qml_details(q)
+            make_flowchart(q, Path(self.tmp_dir.name, 'flowchart.svg'), engine='layered')
+        summary = recorder.summary()
+        for name in ['read_xml.parse', 'read_xml.vars_used', 'read_xml.triggers', 'qml_details.graph',
+                     'qml_details.used_zofar_functions', 'flowchart.graph', 'flowchart.layout', 'flowchart.draw']:
+            self.assertIn(name, summary['stages'])
+        self.assertEqual(len(q.pages), summary['stages']['read_xml.vars_used']['calls'])
+        self.assertEqual(len(q.pages), summary['counters']['read_xml.pages_read'])
+
+        with recording() as recorder:
+            read_xml(test_qml_path(), previous=q)
+        self.assertEqual({'read_xml.pages_reused': len(q.pages)}, recorder.summary()['counters'])
+
+    def test_memory(self):
+        def allocate(n):
+            return [str(i) * 10 for i in range(n)]
+
+        memprofile.start()
+        try:
+            with recording(TimingRecorder(trace_memory=True)) as recorder:
+                with stage('outer'):
+                    with stage('temporary'):
+                        allocate(100000)
+                    with stage('retained'):
+                        kept = allocate(1000)
+                with stage('read_xml'):
+                    q = read_xml(test_qml_path())
+            top_allocations = memprofile.top_allocations(limit=5)
+        finally:
+            memprofile.stop()
+        stages = recorder.summary()['stages']
+        self.assertGreater(stages['temporary']['peak_bytes'], 50 * stages['retained']['peak_bytes'])
+        self.assertLess(stages['temporary']['retained_bytes'], stages['retained']['retained_bytes'])
+        # the peak of a nested stage is part of the peak of the enclosing stage
+        self.assertGreaterEqual(stages['outer']['peak_bytes'], stages['temporary']['peak_bytes'])
+        self.assertGreaterEqual(stages['outer']['retained_bytes'], stages['retained']['retained_bytes'])
+        self.assertIn('peak_bytes', stages['read_xml.parse'])
+        self.assertEqual(5, len(top_allocations))
+        # the questionnaire is retained
+        self.assertGreater(stages['read_xml']['retained_bytes'], 0)
+        self.assertTrue(q.pages)
+        self.assertEqual(1000, len(kept))
+
+        # without tracing, memory is not recorded
+        with recording(TimingRecorder(trace_memory=True)) as recorder:
+            allocate(10)
+            with stage('outer'):
+                pass
+        self.assertEqual({'seconds', 'calls'}, set(recorder.summary()['stages']['outer']))
+        self.assertEqual([], memprofile.top_allocations())
@@ -1,9 +1,68 @@
+import io
+import tempfile
+from pathlib import Path
 from unittest import TestCase
+
+from lxml import etree
+
 from context import pv01_str
-from qrt.util.tomlutil import read_pv
+from qrt.util.qml import read_xml
+from qrt.util.tomlutil import read_pv, compile_pv
+
+
+def pv_many_questions(n: int, per_page: int = 8) -> str:
+    # n copies of the matrix question Q001 of pv01, per_page questions per page
+    q001 = pv01_str[pv01_str.index('[Q001]'):pv01_str.index('[Q002]')]
+    return 'survey = "many"\n' + ''.join(
+        q001.replace('[Q001]', f'[Q{i:04}]').replace('page = "A01"', f'page = "P{i // per_page:03}"')
+        .replace('var0', f'v{i}_') for i in range(n))
 
 
 class Test(TestCase):
     def test_read_pv(self):
         pv = read_pv(pv01_str)
-        pass
+        self.assertEqual(['A01', 'A02'], [p.uid for p in pv.pages])
+        self.assertEqual(['Q001'], [q.uid for q in pv.pages[0].body_questions])
+        self.assertEqual([], pv.pages[1].body_questions)
+        self.assertEqual({'var01a', 'var01b', 'var01c', 'var02'}, set(pv.var_declarations))
+        self.assertEqual('string', pv.var_declarations['var02'].type)
+        # monthpicker questions (Q002, Q003) cannot be generated yet
+        self.assertEqual(2, len(pv.warnings))
+        self.assertEqual(['A02'], [t.target_uid for t in pv.pages[0].transitions])
+
+    def test_compile_pv(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_path = Path(tmp_dir, 'questionnaire.xml')
+            compile_pv(pv01_str, xml_path)
+            xml_str = xml_path.read_text(encoding='utf-8')
+            # the namespace is declared once, on the root element
+            self.assertEqual(1, xml_str.count('xmlns:zofar='))
+            q = read_xml(xml_path)
+            root = etree.parse(str(xml_path)).getroot()
+        items = {it.get('uid'): it for it in root.iter('{*}item')}
+        self.assertEqual('var00.value', items['it2'].get('visible'))
+        self.assertEqual('true', items['it1'].get('visible'))
+        self.assertEqual(['zofar.asNumber(var01) != 2'] * 3,
+                         [ao.get('visible') for ao in root.iter('{*}answerOption') if ao.get('uid') == 'ao4'])
+        self.assertEqual(['A01', 'A02'], [p.uid for p in q.pages])
+        self.assertEqual({'var01a', 'var01b', 'var01c', 'var02'}, set(q.var_declarations))
+        self.assertEqual(set(), set(q.vars_used_not_declared()))
+
+    def test_compile_many_questions(self):
+        pv_str = pv_many_questions(800)
+        out = io.BytesIO()
+        # the compile time is measured in benchmarks/test_benchmarks.py
+        compile_pv(pv_str, out)
+        root = etree.fromstring(out.getvalue())
+        self.assertEqual(100, len(root.findall('{*}page')))
+        self.assertEqual(3200, len(root.find('{*}variables')))
+
+    def test_attached_open_prefix(self):
+        pv_str = pv01_str.replace('prefix = { }, postfix = { }', 'prefix = "vor", postfix = { }')
+        out = io.BytesIO()
+        compile_pv(pv_str, out)
+        root = etree.fromstring(out.getvalue())
+        att_open = root.find('.//{*}attachedOpen')
+        self.assertEqual('var02', att_open.get('variable'))
+        self.assertEqual(['vor'], [label.text for label in att_open.iterfind('{*}prefix/{*}label')])
+        self.assertIsNone(att_open.find('{*}postfix'))
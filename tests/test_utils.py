@@ -1,6 +1,7 @@
 from unittest import TestCase
 from tests.context import test_qml_path, test_questionnaire
-from qrt.util.util import qml_details, all_zofar_functions
+from qrt.util.util import qml_details, all_zofar_functions, zofar_function_usage, extract_attribute_values, \
+    RE_ALL_ZOFAR_FUNCTIONS
 from qrt.util.qml import Questionnaire
 
 
@@ -28,3 +29,17 @@ class TestUtils(TestCase):
     def test_all_zofar_functions(self):
         all_fn = all_zofar_functions(self.q)
         assert True
+
+    def test_zofar_function_usage(self):
+        q = test_questionnaire()
+        usage = zofar_function_usage(q)
+        xml_root = q.xml_root
+        all_str = ' '.join([v for attr_name in ['condition', 'visible', 'command'] for v in
+                            extract_attribute_values(xml_root, attr_name)])
+        # same matches as the separate regular expressions
+        for re_name, re_fn in RE_ALL_ZOFAR_FUNCTIONS.items():
+            matches = re_fn.findall(all_str)
+            self.assertEqual(sorted(set(matches)), all_zofar_functions(q, usage)[re_name])
+            self.assertEqual(len(matches), sum(n for pages in usage[re_name].values() for n in pages.values()))
+        self.assertEqual({'A01': 1}, usage['zofar.asNumber()']['testvar'])
+        self.assertEqual({'var02': {'A01': 3}}, usage['zofar.isMissing()'])